@@ -22,12 +22,19 @@ def handle_start(args: Any, logconfig_dict: dict[str, Any]) -> None:
 
     if os.getenv('WERKZEUG_RUN_MAIN') != 'true':  # skip if reloading
         db.migrate()
-        scanner.scan_background()
         cleanup.cleanup()
 
     if args.dev:
         log.info('Starting Flask web server in debug mode')
         app = app_main.get_app(proxy_count=args.proxy_count, template_reload=True, profiler=args.profiler)
+        if os.getenv('WERKZEUG_RUN_MAIN') == 'true':  # only in the reloaded process serving requests
+            scanner.scan_background()
+            if args.watch:
+                from raphson_mp import watcher
+                watcher.start()
+            if args.lyrics_warm:
+                from raphson_mp import lyrics_warm
+                lyrics_warm.start_background()
         app.run(host=args.host, port=args.port, debug=True)
         return
 
@@ -40,7 +47,7 @@ def handle_start(args: Any, logconfig_dict: dict[str, Any]) -> None:
 
     log.info('Starting gunicorn web server')
     bind = f'[{args.host}]:{args.port}'
-    gapp = gunicorn_app.GunicornApp(bind, args.proxy_count, logconfig_dict)
+    gapp = gunicorn_app.GunicornApp(bind, args.proxy_count, logconfig_dict, args.watch, args.lyrics_warm)
     gapp.run()
 
 
@@ -152,13 +159,13 @@ def handle_playlist(args: Any) -> None:
         log.info('Given user %s access to playlist %s', args.username, args.playlist_path)
 
 
-def handle_scan(_args: Any) -> None:
+def handle_scan(args: Any) -> None:
     """
     Handle command to scan playlists
     """
     from raphson_mp import scanner
 
-    scanner.scan()
+    scanner.scan(full=args.full)
 
 
 def handle_cleanup(_args: Any) -> None:
@@ -253,6 +260,15 @@ def handle_lyrics(args: Any) -> None:
         raise ValueError(lyrics)
 
 
+def handle_lyrics_warm(args: Any) -> None:
+    """
+    Handle command to find lyrics for all tracks
+    """
+    from raphson_mp import lyrics_warm
+
+    lyrics_warm.warm(split_by_comma(args.playlists) if args.playlists else None)
+
+
 def handle_bing(args: Any) -> None:
     from raphson_mp import bing
 
@@ -261,6 +277,27 @@ def handle_bing(args: Any) -> None:
     log.info('saved to bing_result file')
 
 
+def handle_probe_benchmark(args: Any) -> None:
+    import time
+
+    from raphson_mp import music  # import before metadata to prevent import loop
+    from raphson_mp import metadata
+
+    paths = list(music.list_tracks_recursively(Path(args.path)))[:args.limit]
+    log.info('Probing %s files', len(paths))
+
+    results: dict[str, list[metadata.Metadata | None]] = {}
+    for backend in metadata.PROBE_BACKENDS:
+        start_time = time.perf_counter()
+        results[backend] = [metadata.probe(path, backend) for path in paths]
+        duration = time.perf_counter() - start_time
+        log.info('%s: %.1f files/s', backend, len(paths) / duration)
+
+    for path, meta_tagreader, meta_ffprobe in zip(paths, results['tagreader'], results['ffprobe']):
+        if meta_tagreader != meta_ffprobe:
+            log.warning('Different result for %s:\ntagreader: %s\nffprobe:   %s', path, meta_tagreader, meta_ffprobe)
+
+
 def _strenv(name: str, default: str | None = None) -> str | None:
     return os.getenv('MUSIC_' + name, default)
 
@@ -309,6 +346,10 @@ def main():
     parser.add_argument('--radio-playlists',
                         default=_strenv('RADIO_PLAYLISTS'),
                         help='comma-separated list of playlists to use for radio')
+    parser.add_argument('--radio-lookahead',
+                        type=int,
+                        default=_intenv('RADIO_LOOKAHEAD'),
+                        help='number of radio tracks to choose and prepare ahead of time')
     parser.add_argument('--lastfm-api-key',
                         default=_strenv('LASTFM_API_KEY'))
     parser.add_argument('--lastfm-api-secret',
@@ -324,6 +365,21 @@ def main():
     parser.add_argument('--news-server',
                         help='news server url: https://github.com/Derkades/news-scraper',
                         default=_strenv('NEWS_SERVER'))
+    parser.add_argument('--scanner-workers',
+                        type=int,
+                        default=_intenv('SCANNER_WORKERS'),
+                        help='number of files to read metadata from simultaneously when scanning')
+    parser.add_argument('--probe-backend',
+                        default=_strenv('PROBE_BACKEND'),
+                        choices=('tagreader', 'ffprobe'),
+                        help='method for reading metadata from music files. The built-in tag reader is faster and falls back to ffprobe for unsupported files.')
+    parser.add_argument('--lyrics-deadline-seconds',
+                        type=int,
+                        default=_intenv('LYRICS_DEADLINE_SECONDS'),
+                        help='maximum time to wait for lyrics providers, the best lyrics found so far are used after this time')
+    parser.add_argument('--lyrics-preference',
+                        default=_strenv('LYRICS_PREFERENCE'),
+                        help='comma-separated list of lyrics providers, in order of preference. Time-synced lyrics are always preferred over plain lyrics.')
 
     subparsers = parser.add_subparsers(required=True)
 
@@ -333,6 +389,10 @@ def main():
     cmd_start.add_argument('--dev', action='store_true')
     cmd_start.add_argument('--proxy-count', type=int, default=_intenv('PROXY_COUNT', _intenv('PROXIES_X_FORWARDED_FOR', 0)))
     cmd_start.add_argument('--profiler', action='store_true', help='enable performance profiler')
+    cmd_start.add_argument('--watch', action='store_true', default=_boolenv('WATCH'),
+                           help='watch music directory for changes (Linux only)')
+    cmd_start.add_argument('--lyrics-warm', action='store_true', default=_boolenv('LYRICS_WARM'),
+                           help='periodically find lyrics for all tracks in the background')
     cmd_start.set_defaults(func=handle_start)
 
     cmd_useradd = subparsers.add_parser('useradd', help='create new user')
@@ -363,12 +423,20 @@ def main():
 
     cmd_scan = subparsers.add_parser('scan',
                                      help='scan playlists for changes')
+    cmd_scan.add_argument('--full', action='store_true',
+                          help='check all files, also in directories that have not changed since the previous scan')
     cmd_scan.set_defaults(func=handle_scan)
 
     cmd_cleanup = subparsers.add_parser('cleanup',
                                         help='clean old or unused data from the database')
     cmd_cleanup.set_defaults(func=handle_cleanup)
 
+    cmd_lyrics_warm = subparsers.add_parser('lyrics-warm',
+                                            help='find lyrics for tracks ahead of time, so they are cached')
+    cmd_lyrics_warm.add_argument('--playlists', type=str,
+                                 help='comma-separated list of playlists, all playlists by default')
+    cmd_lyrics_warm.set_defaults(func=handle_lyrics_warm)
+
     cmd_migrate = subparsers.add_parser('migrate',
                                        help='run database migrations')
     cmd_migrate.set_defaults(func=handle_migrate)
@@ -403,6 +471,12 @@ def main():
     cmd_cover.add_argument('--duration', type=int)
     cmd_cover.set_defaults(func=handle_lyrics)
 
+    cmd_cover = subparsers.add_parser('debug-probe-benchmark',
+                                      help='Compare speed and results of metadata probe backends')
+    cmd_cover.add_argument('path')
+    cmd_cover.add_argument('--limit', type=int, default=1000)
+    cmd_cover.set_defaults(func=handle_probe_benchmark)
+
     cmd_cover = subparsers.add_parser('debug-bing')
     cmd_cover.add_argument('query')
     cmd_cover.set_defaults(func=handle_bing)
@@ -416,6 +490,11 @@ def main():
     if args.track_max_duration_seconds:
         settings.track_max_duration_seconds = args.track_max_duration_seconds
     settings.radio_playlists = split_by_comma(args.radio_playlists)
+    if args.radio_lookahead is not None:
+        # The radio needs at least the next track to be scheduled
+        if args.radio_lookahead < 1:
+            parser.error('--radio-lookahead (MUSIC_RADIO_LOOKAHEAD) must be at least 1')
+        settings.radio_lookahead = args.radio_lookahead
     settings.lastfm_api_key = args.lastfm_api_key
     settings.lastfm_api_secret = args.lastfm_api_secret
     settings.spotify_api_id = args.spotify_api_id
@@ -423,6 +502,13 @@ def main():
     settings.offline_mode = args.offline
     if args.news_server:
         settings.news_server = args.news_server
+    if args.scanner_workers:
+        settings.scanner_workers = args.scanner_workers
+    if args.probe_backend:
+        settings.probe_backend = args.probe_backend
+    if args.lyrics_deadline_seconds:
+        settings.lyrics_deadline_seconds = args.lyrics_deadline_seconds
+    settings.lyrics_preference = split_by_comma(args.lyrics_preference)
 
     if settings.offline_mode:
         settings.music_dir = Path('/dev/null')
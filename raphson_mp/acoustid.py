@@ -4,9 +4,7 @@ from collections.abc import Iterator
 from dataclasses import dataclass
 from pathlib import Path
 
-import requests
-
-from raphson_mp import settings
+from raphson_mp import httpclient, settings
 
 if settings.offline_mode:
     # Module must not be imported to ensure no data is ever downloaded in offline mode.
@@ -18,6 +16,9 @@ log = logging.getLogger(__name__)
 
 API_KEY = 'rTTqI4IrbJ'
 
+# https://acoustid.org/webservice: no more than 3 requests per second
+_client = httpclient.Client('acoustid', 'https://api.acoustid.org/v2/', rate_limit=3)
+
 
 @dataclass
 class Fingerprint:
@@ -29,13 +30,12 @@ def lookup(fingerprint: Fingerprint) -> Iterator[str]:
     """
     Returns: musicbrainz recording id
     """
-    response = requests.get('https://api.acoustid.org/v2/lookup',
-                            params={'format': 'json',
-                                    'client': API_KEY,
-                                    'duration': fingerprint.duration,
-                                    'fingerprint': fingerprint.fingerprint_b64,
-                                    'meta': 'recordingids'},
-                            headers={'User-Agent': settings.user_agent})
+    response = _client.get('lookup',
+                           params={'format': 'json',
+                                   'client': API_KEY,
+                                   'duration': fingerprint.duration,
+                                   'fingerprint': fingerprint.fingerprint_b64,
+                                   'meta': 'recordingids'})
     response.raise_for_status()
     json = response.json()
 
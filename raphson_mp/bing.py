@@ -2,13 +2,14 @@ import json
 import logging
 import traceback
 from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from html.parser import HTMLParser
-from multiprocessing.pool import ThreadPool
+from threading import Event
 from typing import cast, override
 
 import requests
 
-from raphson_mp import settings
+from raphson_mp import cache, httpclient, settings
 
 log = logging.getLogger(__name__)
 
@@ -18,95 +19,140 @@ if settings.offline_mode:
     raise RuntimeError('Cannot use bing in offline mode')
 
 
-def _download(image_url: str) -> bytes | None:
+_client = httpclient.Client('bing', 'https://www.bing.com/', user_agent=settings.webscraping_user_agent)
+# Images are downloaded from the websites found by bing
+_download_client = httpclient.Client('bing-download', retries=0, pool_hosts=20, circuit_breaker=False)
+_download_executor = ThreadPoolExecutor(max_workers=5, thread_name_prefix='bing-download')
+
+# Larger images are not used, a cover is never displayed this large
+MAX_IMAGE_BYTES = 10*1024*1024
+
+
+def _download(image_url: str, cancelled: Event) -> bytes | None:
     """
     Download image by URL
     Args:
         image_url
-    Returns: Image bytes, or None if the image failed to download
+        cancelled: When set, the download is stopped
+    Returns: Image bytes, or None if the image failed to download, is too large or the download
+             was cancelled
     """
+    if cancelled.is_set():
+        return None
+
     try:
-        resp = requests.get(image_url,
-                            timeout=10,
-                            headers={'User-Agent': settings.user_agent})
-        if resp.status_code != 200:
-            log.info('Could not download %s, status code %s', image_url, resp.status_code)
-            return None
+        with _download_client.get(image_url, stream=True) as resp:
+            if resp.status_code != 200:
+                log.info('Could not download %s, status code %s', image_url, resp.status_code)
+                return None
+
+            content_length = resp.headers.get('Content-Length')
+            if content_length is not None and content_length.isdigit() and int(content_length) > MAX_IMAGE_BYTES:
+                log.info('Not downloading %s, image is too large', image_url)
+                return None
+
+            chunks: list[bytes] = []
+            size = 0
+            for chunk in resp.iter_content(64*1024):
+                if cancelled.is_set():
+                    return None
+                size += len(chunk)
+                if size > MAX_IMAGE_BYTES:
+                    log.info('Stopped downloading %s, image is too large', image_url)
+                    return None
+                chunks.append(chunk)
     except requests.exceptions.RequestException:
         log.info('Could not download %s, connection error', image_url)
         return None
 
-    img_bytes = resp.content
-
     log.info('Downloaded image: %s', image_url)
 
-    return img_bytes
+    return b''.join(chunks)
 
 
 def _download_all(image_urls: list[str]) -> Iterator[bytes]:
     """
-    Download multiple images, returning the image of the largest size first (probably the
-    highest quality image)
+    Download multiple images at the same time, returning images as soon as they are downloaded.
+    Remaining downloads are cancelled when the caller stops iterating.
     """
-    def _sort_key(download: bytes) -> int:
-        return len(download)
-
-    with ThreadPool(5) as pool:
-        maybe_downloads = pool.map(_download, image_urls)
-
-    # Remove failed downloads
-    downloads = [d for d in maybe_downloads if d is not None]
-
-    yield from sorted(downloads, key=_sort_key)
+    cancelled = Event()
+    futures = [_download_executor.submit(_download, image_url, cancelled) for image_url in image_urls]
+    try:
+        for future in as_completed(futures):
+            image_bytes = future.result()
+            if image_bytes is not None:
+                yield image_bytes
+    finally:
+        cancelled.set()
+        for future in futures:
+            future.cancel()
 
 
-def image_search(bing_query: str) -> Iterator[bytes]:
+def _search(bing_query: str) -> list[str]:
     """
-    Perform image search using Bing
-    Parameters:
-        bing_query: Search query
-    Returns: Image data bytes
+    Returns: URLs of images found by Bing
     """
     log.info('Searching bing: %s', bing_query)
-    try:
-        r = requests.get('https://www.bing.com/images/search',
-                         timeout=10,
-                         headers={'User-Agent': settings.webscraping_user_agent},
-                         params={'q': bing_query,
-                                 'form': 'HDRSC2',
-                                 'first': '1',
-                                 'scenario': 'ImageBasicHover'},
-                         cookies={'SRCHHPGUSR': 'ADLT=OFF'})  # disable safe search :-)
+    r = _client.get('images/search',
+                    params={'q': bing_query,
+                            'form': 'HDRSC2',
+                            'first': '1',
+                            'scenario': 'ImageBasicHover'},
+                    cookies={'SRCHHPGUSR': 'ADLT=OFF'})  # disable safe search :-)
 
-        r.raise_for_status()
+    r.raise_for_status()
 
-        class Parser(HTMLParser):
-            image_urls: list[str] = []
+    class Parser(HTMLParser):
+        image_urls: list[str] = []
 
-            @override
-            def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]):
-                if tag != 'a':
-                    return
+        @override
+        def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]):
+            if tag != 'a':
+                return
 
-                attrs_dict = dict(attrs)
+            attrs_dict = dict(attrs)
 
-                if 'class' not in attrs_dict:
-                    return
+            if 'class' not in attrs_dict:
+                return
 
-                if attrs_dict['class'] != 'iusc':
-                    return
+            if attrs_dict['class'] != 'iusc':
+                return
 
-                if 'm' not in attrs_dict:
-                    return
+            if 'm' not in attrs_dict:
+                return
 
-                m_attr: str = cast(str, attrs_dict['m'])
-                image_url = json.loads(m_attr)['murl']
-                self.image_urls.append(image_url)
+            m_attr: str = cast(str, attrs_dict['m'])
+            image_url = json.loads(m_attr)['murl']
+            self.image_urls.append(image_url)
 
-        parser = Parser()
-        parser.feed(r.text)
+    parser = Parser()
+    parser.feed(r.text)
+    return parser.image_urls[:5]
 
-        yield from _download_all(parser.image_urls[:5])
+
+def image_search(bing_query: str) -> Iterator[bytes]:
+    """
+    Perform image search using Bing. Image URLs are cached, so the search does not need to be
+    repeated to download the images again.
+    Parameters:
+        bing_query: Search query
+    Returns: Image data bytes
+    """
+    cache_key = 'bing' + bing_query
+    try:
+        cached = cache.retrieve_json(cache_key)
+        if cached is not None:
+            log.info('Using cached bing search result: %s', bing_query)
+            image_urls: list[str] = cached['urls']
+        else:
+            image_urls = _search(bing_query)
+            # No results may mean bing has changed its website, try again sooner
+            cache.store_json(cache_key, {'urls': image_urls}, cache.HALFYEAR if image_urls else cache.WEEK)
+
+        yield from _download_all(image_urls)
+    except httpclient.CircuitOpenError as ex:
+        log.info('Not searching bing: %s', ex)
+        yield from []
     except Exception:
         log.info('Error during bing search. This is probably a bug.')
         traceback.print_exc()
@@ -131,6 +131,17 @@ def retrieve_response(key: str,
         return Response(data, mimetype=mimetype)
 
 
+def move(keys: list[tuple[str, str]]) -> None:
+    """
+    Move cache entries to a different key, if they exist
+    Args:
+        keys: List of (old key, new key) tuples
+    """
+    with db.cache() as conn:
+        conn.executemany('UPDATE OR REPLACE cache SET key=? WHERE key=?',
+                         [(new_key, old_key) for old_key, new_key in keys])
+
+
 def cleanup() -> None:
     """
     Remove any cache entries that are beyond their expire time.
@@ -11,10 +11,10 @@ def delete_old_trashed_files() -> int:
     Delete trashed files after 30 days.
     """
     count = 0
-    for path in music.list_tracks_recursively(settings.music_dir, trashed=True):
-        if path.stat().st_ctime < time.time() - 60*60*24*30:
-            log.info('Permanently deleting: %s', path.absolute().as_posix())
-            path.unlink()
+    for music_file in music.walk_music_files(settings.music_dir, trashed=True):
+        if music_file.stat.st_ctime < time.time() - 60*60*24*30:
+            log.info('Permanently deleting: %s', music_file.path.absolute().as_posix())
+            music_file.path.unlink()
             count += 1
     return count
 
@@ -33,6 +33,13 @@ def cleanup() -> None:
                              (time.time() - 300,)).rowcount
         log.info('Deleted %s now playing entries', count)
 
+        # album_key is only known for tracks that have been scanned since it was added, see migration 0046
+        if conn.execute('SELECT 1 FROM track WHERE mtime = 0 LIMIT 1').fetchone() is None:
+            count = conn.execute('DELETE FROM cover_placeholder WHERE album_key NOT IN (SELECT album_key FROM track WHERE album_key IS NOT NULL)').rowcount
+            log.info('Deleted %s cover placeholders', count)
+        else:
+            log.info('Not deleting cover placeholders, waiting for scanner to find album keys')
+
         count = delete_old_trashed_files()
         log.info('Deleted %s trashed files', count)
 
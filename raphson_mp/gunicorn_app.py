@@ -3,7 +3,7 @@ from typing import Any
 
 from gunicorn.app.base import BaseApplication
 
-from raphson_mp import main
+from raphson_mp import main, radio_stream
 
 log = logging.getLogger(__name__)
 
@@ -12,11 +12,16 @@ class GunicornApp(BaseApplication):
     bind: str
     proxy_count: int
     logconfig_dict: dict[str, Any]
+    watch: bool
+    lyrics_warm: bool
 
-    def __init__(self, bind: str, proxy_count: int, logconfig_dict: dict[str, Any]):
+    def __init__(self, bind: str, proxy_count: int, logconfig_dict: dict[str, Any], watch: bool = False,
+                 lyrics_warm: bool = False):
         self.bind = bind
         self.proxy_count = proxy_count
         self.logconfig_dict = logconfig_dict
+        self.watch = watch
+        self.lyrics_warm = lyrics_warm
         super().__init__()
 
     def init(self, parser, opts, args):
@@ -29,8 +34,21 @@ class GunicornApp(BaseApplication):
         self.cfg.set('bind', self.bind)
         self.cfg.set('worker_class', 'gthread')
         self.cfg.set('workers', 1)
-        self.cfg.set('threads', 4)
+        # Radio stream listeners each occupy a thread for as long as they are listening
+        self.cfg.set('threads', 4 + radio_stream.MAX_LISTENERS)
         self.cfg.set('access_log_format', "%(h)s %(b)s %(M)sms %(m)s %(U)s?%(q)s")
         self.cfg.set('logconfig_dict', self.logconfig_dict)
         self.cfg.set('preload_app', True)
         self.cfg.set('timeout', 60)
+        self.cfg.set('post_worker_init', self._post_worker_init)
+
+    def _post_worker_init(self, _worker):
+        # Threads do not survive fork, so background threads must be started in the worker process
+        from raphson_mp import scanner
+        scanner.scan_background()
+        if self.watch:
+            from raphson_mp import watcher
+            watcher.start()
+        if self.lyrics_warm:
+            from raphson_mp import lyrics_warm
+            lyrics_warm.start_background()
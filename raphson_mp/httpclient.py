@@ -0,0 +1,228 @@
+"""
+HTTP clients for requests to external services. Every service has its own client with a connection
+pool per host, so connections are kept alive and reused between requests.
+
+Each client also has a circuit breaker: after several failed or slow requests in a row, the service
+is assumed to be down and requests fail immediately for a while, instead of waiting for a timeout.
+Clients for services with a published rate limit wait for their turn before making a request.
+"""
+import logging
+import time
+from threading import Lock
+from typing import Any
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from raphson_mp import settings
+
+log = logging.getLogger(__name__)
+
+# Client by name, for overriding base URLs in tests and for metrics
+clients: dict[str, 'Client'] = {}
+
+# Number of consecutive failed or slow requests after which requests are no longer made
+FAILURE_THRESHOLD = 5
+# Time to skip requests for, before trying a single request to find out whether the service has recovered
+OPEN_SECONDS = 60
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """
+    Raised instead of making a request, when a service is assumed to be down
+    """
+
+
+class RateLimiter:
+    """
+    Token bucket, shared by all threads. Tokens are reserved in the order threads ask for them,
+    so waiting threads are served in order and the rate limit is fully used.
+    """
+    rate: float
+    burst: int
+    _tokens: float
+    _updated: float
+    _lock: Lock
+
+    def __init__(self, rate: float, burst: int = 1):
+        """
+        Args:
+            rate: Tokens added per second
+            burst: Maximum number of tokens, requests that may be made at once after a quiet period
+        """
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = Lock()
+
+    def acquire(self) -> None:
+        """
+        Take a token, waiting until one is available
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # A negative number of tokens means tokens have been reserved by waiting threads
+            self._tokens -= 1
+            wait_seconds = -self._tokens / self.rate if self._tokens < 0 else 0
+
+        if wait_seconds > 0:
+            log.debug('waiting %.2f seconds for rate limit', wait_seconds)
+            time.sleep(wait_seconds)
+
+
+class Client:
+    name: str
+    base_url: str
+    timeout: float
+    slow_seconds: float
+    circuit_breaker: bool
+    rate_limiter: RateLimiter | None
+    session: requests.Session
+    successes: int = 0
+    failures: int = 0
+    rejected: int = 0
+    total_seconds: float = 0
+    consecutive_failures: int = 0
+    open_until: float = 0  # monotonic time
+    _lock: Lock
+
+    def __init__(self,
+                 name: str,
+                 base_url: str = '',
+                 timeout: float = 10,
+                 retries: int = 2,
+                 user_agent: str = settings.user_agent,
+                 headers: dict[str, str] | None = None,
+                 pool_hosts: int = 1,
+                 slow_seconds: float | None = None,
+                 circuit_breaker: bool = True,
+                 rate_limit: float | None = None,
+                 rate_limit_burst: int = 1):
+        """
+        Args:
+            name: Name of the service
+            base_url: Prepended to relative URLs
+            timeout: Default connect and read timeout in seconds
+            retries: Number of times to retry when a connection cannot be established or the server
+                     is temporarily unavailable (502, 503, 504). Timed out requests are not retried.
+            pool_hosts: Number of different hosts to keep connections to, for clients that download
+                        from arbitrary URLs
+            slow_seconds: Responses taking longer than this count as failures for the circuit
+                          breaker, half the timeout by default
+            circuit_breaker: Stop making requests after repeated failures. Should be disabled for
+                             clients that download from arbitrary hosts.
+            rate_limit: Maximum number of requests per second, on average
+            rate_limit_burst: Number of requests that may be made at once, when no requests have
+                              been made for a while
+        """
+        self.name = name
+        self.base_url = base_url
+        self.timeout = timeout
+        self.slow_seconds = slow_seconds if slow_seconds is not None else timeout / 2
+        self.circuit_breaker = circuit_breaker
+        self.rate_limiter = RateLimiter(rate_limit, rate_limit_burst) if rate_limit else None
+        self._lock = Lock()
+
+        retry = Retry(total=retries,
+                      connect=retries,
+                      read=0,
+                      # Rate limited services respond with 503 when the limit is exceeded, retrying
+                      # immediately would bypass the rate limiter
+                      status=0 if rate_limit else retries,
+                      status_forcelist=(502, 503, 504),
+                      backoff_factor=0.5,
+                      respect_retry_after_header=False,
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=10, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['User-Agent'] = user_agent
+        if headers:
+            self.session.headers.update(headers)
+
+        clients[name] = self
+
+    def url(self, url: str) -> str:
+        if url.startswith('http://') or url.startswith('https://'):
+            return url
+        return self.base_url + url
+
+    @property
+    def is_open(self) -> bool:
+        """
+        Whether requests are currently skipped, because the service is assumed to be down
+        """
+        return self.consecutive_failures >= FAILURE_THRESHOLD and time.monotonic() < self.open_until
+
+    def _allow_request(self) -> bool:
+        with self._lock:
+            if not self.circuit_breaker or self.consecutive_failures < FAILURE_THRESHOLD:
+                return True
+
+            now = time.monotonic()
+            if now < self.open_until:
+                self.rejected += 1
+                return False
+
+            # Let a single request through to find out whether the service has recovered, other
+            # requests are skipped until this request has finished.
+            self.open_until = now + OPEN_SECONDS
+            return True
+
+    def _record(self, seconds: float, failed: bool) -> None:
+        with self._lock:
+            self.total_seconds += seconds
+            if failed:
+                self.failures += 1
+                self.consecutive_failures += 1
+                if self.circuit_breaker and self.consecutive_failures >= FAILURE_THRESHOLD:
+                    if self.consecutive_failures == FAILURE_THRESHOLD:
+                        log.warning('%s: %s failed or slow requests, skipping requests for %s seconds',
+                                    self.name, FAILURE_THRESHOLD, OPEN_SECONDS)
+                    self.open_until = time.monotonic() + OPEN_SECONDS
+            else:
+                self.successes += 1
+                if self.consecutive_failures >= FAILURE_THRESHOLD:
+                    log.info('%s: service has recovered', self.name)
+                self.consecutive_failures = 0
+
+    def request(self, method: str, url: str, **kwargs: Any) -> requests.Response:
+        url = self.url(url)
+        if not self._allow_request():
+            raise CircuitOpenError(f'{self.name} is unavailable, not making request: {url}')
+
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+
+        kwargs.setdefault('timeout', self.timeout)
+        start_time = time.monotonic()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            self._record(time.monotonic() - start_time, True)
+            raise
+
+        seconds = time.monotonic() - start_time
+        failed = response.status_code >= 500 or response.status_code == 429 or seconds > self.slow_seconds
+        self._record(seconds, failed)
+        return response
+
+    def get(self, url: str, **kwargs: Any) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs: Any) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+
+def override_base_url(name: str, base_url: str) -> None:
+    """
+    Send requests for a service to a different server, for example a local server in tests
+    """
+    log.info('Using %s for %s', base_url, name)
+    clients[name].base_url = base_url
@@ -3,6 +3,7 @@ Image conversion and thumbnailing
 """
 import logging
 import subprocess
+import tempfile
 from dataclasses import dataclass
 from enum import Enum
 from pathlib import Path
@@ -20,6 +21,7 @@ class ImageQuality():
 
 QUALITY_HIGH = ImageQuality('high', 1200) # 1200x1200 matches MusicBrainz cover
 QUALITY_LOW = ImageQuality('low', 512)
+QUALITY_TINY = ImageQuality('tiny', 128) # for lists of tracks
 
 
 class ImageFormat(Enum):
@@ -27,28 +29,107 @@ class ImageFormat(Enum):
     JPEG = 'jpeg'
 
 
-def thumbnail(input_path: Path, output_path: Path, img_format: ImageFormat, img_quality: ImageQuality, square: bool):
-    size = img_quality.size
+# All thumbnails stored in the cache for every cover image
+THUMBNAIL_VARIANTS: list[tuple[ImageFormat, ImageQuality]] = [(img_format, img_quality)
+                                                             for img_format in ImageFormat
+                                                             for img_quality in (QUALITY_HIGH, QUALITY_LOW, QUALITY_TINY)]
+
+
+def check_valid(data: bytes) -> bool:
+    """
+    Cheap check whether image data looks like a complete image in a common format, without
+    decoding it. Used to reject corrupt or truncated downloads before running ffmpeg.
+    """
+    if len(data) < 32:
+        return False
+
+    if data.startswith(b'\xff\xd8\xff'):
+        # JPEG must have an end of image marker, possibly followed by some padding
+        return b'\xff\xd9' in data[-4096:]
+
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        return b'IEND' in data[-4096:]
+
+    if data[:6] in {b'GIF87a', b'GIF89a'}:
+        return data.rstrip(b'\x00').endswith(b'\x3b')
 
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return int.from_bytes(data[4:8], 'little') + 8 <= len(data)
+
+    if data[4:12] in {b'ftypavif', b'ftypavis'}:
+        return True
+
+    return False
+
+
+def _thumbnail_filter(size: int, square: bool) -> str:
     if square:
-        thumb_filter = f'scale={size}:{size}:force_original_aspect_ratio=increase,crop={size}:{size}'
-    else:
-        thumb_filter = f'scale={size}:{size}:force_original_aspect_ratio=decrease'
+        return f'scale={size}:{size}:force_original_aspect_ratio=increase,crop={size}:{size}'
+    return f'scale={size}:{size}:force_original_aspect_ratio=decrease'
+
 
+def _format_options(img_format: ImageFormat) -> list[str]:
     if img_format == ImageFormat.WEBP:
-        format_options = ['-pix_fmt', 'yuv420p', '-f', 'webp']
-    elif img_format == ImageFormat.JPEG:
-        format_options = ['-pix_fmt', 'yuvj420p', '-f', 'mjpeg']
-    else:
-        raise ValueError()
-
-    subprocess.run(['ffmpeg',
-                    '-hide_banner',
-                    '-nostats',
-                    '-loglevel', settings.ffmpeg_log_level,
-                    '-i', input_path.as_posix(),
-                    '-filter', thumb_filter,
-                    *format_options,
-                    output_path.as_posix()],
-                   check=True,
-                   shell=False)
+        return ['-pix_fmt', 'yuv420p', '-f', 'webp']
+    if img_format == ImageFormat.JPEG:
+        return ['-pix_fmt', 'yuvj420p', '-f', 'mjpeg']
+    raise ValueError()
+
+
+def thumbnails(input_path: Path, variants: list[tuple[ImageFormat, ImageQuality]], square: bool) -> list[bytes]:
+    """
+    Create thumbnails in multiple formats and sizes using a single ffmpeg process. The input image
+    is decoded once and scaled once for every size.
+    Returns: Thumbnail image bytes, in the same order as variants
+    Raises: CalledProcessError if the image could not be decoded
+    """
+    sizes = sorted({img_quality.size for _img_format, img_quality in variants})
+
+    # Split decoded image into one stream per size, and split every scaled stream into one output per format
+    filters = [f'[0:v]split={len(sizes)}' + ''.join(f'[size{size}]' for size in sizes)]
+    for size in sizes:
+        outputs = [i for i, (_img_format, img_quality) in enumerate(variants) if img_quality.size == size]
+        filters.append(f'[size{size}]{_thumbnail_filter(size, square)},split={len(outputs)}' +
+                       ''.join(f'[out{i}]' for i in outputs))
+
+    with tempfile.TemporaryDirectory(prefix='music-thumbnail') as temp_dir:
+        output_paths = [Path(temp_dir, f'output{i}') for i in range(len(variants))]
+        output_options: list[str] = []
+        for i, (img_format, _img_quality) in enumerate(variants):
+            output_options.extend(['-map', f'[out{i}]', '-frames:v', '1', *_format_options(img_format), output_paths[i].as_posix()])
+
+        subprocess.run(['ffmpeg',
+                        *settings.ffmpeg_flags(),
+                        '-i', input_path.as_posix(),
+                        '-filter_complex', ';'.join(filters),
+                        *output_options],
+                       check=True,
+                       shell=False)
+
+        return [output_path.read_bytes() for output_path in output_paths]
+
+
+def average_color(image_bytes: bytes) -> str:
+    """
+    Average color of an image, to show as a placeholder while the image is loading. Should be
+    called with a small thumbnail, because the image is decoded completely.
+    Returns: Color in hex notation, like #a1b2c3
+    Raises: CalledProcessError if the image could not be decoded
+    """
+    rgb = subprocess.run(['ffmpeg',
+                          *settings.ffmpeg_flags(),
+                          '-i', '-',
+                          '-vf', 'scale=1:1:flags=area',
+                          '-frames:v', '1',
+                          '-f', 'rawvideo',
+                          '-pix_fmt', 'rgb24',
+                          '-'],
+                         input=image_bytes,
+                         capture_output=True,
+                         check=True,
+                         shell=False).stdout
+    return '#' + rgb[:3].hex()
+
+
+def thumbnail(input_path: Path, output_path: Path, img_format: ImageFormat, img_quality: ImageQuality, square: bool):
+    output_path.write_bytes(thumbnails(input_path, [(img_format, img_quality)], square)[0])
@@ -3,9 +3,7 @@ import logging
 from typing import Any
 from urllib.parse import quote as urlencode
 
-import requests
-
-from raphson_mp import metadata, settings
+from raphson_mp import httpclient, metadata, settings
 from raphson_mp.auth import StandardUser
 from raphson_mp.metadata import Metadata
 
@@ -17,6 +15,9 @@ if settings.offline_mode:
     raise RuntimeError('Cannot use last.fm in offline mode')
 
 
+_client = httpclient.Client('lastfm', 'https://ws.audioscrobbler.com/2.0/')
+
+
 def get_connect_url() -> str | None:
     if not settings.lastfm_api_key:
         return None
@@ -47,15 +48,11 @@ def _make_request(method: str, api_method: str, **extra_params: str) -> dict[Any
     sig_digest = hashlib.md5(sig).hexdigest()
     query_string += f'&api_sig={sig_digest}'
     if method == 'post':
-        r = requests.post('https://ws.audioscrobbler.com/2.0/',
-                          data=query_string,
-                          timeout=10,
-                          headers={'User-Agent': settings.user_agent,
-                                   'Content-Type': 'application/x-www-form-urlencoded'})
+        r = _client.post('',
+                         data=query_string,
+                         headers={'Content-Type': 'application/x-www-form-urlencoded'})
     elif method == 'get':
-        r = requests.get('https://ws.audioscrobbler.com/2.0/?' + query_string,
-                         timeout=10,
-                         headers={'User-Agent': settings.user_agent})
+        r = _client.get('?' + query_string)
     else:
         raise ValueError
     log.info('lastfm response: %s', r.text)
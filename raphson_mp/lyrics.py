@@ -5,14 +5,14 @@ import logging
 import re
 import time
 from abc import ABC, abstractmethod
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from dataclasses import dataclass
 from html.parser import HTMLParser
+from threading import Event, Lock
 import traceback
 from typing import Any, Final, override
 
-import requests
-
-from raphson_mp import cache, settings, util
+from raphson_mp import cache, httpclient, settings, util
 
 log = logging.getLogger(__name__)
 
@@ -58,6 +58,8 @@ class PlainLyrics(Lyrics):
 class LyricsFetcher(ABC):
     name: str
     supports_synced: bool
+    # Minimum time between requests made in the background, see find()
+    min_interval_seconds: float = 1
 
     @abstractmethod
     def find(self, title: str, artist: str, album: str | None, duration: int | None) -> Lyrics | None:
@@ -67,6 +69,8 @@ class LyricsFetcher(ABC):
 class LrcLibFetcher(LyricsFetcher):
     name: str = 'lrclib.net'
     supports_synced: bool = True
+    min_interval_seconds: float = 0.5
+    _client = httpclient.Client('lrclib', 'https://lrclib.net/api/', timeout=5)
 
     @override
     def find(self, title: str, artist: str, album: str | None, duration: int | None) -> Lyrics | None:
@@ -75,20 +79,15 @@ class LrcLibFetcher(LyricsFetcher):
             params['album_name'] = album
         if duration is not None:
             params['duration'] = str(duration)
-        response = requests.get('https://lrclib.net/api/get',
-                                params=params,
-                                timeout=5,
-                                headers={'User-Agent': settings.user_agent})
+        response = self._client.get('get', params=params)
         if response.status_code != 404:
             response.raise_for_status()
             json = response.json()
         else:
             log.info('lrclib: no results for direct get, trying search')
-            response = requests.get('https://lrclib.net/api/search',
-                                    params={'artist_name': artist,
-                                            'track_name': title},
-                                    timeout=5,
-                                    headers={'User-Agent': settings.user_agent})
+            response = self._client.get('search',
+                                        params={'artist_name': artist,
+                                                'track_name': title})
             response.raise_for_status()
             json = response.json()
             if len(json) == 0:
@@ -117,25 +116,21 @@ class MusixMatchFetcher(LyricsFetcher):
     """
     name: str = 'MusixMatch'
     supports_synced: bool = True
+    min_interval_seconds: float = 5
 
-    _SEARCH_URL: str = 'https://apic-desktop.musixmatch.com/ws/1.1/%s'
-    _session:  requests.Session
+    _client = httpclient.Client('musixmatch', 'https://apic-desktop.musixmatch.com/ws/1.1/',
+                                user_agent=settings.webscraping_user_agent,
+                                headers={"authority": "apic-desktop.musixmatch.com",
+                                         "cookie": "AWSELBCORS=0; AWSELB=0"})
     _cached_token: str | None = None
     _cached_token_expiration_time: int = 0
 
-    def __init__(self):
-        self._session = requests.Session()
-        self._session.headers.update({"authority": "apic-desktop.musixmatch.com",
-                                     "cookie": "AWSELBCORS=0; AWSELB=0",
-                                     "User-Agent": settings.webscraping_user_agent})
-
     def get_token(self) -> str:
         if self._cached_token and int(time.time()) < self._cached_token_expiration_time:
             return self._cached_token
 
-        url = self._SEARCH_URL % 'token.get'
         query = {'user_language': 'en', 'app_id': 'web-desktop-app-v1.0', 't': int(time.time())}
-        response = self._session.get(url, params=query, timeout=10)
+        response = self._client.get('token.get', params=query)
         result = response.json()
         if 'message' in result and 'body' in result["message"] and 'user_token' in result["message"]["body"]:
             token = result["message"]["body"]["user_token"]
@@ -146,9 +141,8 @@ class MusixMatchFetcher(LyricsFetcher):
         raise ValueError('could not obtain token', result)
 
     def get_lyrics_from_list(self, track_id: str) -> str | None:
-        url = self._SEARCH_URL % 'track.subtitle.get'
         query: dict[str, str] = {'track_id': track_id, 'subtitle_format': 'lrc', 'app_id': 'web-desktop-app-v1.0', 'usertoken': self.get_token(), 't': str(int(time.time()))}
-        response = self._session.get(url, params=query, timeout=10)
+        response = self._client.get('track.subtitle.get', params=query)
         response.raise_for_status()
         try:
             result = response.json()
@@ -165,9 +159,8 @@ class MusixMatchFetcher(LyricsFetcher):
 
     @override
     def find(self, title: str, artist: str, album: str | None, duration: int | None):
-        url = self._SEARCH_URL % 'track.search'
         query = [('q', title + ' ' + artist), ('page_size', '5'), ('page', '1'), ('app_id', 'web-desktop-app-v1.0'), ('usertoken', self.get_token()), ('t', int(time.time()))]
-        response = self._session.get(url, params=query, timeout=10)
+        response = self._client.get('track.search', params=query)
         try:
             result = response.json()
         except json.JSONDecodeError:
@@ -201,15 +194,15 @@ class AZLyricsFetcher(LyricsFetcher):
     """
     name: str = 'AZLyrics'
     supports_synced: bool = False
+    min_interval_seconds: float = 5
+    _client = httpclient.Client('azlyrics', 'https://www.azlyrics.com/', user_agent=settings.webscraping_user_agent)
 
     @override
     def find(self, title: str, artist: str, album: str | None, duration: int | None) -> PlainLyrics | None:
         artist = re.sub("[^a-zA-Z0-9]+", "", artist).lower().lstrip('the ')
         title = re.sub("[^a-zA-Z0-9]+", "", title).lower()
-        url = f'https://www.azlyrics.com/lyrics/{artist}/{title}.html'
-        response = requests.get(url,
-                                timeout=10,
-                                headers={'User-Agent': settings.webscraping_user_agent})
+        url = self._client.url(f'lyrics/{artist}/{title}.html')
+        response = self._client.get(url)
         if response.status_code == 404:
             return None
         response.raise_for_status()
@@ -222,6 +215,7 @@ class AZLyricsFetcher(LyricsFetcher):
 class GeniusFetcher(LyricsFetcher):
     name: str = 'Genius'
     supports_synced: bool = False
+    _client = httpclient.Client('genius', 'https://genius.com/', user_agent=settings.webscraping_user_agent)
 
     @override
     def find(self, title: str, artist: str, album: str | None, duration: int | None) -> PlainLyrics | None:
@@ -240,10 +234,8 @@ class GeniusFetcher(LyricsFetcher):
         """
         Returns: URL of genius lyrics page, or None if no page was found.
         """
-        r = requests.get("https://genius.com/api/search/multi",
-                        timeout=10,
-                        params={"per_page": "1", "q": title + ' ' + artist},
-                        headers={'User-Agent': settings.webscraping_user_agent})
+        r = self._client.get('api/search/multi',
+                             params={"per_page": "1", "q": title + ' ' + artist})
 
         search_json = r.json()
         for section in search_json["response"]["sections"]:
@@ -287,9 +279,7 @@ class GeniusFetcher(LyricsFetcher):
         """
         # Firstly, a request is made to download the standard Genius lyrics page. Inside this HTML is
         # a bit of inline javascript.
-        r = requests.get(genius_url,
-                        timeout=10,
-                        headers={'User-Agent': settings.webscraping_user_agent})
+        r = self._client.get(genius_url)
         text = r.text
 
         # Find the important bit of javascript using known parts of the code
@@ -325,6 +315,8 @@ class LyricFindFetcher(LyricsFetcher):
     # https://lyrics.lyricfind.com/openapi.spec.json
     name: str = 'LyricFind'
     supports_synced: bool = False
+    min_interval_seconds: float = 2
+    _client = httpclient.Client('lyricfind', 'https://lyrics.lyricfind.com/')
 
     @override
     def find(self, title: str, artist: str, album: str | None, duration: int | None) -> PlainLyrics | None:
@@ -337,17 +329,15 @@ class LyricFindFetcher(LyricsFetcher):
         return None
 
     def _search(self, title: str, artist: str, duration: int | None) -> Iterator[str]:
-        response = requests.get('https://lyrics.lyricfind.com/api/v1/search',
-                                headers={'User-Agent': settings.user_agent},
-                                params={'reqtype': 'default',
-                                        'territory': 'NL',
-                                        'searchtype': 'track',
-                                        'track': title,
-                                        'artist': artist,
-                                        'limit': 10,
-                                        'output': 'json',
-                                        'useragent': settings.user_agent},
-                                timeout=10)
+        response = self._client.get('api/v1/search',
+                                    params={'reqtype': 'default',
+                                            'territory': 'NL',
+                                            'searchtype': 'track',
+                                            'track': title,
+                                            'artist': artist,
+                                            'limit': 10,
+                                            'output': 'json',
+                                            'useragent': settings.user_agent})
         response.raise_for_status()
         for track in response.json()['tracks']:
             if not util.str_match(title, track['title']):
@@ -372,11 +362,9 @@ class LyricFindFetcher(LyricsFetcher):
         # 'https://lyrics.lyricfind.com/api/v1/lyric' exists but seems to always return unauthorized
         # use a web scraper instead :-)
 
-        url = 'https://lyrics.lyricfind.com/lyrics/' + slug
+        url = self._client.url('lyrics/' + slug)
         log.info('LyricFind: downloading from: %s', url)
-        response = requests.get(url,
-                                timeout=10,
-                                headers={'User-Agent': settings.webscraping_user_agent})
+        response = self._client.get(url, headers={'User-Agent': settings.webscraping_user_agent})
         response.raise_for_status()
         response_html = response.text
         response_json = util.substr_keyword(response_html, '<script id="__NEXT_DATA__" type="application/json">', '</script>')
@@ -401,49 +389,164 @@ else:
     ]
 
 
-def _find(title: str, artist: str, album: str | None, duration: int | None) -> Lyrics | None:
-    assert title is not None and artist is not None, "title and artist are required"
+@dataclass
+class FetcherStats:
+    found: int = 0
+    not_found: int = 0
+    errors: int = 0
+    total_seconds: float = 0  # Total duration of all requests, including requests that were too slow
 
-    log.info('fetching lyrics for: %s - %s', artist, title)
+    def mean_seconds(self) -> float:
+        requests = self.found + self.not_found + self.errors
+        return self.total_seconds / requests if requests else 0
 
-    plain_match: Lyrics | None = None
 
-    for fetcher in FETCHERS:
-        if plain_match is not None and not fetcher.supports_synced:
-            # if we already have plain lyrics, we do not need to try any fetchers that only support plain lyrics
-            continue
+stats: dict[str, FetcherStats] = {fetcher.name: FetcherStats() for fetcher in FETCHERS}
+_stats_lock = Lock()
 
-        try:
-            lyrics = fetcher.find(title, artist, album, duration)
-        except:
-            log.exception('%s: encountered an error', fetcher.name)
-            continue
+# Earliest time (monotonic clock) the next background request may be made, by fetcher name
+_next_request: dict[str, float] = {}
+_next_request_lock = Lock()
 
-        if lyrics is None:
-            log.info('%s: no lyrics found, continuing search', fetcher.name)
-            continue
+# Fetchers mostly wait for network responses. Multiple searches may run at the same time.
+_executor = ThreadPoolExecutor(max_workers=4 * max(len(FETCHERS), 1), thread_name_prefix='lyrics')
 
-        if isinstance(lyrics, TimeSyncedLyrics):
-            log.info('%s: found time-synced lyrics', fetcher.name)
-            return lyrics
 
-        if plain_match:
-            log.info('%s, no time-synced lyrics found, continuing search', fetcher.name)
-            continue
+def _throttle(fetcher: LyricsFetcher, background: bool) -> float:
+    """
+    Reserve time for a request to this fetcher
+    Returns: Number of seconds to wait before making the request. Requests for users never wait,
+             but do delay background requests.
+    """
+    with _next_request_lock:
+        now = time.monotonic()
+        next_request = _next_request.get(fetcher.name, now)
+        if background:
+            request_time = max(now, next_request)
+        else:
+            request_time = now
+        _next_request[fetcher.name] = max(next_request, request_time + fetcher.min_interval_seconds)
+        return request_time - now
 
-        if isinstance(lyrics, PlainLyrics):
-            log.info('%s: found plain lyrics, continuing search', fetcher.name)
-            plain_match = lyrics
-            continue
 
-        raise ValueError(lyrics)
+def _fetch(fetcher: LyricsFetcher, title: str, artist: str, album: str | None, duration: int | None,
+           background: bool, cancelled: Event) -> tuple[Lyrics | None, bool]:
+    """
+    Returns: Lyrics, and whether an error occurred
+    """
+    wait_seconds = _throttle(fetcher, background)
+    if wait_seconds > 0:
+        log.debug('%s: waiting %.1f seconds for rate limit', fetcher.name, wait_seconds)
+        if cancelled.wait(wait_seconds):
+            return None, False
+
+    start_time = time.monotonic()
+    lyrics = None
+    error = False
+    try:
+        lyrics = fetcher.find(title, artist, album, duration)
+    except httpclient.CircuitOpenError as ex:
+        log.info('%s: %s', fetcher.name, ex)
+        error = True
+    except Exception:
+        log.exception('%s: encountered an error', fetcher.name)
+        error = True
+
+    with _stats_lock:
+        fetcher_stats = stats[fetcher.name]
+        fetcher_stats.total_seconds += time.monotonic() - start_time
+        if error:
+            fetcher_stats.errors += 1
+        elif lyrics is None:
+            fetcher_stats.not_found += 1
+        else:
+            fetcher_stats.found += 1
 
-    if plain_match is not None:
-        log.info('Returning plain lyrics')
-        return plain_match
+    return lyrics, error
 
-    log.info('No lyrics found')
-    return None
+
+def _preference(fetcher: LyricsFetcher) -> int:
+    """
+    Returns: Position of fetcher in the configured preference, lower is better. Fetchers that are
+             not configured are ordered after configured fetchers, in their default order.
+    """
+    if fetcher.name in settings.lyrics_preference:
+        return settings.lyrics_preference.index(fetcher.name)
+    return len(settings.lyrics_preference) + FETCHERS.index(fetcher)
+
+
+def _find(title: str, artist: str, album: str | None, duration: int | None, background: bool) -> tuple[Lyrics | None, bool]:
+    """
+    Search all fetchers at the same time. Time-synced lyrics are preferred over plain lyrics, then
+    lyrics from a preferred fetcher. The search stops as soon as no fetcher that is still busy can
+    return a better result, or when the deadline has passed. Fetchers that are still busy then
+    finish in the background and their results are discarded.
+    In the background, there is no deadline and the rate limit of every fetcher is respected.
+    Returns: Lyrics, and whether the result is conclusive: false if a fetcher that could have
+             returned a better result failed or did not finish before the deadline
+    """
+    assert title is not None and artist is not None, "title and artist are required"
+
+    log.info('fetching lyrics for: %s - %s', artist, title)
+
+    def rank(fetcher: LyricsFetcher, synced: bool) -> tuple[int, int]:
+        return (0 if synced else 1, _preference(fetcher))
+
+    cancelled = Event()
+    futures = {_executor.submit(_fetch, fetcher, title, artist, album, duration, background, cancelled): fetcher
+               for fetcher in FETCHERS}
+    pending = set(futures)
+    best: Lyrics | None = None
+    best_rank: tuple[int, int] | None = None
+    failed: list[LyricsFetcher] = []
+    deadline_passed = False
+    deadline = None if background else time.monotonic() + settings.lyrics_deadline_seconds
+
+    try:
+        while pending:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                log.info('deadline passed, not waiting for: %s', ', '.join(futures[future].name for future in pending))
+                deadline_passed = True
+                break
+
+            for future in done:
+                fetcher = futures[future]
+                lyrics, error = future.result()
+                if error:
+                    failed.append(fetcher)
+                    continue
+
+                if lyrics is None:
+                    log.info('%s: no lyrics found', fetcher.name)
+                    continue
+
+                if not isinstance(lyrics, (TimeSyncedLyrics, PlainLyrics)):
+                    raise ValueError(lyrics)
+
+                synced = isinstance(lyrics, TimeSyncedLyrics)
+                log.info('%s: found %s lyrics', fetcher.name, 'time-synced' if synced else 'plain')
+                if best_rank is None or rank(fetcher, synced) < best_rank:
+                    best = lyrics
+                    best_rank = rank(fetcher, synced)
+
+            if best_rank is not None and all(rank(futures[future], futures[future].supports_synced) > best_rank
+                                             for future in pending):
+                break
+    finally:
+        cancelled.set()
+        for future in pending:
+            future.cancel()
+
+    conclusive = not deadline_passed and all(best_rank is not None and rank(fetcher, fetcher.supports_synced) > best_rank
+                                             for fetcher in failed)
+
+    if best is None:
+        log.info('No lyrics found')
+    else:
+        log.info('Returning lyrics from %s', best.source)
+    return best, conclusive
 
 
 def to_dict(lyrics: Lyrics | None) -> dict[str, Any]:
@@ -472,20 +575,36 @@ def from_dict(dict: dict[str, Any]) -> Lyrics | None:
     raise ValueError(dict['type'])
 
 
-def find(title: str, artist: str, album: str | None, duration: int | None) -> Lyrics | None:
+def _cache_key(title: str, artist: str, album: str | None, duration: int | None) -> str:
+    return f'lyrics{artist}{title}{album}{duration}'
+
+
+def is_cached(title: str, artist: str, album: str | None, duration: int | None) -> bool:
+    return cache.retrieve(_cache_key(title, artist, album, duration)) is not None
+
+
+def find(title: str, artist: str, album: str | None, duration: int | None, background: bool = False) -> Lyrics | None:
+    """
+    Find lyrics, using cached lyrics if possible
+    Args:
+        background: Search is not for a waiting user. Respect rate limits instead of using a deadline.
+    """
     assert title is not None and artist is not None, "title and artist are required"
 
-    cache_key = f'lyrics{artist}{title}{album}{duration}'
+    cache_key = _cache_key(title, artist, album, duration)
 
     cached_dict = cache.retrieve_json(cache_key)
     if cached_dict is not None:
         log.info('returning lyrics from cache')
         return from_dict(cached_dict)
 
-    lyrics = _find(title, artist, album, duration)
+    lyrics, conclusive = _find(title, artist, album, duration, background)
 
     cached_dict = to_dict(lyrics)
-    if lyrics is None:
+    if not conclusive:
+        # A fetcher that failed or was too slow may find (better) lyrics when trying again later
+        duration = cache.HOUR
+    elif lyrics is None:
         duration = cache.MONTH
     else:
         duration = cache.YEAR
@@ -0,0 +1,83 @@
+"""
+Find lyrics for all tracks ahead of time, so the lyrics are already cached when a user opens the
+lyrics pane. Lyrics providers are queried slowly, respecting their rate limits.
+"""
+import logging
+import time
+from threading import Thread
+
+from raphson_mp import db, lyrics, music, settings
+
+log = logging.getLogger(__name__)
+
+# Time between runs of the background job, new tracks are picked up in the next run
+INTERVAL_SECONDS = 24*3600
+
+
+def warm(playlists: list[str] | None = None) -> None:
+    """
+    Find and cache lyrics for tracks that have a title and artist, skipping tracks with
+    embedded lyrics or cached lyrics.
+    Args:
+        playlists: Names of playlists to warm, or None for all playlists
+    """
+    with db.connect(read_only=True) as conn:
+        if playlists is None:
+            relpaths = [row[0] for row in conn.execute('SELECT path FROM track')]
+        else:
+            relpaths = []
+            for playlist in playlists:
+                relpaths.extend(row[0] for row in conn.execute('SELECT path FROM track WHERE playlist = ?', (playlist,)))
+
+    log.info('Finding lyrics for up to %s tracks', len(relpaths))
+
+    searched = 0
+    found = 0
+    for relpath in relpaths:
+        # Short-lived connection, searching for lyrics takes a long time
+        with db.connect(read_only=True) as conn:
+            track = music.Track.by_relpath(conn, relpath)
+            if track is None:  # deleted in the meantime
+                continue
+            meta = track.metadata()
+
+        if meta.lyrics:
+            continue
+
+        title = meta.title
+        artist = meta.primary_artist()
+        if not title or not artist:
+            continue
+
+        if lyrics.is_cached(title, artist, meta.album, meta.duration):
+            continue
+
+        log.debug('Finding lyrics for: %s', relpath)
+        try:
+            if lyrics.find(title, artist, meta.album, meta.duration, background=True) is not None:
+                found += 1
+        except Exception:
+            log.exception('Error finding lyrics for: %s', relpath)
+        searched += 1
+
+    log.info('Searched lyrics for %s tracks, found lyrics for %s tracks', searched, found)
+
+
+def _warm_background() -> None:
+    while True:
+        try:
+            warm()
+        except Exception:
+            log.exception('Error finding lyrics in the background')
+        time.sleep(INTERVAL_SECONDS)
+
+
+def start_background() -> None:
+    """
+    Periodically find lyrics in a background thread
+    """
+    if settings.offline_mode:
+        log.info('Not finding lyrics in offline mode')
+        return
+
+    Thread(target=_warm_background, name='lyrics-warm', daemon=True).start()
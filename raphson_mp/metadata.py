@@ -2,10 +2,12 @@ import json
 import logging
 import re
 import subprocess
+import unicodedata
 from dataclasses import dataclass
 from pathlib import Path
 
-from raphson_mp import music
+from raphson_mp import music, settings, tagreader
+from raphson_mp.tagreader import ProbeResult
 
 log = logging.getLogger(__name__)
 
@@ -121,6 +123,15 @@ def ignore_album_artist(artist: str) -> bool:
     return artist.lower() in ALBUM_ARTIST_IGNORE
 
 
+def _normalize_key(text: str) -> str:
+    """
+    Normalize text for use in a key, so differently written names (case, punctuation, unicode
+    forms, whitespace) result in the same key
+    """
+    text = unicodedata.normalize('NFKC', text).casefold()
+    return re.sub(r'[\W_]+', ' ', text).strip()
+
+
 def _strip_keywords(inp: str) -> str:
     """
     Remove undesirable keywords from title, as a result of being downloaded from the internet.
@@ -179,6 +190,7 @@ class Metadata:
     tags: list[str]
     lyrics: str | None
     video: str | None
+    embedded_cover: bool | None = None  # None if not known
 
     def _meta_title(self) -> str | None:
         """
@@ -241,6 +253,24 @@ class Metadata:
             # no artists
             return None
 
+    def album_key(self) -> str | None:
+        """
+        Key identifying the album this track is part of, used to share album covers between
+        tracks. Tracks of the same album have the same key, even when their tags are written
+        slightly differently or only some tracks have an album artist.
+        Returns: Album key, or None if the track is not part of an album
+        """
+        if not self.album or ignore_album(self.album):
+            return None
+
+        if self.album_artist:
+            # Compilations have an album artist like "Various Artists"
+            artist = '' if ignore_album_artist(self.album_artist) else self.album_artist
+        else:
+            artist = self.primary_artist() or ''
+
+        return _normalize_key(artist) + '|' + _normalize_key(self.album)
+
     def get_ffmpeg_options(self, option: str = '-metadata') -> list[str]:
         metadata_options: list[str] = []
         if self.album:
@@ -262,12 +292,10 @@ class Metadata:
         return metadata_options
 
 
-def probe(path: Path) -> Metadata | None:
+def _probe_ffprobe(path: Path) -> ProbeResult | None:
     """
-    Create Metadata object by running ffprobe on a file
-    Args:
-        path: Path to file
-    Returns: Metadata object, or None if ffprobe failed to read the file
+    Read tags, duration and video codecs by running ffprobe
+    Returns: ProbeResult, or None if ffprobe failed to read the file
     """
     command = [
         'ffprobe',
@@ -288,18 +316,10 @@ def probe(path: Path) -> Metadata | None:
 
     data = json.loads(result.stdout.decode())
 
-    duration = int(float(data['format']['duration']))
-    artists: list[str] = []
-    album: str | None = None
-    title: str | None = None
-    year: int | None = None
-    album_artist: str | None = None
-    track_number: int | None = None
-    tags: list[str] = []
-    lyrics: str | None = None
-    video: str | None = None
-
+    duration = float(data['format']['duration'])
     meta_tags: list[tuple[str, str]] = []
+    video_codecs: list[str] = []
+    cover = False
 
     for stream in data['streams']:
         if stream['codec_type'] == 'audio':
@@ -307,15 +327,65 @@ def probe(path: Path) -> Metadata | None:
                 meta_tags.extend(stream['tags'].items())
 
         if stream['codec_type'] == 'video':
-            if stream['codec_name'] == 'vp9':
-                video = 'vp9'
-            elif stream['codec_name'] == 'h264':
-                video = 'h264'
+            if stream.get('disposition', {}).get('attached_pic'):
+                cover = True
+            else:
+                video_codecs.append(stream['codec_name'])
 
     if 'tags' in data['format']:
         meta_tags.extend(data['format']['tags'].items())
 
-    for name, value in meta_tags:
+    return ProbeResult(duration, meta_tags, video_codecs, cover)
+
+
+def _probe_tagreader(path: Path) -> ProbeResult | None:
+    """
+    Read tags, duration and video codecs using the built-in tag reader, falling back to ffprobe
+    for files the tag reader does not support.
+    """
+    try:
+        return tagreader.read_file(path)
+    except tagreader.UnsupportedFile as ex:
+        log.debug('Using ffprobe for %s: %s', path, ex)
+        return _probe_ffprobe(path)
+
+
+PROBE_BACKENDS = {
+    'tagreader': _probe_tagreader,
+    'ffprobe': _probe_ffprobe,
+}
+
+
+def probe(path: Path, backend: str | None = None) -> Metadata | None:
+    """
+    Create Metadata object by reading tags from a file
+    Args:
+        path: Path to file
+        backend: Probe backend, see PROBE_BACKENDS. Uses the configured backend by default.
+    Returns: Metadata object, or None if the file could not be read
+    """
+    result = PROBE_BACKENDS[backend if backend else settings.probe_backend](path)
+    if result is None:
+        return None
+
+    duration = int(result.duration)
+    artists: list[str] = []
+    album: str | None = None
+    title: str | None = None
+    year: int | None = None
+    album_artist: str | None = None
+    track_number: int | None = None
+    tags: list[str] = []
+    lyrics: str | None = None
+    video: str | None = None
+
+    for codec_name in result.video_codecs:
+        if codec_name == 'vp9':
+            video = 'vp9'
+        elif codec_name == 'h264':
+            video = 'h264'
+
+    for name, value in result.tags:
         # sometimes ffprobe returns tags in uppercase
         name = name.lower()
 
@@ -367,4 +437,5 @@ def probe(path: Path) -> Metadata | None:
                     track_number,
                     tags,
                     lyrics,
-                    video)
+                    video,
+                    result.cover)
@@ -0,0 +1,20 @@
+BEGIN;
+
+ALTER TABLE playlist ADD COLUMN track_count INTEGER NOT NULL DEFAULT 0;
+
+UPDATE playlist SET track_count = (SELECT COUNT(*) FROM track WHERE track.playlist = playlist.path);
+
+CREATE TRIGGER playlist_track_count_insert AFTER INSERT ON track BEGIN
+    UPDATE playlist SET track_count = track_count + 1 WHERE path = new.playlist;
+END;
+
+CREATE TRIGGER playlist_track_count_delete AFTER DELETE ON track BEGIN
+    UPDATE playlist SET track_count = track_count - 1 WHERE path = old.playlist;
+END;
+
+CREATE TRIGGER playlist_track_count_update AFTER UPDATE OF playlist ON track WHEN old.playlist != new.playlist BEGIN
+    UPDATE playlist SET track_count = track_count - 1 WHERE path = old.playlist;
+    UPDATE playlist SET track_count = track_count + 1 WHERE path = new.playlist;
+END;
+
+COMMIT;
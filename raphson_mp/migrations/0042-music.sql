@@ -0,0 +1,11 @@
+BEGIN;
+
+CREATE TABLE scanner_directory (
+    path TEXT NOT NULL UNIQUE PRIMARY KEY,
+    playlist TEXT NOT NULL REFERENCES playlist(path) ON DELETE CASCADE,
+    mtime INTEGER NOT NULL -- Nanoseconds since UNIX epoch
+) STRICT;
+
+CREATE INDEX idx_scanner_directory_playlist ON scanner_directory(playlist);
+
+COMMIT;
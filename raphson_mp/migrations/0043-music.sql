@@ -0,0 +1,7 @@
+BEGIN;
+
+-- 1 if the file has an embedded cover image, 0 if it does not, NULL if not known because the
+-- track has not been scanned since this column was added
+ALTER TABLE track ADD COLUMN embedded_cover INTEGER NULL;
+
+COMMIT;
@@ -0,0 +1,9 @@
+BEGIN;
+
+-- Normalized album artist and album name, see Metadata.album_key(). NULL if the track is not part
+-- of an album, or if it has not been scanned since this column was added.
+ALTER TABLE track ADD COLUMN album_key TEXT NULL;
+
+CREATE INDEX idx_track_album_key ON track(album_key);
+
+COMMIT;
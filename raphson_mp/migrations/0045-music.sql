@@ -0,0 +1,8 @@
+BEGIN;
+
+CREATE TABLE cover_placeholder (
+    album_key TEXT NOT NULL UNIQUE PRIMARY KEY,
+    color TEXT NOT NULL -- average color of album cover, like #a1b2c3
+) STRICT;
+
+COMMIT;
@@ -0,0 +1,12 @@
+BEGIN;
+
+-- Not used by any query
+DROP INDEX idx_track_album_key;
+
+-- Read metadata of all files again, to fill the album_key and embedded_cover columns for tracks
+-- scanned before these columns were added. The scanner skips files in unchanged directories and
+-- files with an unchanged modification time.
+UPDATE track SET mtime = 0;
+DELETE FROM scanner_directory;
+
+COMMIT;
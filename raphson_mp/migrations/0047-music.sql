@@ -0,0 +1,6 @@
+BEGIN;
+
+-- For finding the most recent change in a playlist, see shuffle.playlist_version()
+CREATE INDEX idx_scanner_log_playlist ON scanner_log(playlist);
+
+COMMIT;
@@ -1,11 +1,17 @@
 from __future__ import annotations
 
 import logging
+import os
 import random
 import shutil
 import subprocess
+import sys
 import tempfile
+import threading
+import time
 from collections.abc import Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import closing
 from dataclasses import dataclass
 from datetime import datetime, timezone
 from enum import Enum
@@ -13,9 +19,11 @@ from json.decoder import JSONDecodeError
 from pathlib import Path
 from sqlite3 import Connection
 from subprocess import CalledProcessError
+from threading import Lock
 from typing import Literal
 
-from raphson_mp import cache, image, jsonw, lyrics, metadata, reddit, settings
+from raphson_mp import (cache, db, image, jsonw, lyrics, metadata, reddit,
+                        settings, shuffle)
 from raphson_mp.auth import User
 from raphson_mp.image import ImageFormat, ImageQuality
 from raphson_mp.lyrics import Lyrics, PlainLyrics
@@ -37,6 +45,7 @@ MUSIC_EXTENSIONS = [
     '.opus',
     '.mp4'
 ]
+MUSIC_EXTENSIONS_TUPLE = tuple(MUSIC_EXTENSIONS)
 
 
 def to_relpath(path: Path) -> str:
@@ -81,6 +90,72 @@ def is_music_file(path: Path) -> bool:
     return False
 
 
+@dataclass
+class MusicFile:
+    path: Path
+    stat: os.stat_result
+    trashed: bool
+
+
+def walk_directories(path: Path, skip_trashed: bool = True) -> Iterator[tuple[Path, os.stat_result, list[os.DirEntry[str]]]]:
+    """
+    Walk a directory tree. Symlinked directories are followed, but every directory is visited only
+    once so a symlink cycle does not make the walk run forever. Directories that cannot be listed
+    are skipped.
+    Args:
+        path: Directory Path
+        skip_trashed: Do not descend into trashed directories
+    Returns: Iterator of directory path, directory stat result and entries in the directory that
+             are not directories
+    """
+    visited: set[tuple[int, int]] = set()
+    stack = [path]
+    while stack:
+        dir_path = stack.pop()
+        files: list[os.DirEntry[str]] = []
+        try:
+            dir_stat = dir_path.stat()
+            if (dir_stat.st_dev, dir_stat.st_ino) in visited:
+                log.warning('Skipping directory that was already visited, symlink cycle? %s', dir_path)
+                continue
+            visited.add((dir_stat.st_dev, dir_stat.st_ino))
+
+            with os.scandir(dir_path) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        if not (skip_trashed and entry.name.startswith('.trash.')):
+                            stack.append(Path(entry.path))
+                    else:
+                        files.append(entry)
+        except OSError as ex:
+            log.warning('Cannot list directory %s: %s', dir_path, ex)
+            continue
+
+        yield dir_path, dir_stat, files
+
+
+def walk_music_files(path: Path, trashed: bool = False) -> Iterator[MusicFile]:
+    """
+    Find music files in a directory, recursively, in a single pass over the directory tree.
+    Args:
+        path: Directory Path
+        trashed: True to find trashed files only, False to find files that are not trashed.
+                 When looking for files that are not trashed, trashed directories are skipped
+                 entirely.
+    Returns: Iterator of music files with their stat result
+    """
+    for dir_path, _dir_stat, files in walk_directories(path, skip_trashed=not trashed):
+        dir_trashed = is_trashed(dir_path)
+        for entry in files:
+            entry_trashed = dir_trashed or entry.name.startswith('.trash.')
+            if entry_trashed != trashed or not entry.name.endswith(MUSIC_EXTENSIONS_TUPLE):
+                continue
+            try:
+                yield MusicFile(Path(entry.path), entry.stat(), entry_trashed)
+            except OSError as ex:
+                log.warning('Cannot read file %s: %s', entry.path, ex)
+
+
 def list_tracks_recursively(path: Path, trashed: bool = False) -> Iterator[Path]:
     """
     Scan directory for tracks, recursively
@@ -88,15 +163,41 @@ def list_tracks_recursively(path: Path, trashed: bool = False) -> Iterator[Path]
         path: Directory Path
     Returns: Paths iterator
     """
-    for ext in MUSIC_EXTENSIONS:
-        for track_path in path.glob('**/*' + ext):
-            if is_trashed(track_path) == trashed:
-                yield track_path
+    for music_file in walk_music_files(path, trashed):
+        yield music_file.path
+
+
+def _extract_embedded_cover(path: Path) -> bytes | None:
+    """
+    Returns: Embedded cover image bytes, or None if the file has no embedded cover image
+    """
+    result = subprocess.run(['ffmpeg', *settings.ffmpeg_flags(),
+                             '-i', path.as_posix(),
+                             '-map', '0:v:0',
+                             '-frames:v', '1',
+                             '-c:v', 'copy',
+                             '-f', 'image2pipe',
+                             '-'],
+                            capture_output=True,
+                            shell=False,
+                            check=False)
+    if result.returncode != 0 or not result.stdout:
+        return None
+    return result.stdout
 
 
-def get_possible_covers(artist: str | None, album: str, meme: bool) -> Iterator[bytes]:
+def get_possible_covers(artist: str | None, album: str, meme: bool, embedded_path: Path | None = None) -> Iterator[bytes]:
+    """
+    Args:
+        embedded_path: Audio file that may contain an embedded cover, to try before searching online
+    """
     from raphson_mp import bing, musicbrainz
 
+    if embedded_path:
+        if image_bytes := _extract_embedded_cover(embedded_path):
+            log.info('Using embedded cover: %s', embedded_path)
+            yield image_bytes
+
     if meme:
         if random.random() > 0.5:
             if image_bytes := reddit.get_image(album):
@@ -122,15 +223,46 @@ def get_possible_covers(artist: str | None, album: str, meme: bool) -> Iterator[
     yield settings.raphson_png.read_bytes()
 
 
+def _store_cover_placeholder(album_key: str, thumbnail_bytes: bytes) -> None:
+    try:
+        color = image.average_color(thumbnail_bytes)
+    except CalledProcessError:
+        log.warning('Failed to determine average cover color')
+        return
+
+    with db.connect() as conn:
+        conn.execute('INSERT OR REPLACE INTO cover_placeholder (album_key, color) VALUES (?, ?)', (album_key, color))
+
+
+def _cover_cache_key(artist: str | None, album: str, meme: bool, album_key: str | None) -> str:
+    if album_key is not None:
+        # Shared by all tracks of an album
+        return f'albumcover{album_key}{meme}'
+    return f'cover{artist}{album}{meme}'
+
+
+def get_cached_cover(artist: str | None, album: str, meme: bool,
+                     img_quality: ImageQuality, img_format: ImageFormat,
+                     album_key: str | None = None) -> bytes | None:
+    """
+    Returns: Album cover image bytes, or None if the cover has not been found yet, see get_cover()
+    """
+    return cache.retrieve(_cover_cache_key(artist, album, meme, album_key) + img_quality.name + img_format.name)
+
+
 def get_cover(artist: str | None, album: str, meme: bool,
-              img_quality: ImageQuality, img_format: ImageFormat) -> bytes:
+              img_quality: ImageQuality, img_format: ImageFormat,
+              embedded_path: Path | None = None,
+              album_key: str | None = None) -> bytes:
     """
     Find album cover
     Parameters:
-        meta: Track metadata
+        embedded_path: Audio file that may contain an embedded cover, see get_possible_covers()
+        album_key: Album the cover is for, see Metadata.album_key()
     Returns: Album cover image bytes, or None if no image was found.
     """
-    cache_key =  f'cover{artist}{album}{meme}'  # quality is appended later
+    # quality is appended later
+    cache_key = _cover_cache_key(artist, album, meme, album_key)
 
     cache_data = cache.retrieve(cache_key + img_quality.name + img_format.name)
     if cache_data is not None:
@@ -140,31 +272,53 @@ def get_cover(artist: str | None, album: str, meme: bool,
 
     log.info('Cover thumbnail not cached, need to download album cover image: %s - %s', artist, album)
 
-    for cover_bytes in get_possible_covers(artist, album, meme):
-        with tempfile.TemporaryDirectory(prefix='music-cover') as temp_dir:
-            input_path = Path(temp_dir, 'input')
-            input_path.write_bytes(cover_bytes)
-
-            try:
-                log.info('Generating thumbnails')
-                for img_format2 in ImageFormat:
-                    for img_quality2 in (image.QUALITY_HIGH, image.QUALITY_LOW):
-                        output_path = Path(temp_dir, 'output' + img_quality2.name + img_format2.name)
-                        image.thumbnail(input_path, output_path, img_format2, img_quality2, square=not meme)
-                        image_bytes = output_path.read_bytes()
-                        cache.store(cache_key + img_quality2.name + img_format2.name, image_bytes, cache.HALFYEAR)
-
-                        if img_quality2 == img_quality and img_format2 == img_format:
-                            return_data = image_bytes
-            except CalledProcessError:
-                log.warning('Failed to generate thumbnail, image is probably corrupt. Trying another image.')
+    # Closing stops downloads of other possible covers once a cover has been found
+    with closing(get_possible_covers(artist, album, meme, embedded_path)) as possible_covers:
+        for cover_bytes in possible_covers:
+            if not image.check_valid(cover_bytes):
+                log.warning('Image is corrupt or in an unsupported format. Trying another image.')
                 continue
 
-        return return_data  # pyright: ignore[reportPossiblyUnboundVariable]
+            with tempfile.TemporaryDirectory(prefix='music-cover') as temp_dir:
+                input_path = Path(temp_dir, 'input')
+                input_path.write_bytes(cover_bytes)
+
+                try:
+                    log.info('Generating thumbnails')
+                    thumbnails = image.thumbnails(input_path, image.THUMBNAIL_VARIANTS, square=not meme)
+                except CalledProcessError:
+                    log.warning('Failed to generate thumbnail, image is probably corrupt. Trying another image.')
+                    continue
+
+            for (img_format2, img_quality2), image_bytes in zip(image.THUMBNAIL_VARIANTS, thumbnails):
+                cache.store(cache_key + img_quality2.name + img_format2.name, image_bytes, cache.HALFYEAR)
+
+                if img_quality2 == img_quality and img_format2 == img_format:
+                    return_data = image_bytes
+
+                if album_key is not None and not meme and img_quality2 == image.QUALITY_TINY and img_format2 == ImageFormat.WEBP:
+                    _store_cover_placeholder(album_key, image_bytes)
+
+            return return_data  # pyright: ignore[reportPossiblyUnboundVariable]
 
     raise ValueError('always at least one possible cover must be returned')
 
 
+_transcode_jobs: dict[str, Future[bytes]] = {}
+_transcode_jobs_lock = Lock()
+
+
+def _lower_thread_priority() -> None:
+    # On Linux, niceness applies to individual threads and is inherited by ffmpeg child processes
+    if sys.platform == 'linux':
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+
+
+_warm_executor = ThreadPoolExecutor(max_workers=1,
+                                    thread_name_prefix='warm-transcode',
+                                    initializer=_lower_thread_priority)
+
+
 class AudioType(Enum):
     """
     Opus audio in WebM container, for music player streaming.
@@ -193,6 +347,40 @@ class AudioType(Enum):
     """
     MP3_WITH_METADATA = 3
 
+    @staticmethod
+    def from_value(value: str) -> AudioType:
+        """
+        Get audio type from its lower case name as used in the API, like 'webm_opus_high'
+        """
+        for audio_type in AudioType:
+            if audio_type.name.lower() == value:
+                return audio_type
+        raise ValueError(value)
+
+
+def loudnorm_cache_key(relpath: str, mtime: int) -> str:
+    return 'loud3' + relpath + str(mtime)
+
+
+def audio_cache_key(audio_type: AudioType, relpath: str, mtime: int) -> str:
+    return 'audio9' + str(audio_type) + relpath + str(mtime)
+
+
+def video_cache_key(relpath: str, mtime: int) -> str:
+    return f'video{relpath}{mtime}'
+
+
+def moved_cache_keys(old_relpath: str, new_relpath: str, mtime: int) -> list[tuple[str, str]]:
+    """
+    Returns: Old and new cache keys of audio and video data of a track that has been moved or
+             renamed, for cache.move()
+    """
+    keys = [(loudnorm_cache_key(old_relpath, mtime), loudnorm_cache_key(new_relpath, mtime)),
+            (video_cache_key(old_relpath, mtime), video_cache_key(new_relpath, mtime))]
+    for audio_type in AudioType:
+        keys.append((audio_cache_key(audio_type, old_relpath, mtime), audio_cache_key(audio_type, new_relpath, mtime)))
+    return keys
+
 
 @dataclass
 class Track:
@@ -220,11 +408,11 @@ class Track:
         if self._metadata:
             return self._metadata
 
-        query = 'SELECT duration, title, album, album_artist, track_number, year, lyrics, video FROM track WHERE path=?'
+        query = 'SELECT duration, title, album, album_artist, track_number, year, lyrics, video, embedded_cover FROM track WHERE path=?'
         row = self.conn.execute(query, (self.relpath,)).fetchone()
         if row is None:
             raise ValueError('Missing track from database: ' + self.relpath)
-        duration, title, album, album_artist, track_number, year, lyrics, video = row
+        duration, title, album, album_artist, track_number, year, lyrics, video, embedded_cover = row
 
         rows = self.conn.execute('SELECT artist FROM track_artist WHERE track=?', (self.relpath,)).fetchall()
         artists = [row[0] for row in rows]
@@ -232,31 +420,45 @@ class Track:
         rows = self.conn.execute('SELECT tag FROM track_tag WHERE track=?', (self.relpath,)).fetchall()
         tags = [row[0] for row in rows]
 
-        return Metadata(self.relpath, duration, metadata.sort_artists(artists, album_artist), album, title, year, album_artist, track_number, tags, lyrics, video)
+        embedded_cover = None if embedded_cover is None else bool(embedded_cover)
+        return Metadata(self.relpath, duration, metadata.sort_artists(artists, album_artist), album, title, year, album_artist, track_number, tags, lyrics, video, embedded_cover)
+
+    def _cover_album(self, meta: Metadata) -> str:
+        """
+        Returns: Album name to search a cover for
+        """
+        if meta.album and not metadata.ignore_album(meta.album):
+            return meta.album
+        if meta.title:
+            return meta.title
+        return self.relpath.split('/')[-1]
+
+    def get_cached_cover(self, meme: bool, img_quality: ImageQuality, img_format: ImageFormat) -> bytes | None:
+        """
+        Returns: Album cover image bytes, or None if the cover has not been found yet
+        """
+        meta = self.metadata()
+        return get_cached_cover(meta.primary_artist(), self._cover_album(meta), meme, img_quality, img_format, meta.album_key())
 
     def get_cover(self, meme: bool, img_quality: ImageQuality, img_format: ImageFormat) -> bytes:
         """
-        Find album cover using MusicBrainz or Bing.
-        Parameters:
-            meta: Track metadata
+        Find album cover, embedded in the audio file or using MusicBrainz or Bing.
         Returns: Album cover image bytes, or None if MusicBrainz nor bing found an image.
         """
         meta = self.metadata()
-
-        if meta.album and not metadata.ignore_album(meta.album):
-            album = meta.album
-        elif meta.title:
-            album = meta.title
-        else:
-            album = self.relpath.split('/')[-1]
-
+        album = self._cover_album(meta)
         artist = meta.primary_artist()
 
-        return get_cover(artist, album, meme, img_quality, img_format)
+        # Tracks scanned before embedded covers were detected may have one, unless the
+        # video stream is an actual video
+        embedded = meta.embedded_cover or (meta.embedded_cover is None and meta.video is None)
+        embedded_path = self.path if embedded and not meme else None
+
+        return get_cover(artist, album, meme, img_quality, img_format, embedded_path, meta.album_key())
 
     def get_loudnorm_filter(self) -> str:
         """Get ffmpeg loudnorm filter string"""
-        cache_key = 'loud3' + self.relpath + str(self.mtime)
+        cache_key = loudnorm_cache_key(self.relpath, self.mtime)
         cached_data = cache.retrieve(cache_key)
         if cached_data is not None:
             log.info('Returning cached loudness data')
@@ -324,7 +526,7 @@ class Track:
         Normalize and compress audio using ffmpeg
         Returns: Compressed audio bytes
         """
-        cache_key = 'audio9' + str(audio_type) + self.relpath + str(self.mtime)
+        cache_key = audio_cache_key(audio_type, self.relpath, self.mtime)
 
         cached_data = cache.retrieve(cache_key)
 
@@ -332,6 +534,31 @@ class Track:
             log.info('Returning cached audio')
             return cached_data
 
+        # If the same audio is already being transcoded, for example by a warm_transcode()
+        # job, wait for it instead of transcoding it again.
+        with _transcode_jobs_lock:
+            job = _transcode_jobs.get(cache_key)
+            is_new_job = job is None
+            if job is None:
+                job = Future()
+                _transcode_jobs[cache_key] = job
+
+        if not is_new_job:
+            log.info('Waiting for transcode job in progress: %s', self.relpath)
+            return job.result()
+
+        try:
+            audio_data = self._transcode(audio_type, cache_key)
+            job.set_result(audio_data)
+            return audio_data
+        except BaseException as ex:
+            job.set_exception(ex)
+            raise ex
+        finally:
+            with _transcode_jobs_lock:
+                del _transcode_jobs[cache_key]
+
+    def _transcode(self, audio_type: AudioType, cache_key: str) -> bytes:
         loudnorm = self.get_loudnorm_filter()
 
         log.info('Transcoding audio: %s', self.relpath)
@@ -428,9 +655,24 @@ class Track:
             shutil.copy(temp_file.name, self.path)
 
 
-    def info_dict(self) -> dict[str, str | int | list[str] | None]:
+    def cover_placeholder(self, meta: Metadata) -> str | None:
+        """
+        Returns: Average color of the album cover, or None if not known
+        """
+        album_key = meta.album_key()
+        if album_key is None:
+            return None
+        row = self.conn.execute('SELECT color FROM cover_placeholder WHERE album_key = ?', (album_key,)).fetchone()
+        return row[0] if row else None
+
+    def info_dict(self, cover_placeholder: bool = True) -> dict[str, str | int | list[str] | None]:
+        """
+        Args:
+            cover_placeholder: Include the cover placeholder. It must be left out of responses that
+                               are cached until the library changes, see respcache.
+        """
         meta = self.metadata()
-        return {
+        info: dict[str, str | int | list[str] | None] = {
             'playlist': self.playlist,
             'path': self.relpath,
             'mtime': self.mtime,
@@ -444,8 +686,15 @@ class Track:
             'video': meta.video,
             'display': meta.display_title(),
         }
+        if cover_placeholder:
+            info['cover_placeholder'] = self.cover_placeholder(meta)
+        return info
 
-    def lyrics(self) -> Lyrics | None:
+    def lyrics(self, background: bool = False) -> Lyrics | None:
+        """
+        Args:
+            background: Lyrics are not needed right away, see lyrics.find()
+        """
         meta = self.metadata()
         if meta.lyrics:
             log.info('using lyrics from metadata')
@@ -454,7 +703,7 @@ class Track:
         title = meta.title
         artist = meta.primary_artist()
         if title and artist:
-            return lyrics.find(title, artist, meta.album, meta.duration)
+            return lyrics.find(title, artist, meta.album, meta.duration, background=background)
 
         log.info("can't search for lyrics due to missing metadata")
         return None
@@ -473,6 +722,29 @@ class Track:
         return None
 
 
+def _warm_transcode(relpath: str, audio_type: AudioType) -> None:
+    try:
+        with db.connect(read_only=True) as conn:
+            track = Track.by_relpath(conn, relpath)
+            if track is None:
+                log.info('Not warming transcode, track was deleted: %s', relpath)
+                return
+            track.transcoded_audio(audio_type)
+    except Exception:
+        log.exception('Error warming transcode: %s', relpath)
+
+
+def warm_transcode(track: Track, audio_type: AudioType) -> None:
+    """
+    Transcode audio in the background with low priority, so it is likely to be cached
+    by the time a client requests it. A client requesting audio while it is being
+    transcoded waits for the background job.
+    """
+    if settings.offline_mode:
+        return
+    _warm_executor.submit(_warm_transcode, track.relpath, audio_type)
+
+
 @dataclass
 class PlaylistStats:
     track_count: int
@@ -489,50 +761,71 @@ class PlaylistStats:
     least_recent_choice: int
     most_recent_mtime: int
 
-    def __init__(self, conn: Connection, relpath: str):
-        row = conn.execute('SELECT COUNT(*), SUM(duration), AVG(duration) FROM track WHERE playlist=?',
-                           (relpath,)).fetchone()
-        self.track_count, self.total_duration, self.mean_duration = row
-
-        row = conn.execute('''
-                           SELECT COUNT(DISTINCT artist)
-                           FROM track_artist JOIN track ON track.path=track
-                           WHERE playlist=?
-                           ''', (relpath,)).fetchone()
-        self.artist_count, = row
-
-        (self.has_title_count,
-         self.has_album_count,
-         self.has_album_artist_count,
-         self.has_year_count,
-         self.most_recent_choice,
-         self.least_recent_choice,
-         self.most_recent_mtime
-         ) = conn.execute('''
-                          SELECT SUM(title IS NOT NULL),
-                                 SUM(album IS NOT NULL),
-                                 SUM(album_artist IS NOT NULL),
-                                 SUM(year IS NOT NULL),
-                                 MAX(last_chosen),
-                                 MIN(last_chosen),
-                                 MAX(mtime)
-                          FROM track WHERE playlist=?
-                          ''', (relpath,)).fetchone()
-
-
-        (self.has_artist_count,
-         ) = conn.execute('''
-                          SELECT COUNT(DISTINCT track)
-                          FROM track_artist JOIN track ON track.path = track
-                          WHERE playlist=?
-                          ''', (relpath,)).fetchone()
-
-        (self.has_tag_count,
-         ) = conn.execute('''
-                          SELECT COUNT(DISTINCT track)
-                          FROM track_tag JOIN track ON track.path = track
-                          WHERE playlist=?
-                          ''', (relpath,)).fetchone()
+
+# Statistics only change when the scanner changes tracks, so they are cached until the
+# library version changes. Last chosen timestamps change all the time, so those are
+# queried separately and never cached.
+_stats_cache: tuple[int, dict[str, tuple[int, ...]]] | None = None
+_stats_cache_lock = Lock()
+
+
+def _query_playlists_stats(conn: Connection) -> dict[str, tuple[int, ...]]:
+    rows = conn.execute('''
+                        SELECT playlist,
+                               COUNT(*),
+                               SUM(duration),
+                               AVG(duration),
+                               (SELECT COUNT(DISTINCT artist)
+                                FROM track_artist JOIN track AS artist_track ON artist_track.path = track_artist.track
+                                WHERE artist_track.playlist = track.playlist),
+                               SUM(title IS NOT NULL),
+                               SUM(album IS NOT NULL),
+                               SUM(album_artist IS NOT NULL),
+                               SUM(year IS NOT NULL),
+                               SUM(EXISTS(SELECT 1 FROM track_artist WHERE track_artist.track = track.path)),
+                               SUM(EXISTS(SELECT 1 FROM track_tag WHERE track_tag.track = track.path)),
+                               MAX(mtime)
+                        FROM track
+                        GROUP BY playlist
+                        ''')
+    return {row[0]: row[1:] for row in rows}
+
+
+def playlists_stats(conn: Connection) -> dict[str, PlaylistStats]:
+    """
+    Get statistics for all playlists at once
+    Returns: Dictionary with playlist name as key. Playlists without tracks are not included.
+    """
+    global _stats_cache
+    version = shuffle.library_version(conn)
+    with _stats_cache_lock:
+        if _stats_cache is None or _stats_cache[0] != version:
+            _stats_cache = (version, _query_playlists_stats(conn))
+        stats = _stats_cache[1]
+
+    choices = {playlist: (most_recent, least_recent)
+               for playlist, most_recent, least_recent
+               in conn.execute('SELECT playlist, MAX(last_chosen), MIN(last_chosen) FROM track GROUP BY playlist')}
+
+    result: dict[str, PlaylistStats] = {}
+    for playlist, (track_count, total_duration, mean_duration, artist_count,
+                   has_title_count, has_album_count, has_album_artist_count, has_year_count,
+                   has_artist_count, has_tag_count, most_recent_mtime) in stats.items():
+        most_recent_choice, least_recent_choice = choices.get(playlist, (0, 0))
+        result[playlist] = PlaylistStats(track_count, total_duration, mean_duration, artist_count,
+                                         has_title_count, has_album_count, has_album_artist_count,
+                                         has_year_count, has_artist_count, has_tag_count,
+                                         most_recent_choice, least_recent_choice, most_recent_mtime)
+    return result
+
+
+def _disliked_tracks(conn: Connection, user: User | None) -> list[str] | None:
+    """
+    Returns: Paths of tracks disliked by the user, or None if there is no user
+    """
+    if user is None:
+        return None
+    return [row[0] for row in conn.execute('SELECT track FROM dislikes WHERE user=?', (user.user_id,))]
 
 
 class TagMode(Enum):
@@ -567,53 +860,48 @@ class Playlist:
             tags: List of tags
         Returns: Track object
         """
-        query = """
-                SELECT track.path, last_chosen
-                FROM track
-                WHERE track.playlist=?
-                """
-        params: list[str | int] = [self.name]
+        disliked = _disliked_tracks(self.conn, user)
+        chosen = self._choose(disliked, require_metadata, tag_mode, tags)
+        if chosen is None:
+            return None
+
+        self.conn.execute('UPDATE track SET last_chosen = ? WHERE path=?', (int(time.time()), chosen))
 
-        if user is not None:
-            query += ' AND NOT EXISTS (SELECT 1 FROM dislikes WHERE user=? AND track=path)'
-            params.append(user.user_id)
+        track = Track.by_relpath(self.conn, chosen)
+        if track is None:
+            raise RuntimeError('Track has just been selected from the database so it must exist')
+        return track
+
+    def _choose(self,
+                exclude: list[str] | None,
+                require_metadata: bool,
+                tag_mode: TagMode | None,
+                tags: list[str] | None) -> str | None:
+        """
+        Randomly choose a track from this playlist's shuffle bag, without updating the database
+        Returns: Relative path of chosen track, or None if no track matches the filters
+        """
+        bag = shuffle.get_bag(self.conn, self.name)
 
-        track_tags_query = 'SELECT tag FROM track_tag WHERE track = track.path'
         if tag_mode == TagMode.ALLOW:
             assert tags is not None
-            query += ' AND (' + ' OR '.join(len(tags) * [f'? IN ({track_tags_query})']) + ')'
-            params.extend(tags)
+            chosen = bag.choose(require_metadata, allow_tags=tags, exclude=exclude)
         elif tag_mode == TagMode.DENY:
             assert tags is not None
-            query += ' AND (' + ' AND '.join(len(tags) * [f'? NOT IN ({track_tags_query})']) + ')'
-            params.extend(tags)
-
-        if require_metadata:
-            # Has at least metadata for: title, album, album artist, artists
-            query += ' AND title NOT NULL AND album NOT NULL AND EXISTS(SELECT artist FROM track_artist WHERE track = path)'
-
-        query += f' ORDER BY last_chosen ASC LIMIT {self.track_count // 4 + 1}'
-
-        # From selected least recently played tracks, choose a random one
-        query = 'SELECT * FROM (' + query + ') ORDER BY RANDOM() LIMIT 1'
+            chosen = bag.choose(require_metadata, deny_tags=tags, exclude=exclude)
+        else:
+            chosen = bag.choose(require_metadata, exclude=exclude)
 
-        row = self.conn.execute(query, params).fetchone()
-        if row is None:
+        if chosen is None:
             return None
-        track, last_chosen = row
-        current_timestamp = int(datetime.now().timestamp())
+
+        relpath, last_chosen = chosen
         if last_chosen == 0:
-            log.info('Chosen track: %s (never played)', track)
+            log.info('Chosen track: %s (never played)', relpath)
         else:
-            hours_ago = (current_timestamp - last_chosen) / 3600
-            log.info('Chosen track: %s (last played %.2f hours ago)', track, hours_ago)
-
-        self.conn.execute('UPDATE track SET last_chosen = ? WHERE path=?', (current_timestamp, track))
-
-        track = Track.by_relpath(self.conn, track)
-        if track is None:
-            raise RuntimeError('Track has just been selected from the database so it must exist')
-        return track
+            hours_ago = (int(time.time()) - last_chosen) / 3600
+            log.info('Chosen track: %s (last played %.2f hours ago)', relpath, hours_ago)
+        return relpath
 
     def has_write_permission(self, user: User) -> bool:
         """
@@ -630,11 +918,11 @@ class Playlist:
 
         return row is not None
 
-    def stats(self) -> PlaylistStats:
+    def stats(self) -> PlaylistStats | None:
         """
-        Returns: PlaylistStats
+        Returns: PlaylistStats, or None if the playlist has no tracks
         """
-        return PlaylistStats(self.conn, self.name)
+        return playlists_stats(self.conn).get(self.name)
 
     def tracks(self) -> list[Track]:
         tracks: list[Track] = []
@@ -656,7 +944,7 @@ class Playlist:
             name = relpath[:relpath.index('/')]
         except ValueError:  # No slash found
             name = relpath
-        track_count = conn.execute('SELECT COUNT(*) FROM track WHERE playlist=?',
+        track_count = conn.execute('SELECT track_count FROM playlist WHERE path=?',
                                 (name,)).fetchone()[0]
         return Playlist(conn, name, from_relpath(name), track_count)
 
@@ -676,7 +964,7 @@ def playlist(conn: Connection, name: str) -> Playlist:
     Returns: Playlist object
     """
     row = conn.execute('''
-                        SELECT (SELECT COUNT(*) FROM track WHERE playlist=playlist.path)
+                        SELECT track_count
                         FROM playlist
                         WHERE path=?
                         ''', (name,)).fetchone()
@@ -694,7 +982,7 @@ def user_playlist(conn: Connection, name: str, user_id: int) -> UserPlaylist:
     Returns: UserPlaylist object
     """
     row = conn.execute('''
-                       SELECT (SELECT COUNT(*) FROM track WHERE playlist=path),
+                       SELECT track_count,
                               EXISTS(SELECT 1 FROM user_playlist_write WHERE playlist=path AND user=:user) AS write,
                               EXISTS(SELECT 1 FROM user_playlist_favorite WHERE playlist=path AND user=:user) AS favorite
                        FROM playlist
@@ -711,7 +999,7 @@ def playlists(conn: Connection) -> list[Playlist]:
     Returns: List of Playlist objects
     """
     rows = conn.execute('''
-                        SELECT path, (SELECT COUNT(*) FROM track WHERE playlist=playlist.path)
+                        SELECT path, track_count
                         FROM playlist
                         ''')
     return [Playlist(conn, name, from_relpath(name), track_count)
@@ -728,7 +1016,7 @@ def user_playlists(conn: Connection, user_id: int, all_writable: bool = False) -
     """
     rows = conn.execute('''
                         SELECT path,
-                               (SELECT COUNT(*) FROM track WHERE playlist=playlist.path),
+                               track_count,
                                EXISTS(SELECT 1 FROM user_playlist_write WHERE playlist=path AND user=:user) AS write,
                                EXISTS(SELECT 1 FROM user_playlist_favorite WHERE playlist=path AND user=:user) AS favorite
                         FROM playlist
@@ -737,3 +1025,50 @@ def user_playlists(conn: Connection, user_id: int, all_writable: bool = False) -
 
     return [UserPlaylist(conn, name, from_relpath(name), track_count, write == 1 or all_writable, favorite == 1)
             for name, track_count, write, favorite in rows]
+
+
+def choose_tracks(conn: Connection,
+                  playlist_names: list[str],
+                  count: int,
+                  user: User | None,
+                  require_metadata: bool = False,
+                  tag_mode: TagMode | None = None,
+                  tags: list[str] | None = None) -> list[Track]:
+    """
+    Randomly choose multiple tracks, taking turns choosing from each playlist.
+    Args:
+        playlist_names: Playlists to choose from, in round robin order
+        count: Number of tracks to choose. Fewer tracks are returned if playlists run out of tracks.
+        tag_mode: 'allow' or 'deny'
+        tags: List of tags
+    Returns: List of Track objects
+    """
+    # Disliked tracks and tracks that have already been chosen are excluded
+    exclude = _disliked_tracks(conn, user) or []
+    candidate_playlists = [playlist(conn, name) for name in playlist_names]
+    chosen: list[str] = []
+
+    i = 0
+    while len(chosen) < count and candidate_playlists:
+        i %= len(candidate_playlists)
+        relpath = candidate_playlists[i]._choose(exclude, require_metadata, tag_mode, tags)  # pyright: ignore[reportPrivateUsage]
+        if relpath is None:
+            # No more tracks can be chosen from this playlist
+            del candidate_playlists[i]
+            continue
+        chosen.append(relpath)
+        exclude.append(relpath)
+        i += 1
+
+    # Update all tracks in a single statement
+    current_timestamp = int(time.time())
+    conn.executemany('UPDATE track SET last_chosen = ? WHERE path=?',
+                     [(current_timestamp, relpath) for relpath in chosen])
+
+    tracks: list[Track] = []
+    for relpath in chosen:
+        track = Track.by_relpath(conn, relpath)
+        if track is None:
+            raise RuntimeError('Track has just been selected from the database so it must exist')
+        tracks.append(track)
+    return tracks
@@ -1,15 +1,13 @@
 import logging
 import re
-import time
 import traceback
 from collections.abc import Iterator
 from dataclasses import dataclass
 from typing import Any
 
-import requests
 from requests.exceptions import HTTPError
 
-from raphson_mp import settings
+from raphson_mp import cache, httpclient, settings
 
 if settings.offline_mode:
     # Module must not be imported to ensure no data is ever downloaded in offline mode.
@@ -18,6 +16,14 @@ if settings.offline_mode:
 
 log = logging.getLogger(__name__)
 
+# https://musicbrainz.org/doc/MusicBrainz_API/Rate_Limiting
+_client = httpclient.Client('musicbrainz', 'https://musicbrainz.org/ws/2/', headers={'Accept': 'application/json'},
+                            rate_limit=1)
+# Cover Art Archive does not publish a rate limit, be polite anyway
+_coverartarchive_client = httpclient.Client('coverartarchive', 'https://coverartarchive.org/',
+                                            timeout=30,  # long timeout, internet archive can be slow
+                                            pool_hosts=4,  # redirects to archive.org servers
+                                            rate_limit=2, rate_limit_burst=2)
 
 # https://lucene.apache.org/core/4_3_0/queryparser/org/apache/lucene/queryparser/classic/package-summary.html#Escaping_Special_Characters
 # https://github.com/alastair/python-musicbrainzngs/blob/1638c6271e0beb9560243c2123d354461ec9f842/musicbrainzngs/musicbrainz.py#L27
@@ -29,22 +35,15 @@ def lucene_escape(text: str) -> str:
 
 
 def _mb_get(url: str, params: dict[str, str]) -> dict[str, Any]:
-    response = requests.get('https://musicbrainz.org/ws/2/' + url,
-                            headers={'Accept': 'application/json',
-                                     'User-Agent': settings.user_agent},
-                     params=params,
-                     timeout=10)
+    response = _client.get(url, params=params)
     response.raise_for_status()
     return response.json()
 
 
 def _get_release_group_cover(release_group: str) -> bytes | None:
-    url = f'https://coverartarchive.org/release-group/{release_group}/front-1200'
+    url = _coverartarchive_client.url(f'release-group/{release_group}/front-1200')
     log.info('downloading: %s', url)
-    response = requests.get(url,
-                            headers={'User-Agent': settings.user_agent},
-                            allow_redirects=True,
-                            timeout=30) # long timeout, internet archive can be slow
+    response = _coverartarchive_client.get(url, allow_redirects=True)
     if response.status_code == 404:
         log.info('release group has no image')
         return None
@@ -66,27 +65,56 @@ def _search_release_group(artist: str, title: str) -> str | None:
             log.info('Found release group: %s: %s (%s)', group['id'], group['title'], group['primary-type'])
             return group['id']
 
-        time.sleep(1) # avoid rate limit
-
     log.info('No release group found')
     return None
 
 
+def _cached_release_group(artist: str, album: str) -> str | None:
+    """
+    Like _search_release_group(), but cached. Also caches when no release group was found.
+    """
+    cache_key = f'mbreleasegroup{artist}{album}'
+    cached = cache.retrieve_json(cache_key)
+    if cached is not None:
+        return cached['id']
+
+    release_group = _search_release_group(artist, album)
+    cache.store_json(cache_key, {'id': release_group}, cache.HALFYEAR if release_group else cache.MONTH)
+    return release_group
+
+
+def _cached_release_group_cover(release_group: str) -> bytes | None:
+    """
+    Like _get_release_group_cover(), but cached. The original image is cached, so thumbnails can
+    be generated again without downloading it.
+    """
+    cache_key = f'mbcover{release_group}'
+    cached = cache.retrieve(cache_key)
+    if cached is not None:
+        return cached if cached else None
+
+    image_bytes = _get_release_group_cover(release_group)
+    if image_bytes is None:
+        cache.store(cache_key, b'', cache.MONTH)
+    else:
+        cache.store(cache_key, image_bytes, cache.YEAR)
+    return image_bytes
+
+
 def get_cover(artist: str, album: str) -> bytes | None:
     """
     Get album cover for the given artist and album
     Returns: Image bytes, or None of no album cover was found.
     """
     try:
-        release_group = _search_release_group(artist, album)
+        release_group = _cached_release_group(artist, album)
         if release_group is None:
             return None
 
-        image_bytes = _get_release_group_cover(release_group)
-        if image_bytes is None:
-            return None
-
-        return image_bytes
+        return _cached_release_group_cover(release_group)
+    except httpclient.CircuitOpenError as ex:
+        log.info('Not retrieving album art from musicbrainz: %s', ex)
+        return None
     except Exception as ex:
         log.info('Error retrieving album art from musicbrainz: %s', ex)
         traceback.print_exc()
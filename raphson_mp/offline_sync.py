@@ -1,5 +1,6 @@
 import logging
 import random
+import time
 from sqlite3 import Connection
 
 from raphson_mp import db, settings
@@ -46,7 +47,14 @@ class OfflineSync:
              'cover_data': download.image,
              'lyrics_json': download.lyrics_json})
 
-    async def _update_track(self, track: Track) -> None:
+    def _log_change(self, action: str, playlist: str, path: str) -> None:
+        """
+        Add scanner log entry, so in-memory caches that depend on the track table are refreshed
+        """
+        self.db_music.execute('INSERT INTO scanner_log (timestamp, action, playlist, track) VALUES (?, ?, ?, ?)',
+                              (int(time.time()), action, playlist, path))
+
+    async def _update_track(self, playlist: str, track: Track) -> None:
         await self._download_track_content(track)
 
         self.db_music.execute('UPDATE track SET duration=?, title=?, album=?, album_artist=?, year=?, mtime=? WHERE path=?',
@@ -55,6 +63,7 @@ class OfflineSync:
         self.db_music.execute('DELETE FROM track_artist WHERE track=?', (track.path,))
         self.db_music.executemany('INSERT INTO track_artist (track, artist) VALUES (?, ?)',
                                   [(track.path, artist) for artist in track.artists])
+        self._log_change('update', playlist, track.path)
 
     async def _insert_track(self, playlist: str, track: Track) -> None:
         await self._download_track_content(track)
@@ -69,14 +78,16 @@ class OfflineSync:
         )
         self.db_music.executemany('INSERT INTO track_artist (track, artist) VALUES (?, ?)',
                                   [(track.path, artist) for artist in track.artists])
+        self._log_change('insert', playlist, track.path)
 
     def _prune_tracks(self, track_paths: set[str]):
-        rows = self.db_music.execute('SELECT path FROM track').fetchall()
-        for path, in rows:
+        rows = self.db_music.execute('SELECT path, playlist FROM track').fetchall()
+        for path, playlist in rows:
             if path not in track_paths:
                 log.info('Delete: %s', path)
                 self.db_offline.execute('DELETE FROM content WHERE path=?', (path,))
                 self.db_music.execute('DELETE FROM track WHERE path=?', (path,))
+                self._log_change('delete', playlist, path)
 
     def _prune_playlists(self):
         # Remove empty playlists
@@ -99,7 +110,7 @@ class OfflineSync:
                                   force_resync: float):
         log.info('Syncing playlist: %s', playlist)
 
-        self.db_music.execute('INSERT INTO playlist VALUES (?) ON CONFLICT (path) DO NOTHING',
+        self.db_music.execute('INSERT INTO playlist (path) VALUES (?) ON CONFLICT (path) DO NOTHING',
                                   (playlist,))
 
         tracks = await self.client.list_tracks(playlist)
@@ -116,10 +127,10 @@ class OfflineSync:
                 mtime, = row
                 if mtime != track.mtime:
                     log.info('Out of date: %s', track.path)
-                    await self._update_track(track)
+                    await self._update_track(playlist, track)
                 elif force_resync > 0 and random.random() < force_resync:
                     log.info('Force resync: %s', track.path)
-                    await self._update_track(track)
+                    await self._update_track(playlist, track)
             else:
                 log.info('Missing: %s', track.path)
                 await self._insert_track(playlist, track)
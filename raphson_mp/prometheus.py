@@ -1,9 +1,11 @@
 import functools
 import time
 
-from prometheus_client import Gauge
+from prometheus_client import REGISTRY, Gauge
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import Collector
 
-from raphson_mp import db
+from raphson_mp import db, httpclient, lyrics, scanner
 
 
 def _active_players():
@@ -19,3 +21,44 @@ for db_name in db.DATABASE_NAMES:
 
 # Active players
 Gauge('active_players', 'Active players').set_function(_active_players)
+
+# Scanner
+Gauge('scanner_files_total', 'Number of new or changed files in playlist being scanned').set_function(lambda: scanner.status.total)
+Gauge('scanner_files_processed', 'Number of files processed in playlist being scanned').set_function(lambda: scanner.status.processed)
+Gauge('scanner_errors', 'Number of files that could not be scanned').set_function(lambda: scanner.status.errors)
+
+# Lyrics
+g_lyrics_requests = Gauge('lyrics_requests', 'Number of lyrics searches by provider and result', labelnames=('fetcher', 'result'))
+g_lyrics_seconds = Gauge('lyrics_mean_seconds', 'Mean duration of lyrics searches by provider', labelnames=('fetcher',))
+for fetcher_name, fetcher_stats in lyrics.stats.items():
+    g_lyrics_requests.labels(fetcher_name, 'found').set_function(lambda s=fetcher_stats: s.found)
+    g_lyrics_requests.labels(fetcher_name, 'not_found').set_function(lambda s=fetcher_stats: s.not_found)
+    g_lyrics_requests.labels(fetcher_name, 'error').set_function(lambda s=fetcher_stats: s.errors)
+    g_lyrics_seconds.labels(fetcher_name).set_function(fetcher_stats.mean_seconds)
+
+
+class HttpClientCollector(Collector):
+    """
+    Requests to external services. Clients are created when a module is first used, so the
+    set of services is only known at collection time.
+    """
+
+    def collect(self):
+        requests = CounterMetricFamily('http_client_requests', 'Requests to external services by result',
+                                       labels=('service', 'result'))
+        seconds = CounterMetricFamily('http_client_request_seconds', 'Total duration of requests to external services',
+                                      labels=('service',))
+        circuit_open = GaugeMetricFamily('http_client_circuit_open', 'Whether requests to an external service are skipped because it is down',
+                                         labels=('service',))
+        for name, client in list(httpclient.clients.items()):
+            requests.add_metric((name, 'success'), client.successes)
+            requests.add_metric((name, 'failure'), client.failures)
+            requests.add_metric((name, 'rejected'), client.rejected)
+            seconds.add_metric((name,), client.total_seconds)
+            circuit_open.add_metric((name,), int(client.is_open))
+        yield requests
+        yield seconds
+        yield circuit_open
+
+
+REGISTRY.register(HttpClientCollector())
@@ -1,15 +1,20 @@
 import logging
 import random
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from sqlite3 import Connection
 from typing import cast
 
-from raphson_mp import music, settings
-from raphson_mp.music import Track
+from raphson_mp import db, image, music, settings
+from raphson_mp.image import ImageFormat
+from raphson_mp.music import AudioType, Track
 
 log = logging.getLogger(__name__)
 
+# Finds covers and lyrics for scheduled tracks, one track at a time
+_warm_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='radio-warm')
+
 
 @dataclass
 class RadioTrack:
@@ -61,42 +66,75 @@ def get_current_track(conn: Connection) -> RadioTrack:
     return RadioTrack(current_track, start_time)
 
 
-def get_next_track(conn: Connection) -> RadioTrack:
-    current_time = int(time.time() * 1000)
-
-    current_track_info = conn.execute('''
-                                        SELECT radio_track.start_time + track.duration*1000 AS end_time, track.playlist
-                                        FROM radio_track JOIN track ON radio_track.track = track.path
-                                        WHERE radio_track.start_time < ? AND end_time > ?
-                                        ORDER BY radio_track.start_time ASC
-                                        LIMIT 1
-                                        ''',
-                                        (current_time, current_time)).fetchone()
-
-    next_track_info = conn.execute('''
-                                    SELECT track, start_time
-                                    FROM radio_track
-                                    WHERE start_time >= ?
-                                    ORDER BY start_time ASC
-                                    LIMIT 1
-                                    ''',
+def _warm(relpath: str) -> None:
+    try:
+        with db.connect(read_only=True) as conn:
+            track = Track.by_relpath(conn, relpath)
+            if track is None:
+                log.info('Not warming radio track, track was deleted: %s', relpath)
+                return
+            track.get_cover(False, image.QUALITY_HIGH, ImageFormat.WEBP)
+            track.lyrics(background=True)
+    except Exception:
+        log.exception('Error warming radio track: %s', relpath)
+
+
+def _schedule_lookahead(conn: Connection, current_time: int) -> None:
+    """
+    Choose tracks until settings.radio_lookahead tracks are scheduled after the current track. Audio,
+    cover and lyrics of newly chosen tracks are prepared in the background, so they are ready by
+    the time a client requests them.
+    """
+    scheduled_count, = conn.execute('SELECT COUNT(*) FROM radio_track WHERE start_time >= ?',
                                     (current_time,)).fetchone()
+    if scheduled_count >= settings.radio_lookahead:
+        return
+
+    # Remove tracks that have finished playing, so the table does not grow forever
+    conn.execute('''
+                 DELETE FROM radio_track
+                 WHERE rowid IN (SELECT radio_track.rowid
+                                 FROM radio_track JOIN track ON radio_track.track = track.path
+                                 WHERE radio_track.start_time + track.duration*1000 < ?)
+                 ''',
+                 (current_time,))
+
+    for _i in range(settings.radio_lookahead - scheduled_count):
+        last_track_info = conn.execute('''
+                                       SELECT radio_track.start_time + track.duration*1000 AS end_time, track.playlist
+                                       FROM radio_track JOIN track ON radio_track.track = track.path
+                                       ORDER BY radio_track.start_time DESC
+                                       LIMIT 1
+                                       ''').fetchone()
+
+        if last_track_info is None or last_track_info[0] <= current_time:
+            raise ValueError('Cannot choose next track when current track has not been chosen')
 
-    if next_track_info is None:
+        (last_track_end_time, last_track_playlist) = last_track_info
+
+        # Choose next track starting right after the last scheduled track
         log.info('Choose next track')
+        track = _choose_track(conn, previous_playlist=last_track_playlist)
+        conn.execute('INSERT INTO radio_track (track, start_time) VALUES (?, ?)',
+                     (track.relpath, last_track_end_time))
 
-        if current_track_info is None:
-            raise ValueError('Cannot choose next track when current track has not been chosen')
+        if not settings.offline_mode:
+            music.warm_transcode(track, AudioType.WEBM_OPUS_HIGH)
+            _warm_executor.submit(_warm, track.relpath)
 
-        (current_track_end_time, current_track_playlist) = current_track_info
 
-        # Choose next track starting right after current track
-        track = _choose_track(conn, previous_playlist=current_track_playlist)
-        conn.execute('INSERT INTO radio_track (track, start_time) VALUES (?, ?)',
-                        (track.relpath, current_track_end_time))
-        return RadioTrack(track, current_track_end_time)
+def get_next_track(conn: Connection) -> RadioTrack:
+    current_time = int(time.time() * 1000)
+
+    _schedule_lookahead(conn, current_time)
 
-    log.info('Returning already chosen next track')
-    (track_path, start_time) = next_track_info
+    (track_path, start_time) = conn.execute('''
+                                            SELECT track, start_time
+                                            FROM radio_track
+                                            WHERE start_time >= ?
+                                            ORDER BY start_time ASC
+                                            LIMIT 1
+                                            ''',
+                                            (current_time,)).fetchone()
     track = cast(Track, Track.by_relpath(conn, track_path))
     return RadioTrack(track, start_time)
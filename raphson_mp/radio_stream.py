@@ -0,0 +1,294 @@
+"""
+Continuous Ogg/Opus radio stream, shared by all listeners.
+
+Tracks are played according to the radio schedule (see radio.py), so listeners of the stream hear
+the same as users of the radio page. A single ffmpeg encoder process produces the stream. For every
+track, a decoder process writes raw audio in real time to the encoder, using the transcoded (and
+loudness normalized) audio from the cache. Listeners receive Ogg pages from a shared buffer, so an
+extra listener costs a socket write, not a transcode.
+"""
+import logging
+import subprocess
+import tempfile
+import time
+from collections import deque
+from collections.abc import Generator, Iterator
+from threading import Condition, Lock, Thread
+from typing import IO
+
+from raphson_mp import db, music, radio, settings
+from raphson_mp.music import AudioType
+
+log = logging.getLogger(__name__)
+
+SAMPLE_RATE = 48000
+CHANNELS = 2
+BYTES_PER_FRAME = CHANNELS * 2  # signed 16 bit samples
+
+# The ffmpeg Ogg muxer writes a page every second, keep the last 30 seconds
+BUFFER_PAGES = 30
+# Pages sent immediately to a new listener, so playback can start without waiting
+BURST_PAGES = 3
+# Maximum number of simultaneous listeners. Every listener occupies a web server thread.
+MAX_LISTENERS = 16
+# Stop transcoding after nobody has listened for this long
+IDLE_SECONDS = 60
+
+
+class RadioStream:
+    headers: bytes | None  # OpusHead and OpusTags pages, sent to every listener first
+    pages: deque[tuple[int, bytes]]  # sequence number and page
+    sequence: int
+    listeners: int
+    last_listener_time: float
+    running: bool
+    condition: Condition
+    _in_headers: bool  # whether the previous page contained (part of) a header packet
+    _encoder: subprocess.Popen[bytes]
+
+    def __init__(self):
+        self.headers = None
+        self.pages = deque(maxlen=BUFFER_PAGES)
+        self.sequence = 0
+        self.listeners = 0
+        self.last_listener_time = time.monotonic()
+        self.running = True
+        self.condition = Condition()
+        self._in_headers = False
+
+    def _is_idle(self) -> bool:
+        with self.condition:
+            return self.listeners == 0 and time.monotonic() - self.last_listener_time > IDLE_SECONDS
+
+    def _add_page(self, page: bytes) -> None:
+        body = page[27 + page[26]:]
+        # A page with the continued packet flag holds the rest of a packet from the previous page,
+        # for example when OpusTags does not fit in a single page
+        continued = page[5] & 0x01
+        with self.condition:
+            if body.startswith(b'OpusHead') or body.startswith(b'OpusTags') or (continued and self._in_headers):
+                self._in_headers = True
+                self.headers = (self.headers or b'') + page
+            else:
+                self._in_headers = False
+                self.sequence += 1
+                self.pages.append((self.sequence, page))
+            self.condition.notify_all()
+
+    def _read_pages(self) -> None:
+        stdout = self._encoder.stdout
+        assert stdout is not None
+        try:
+            while page := _read_page(stdout):
+                self._add_page(page)
+        finally:
+            with self.condition:
+                self.running = False
+                self.condition.notify_all()
+
+    def _write_silence(self, seconds: float) -> None:
+        """
+        Write silence in real time, for when a track ends before the next track is scheduled to start
+        """
+        stdin = self._encoder.stdin
+        assert stdin is not None
+        end_time = time.time() + seconds
+        while (remaining := end_time - time.time()) > 0:
+            chunk_seconds = min(remaining, 0.1)
+            frames = int(chunk_seconds * SAMPLE_RATE)
+            stdin.write(bytes(frames * BYTES_PER_FRAME))
+            time.sleep(chunk_seconds)
+
+    def _play(self, track: music.Track, start_time: int) -> bool:
+        """
+        Decode track to the encoder, starting at the position it should be at according to the
+        radio schedule
+        Returns: False if playback was stopped because there are no listeners
+        """
+        offset = time.time() - start_time / 1000
+        if offset < 0:
+            self._write_silence(-offset)
+            offset = 0
+
+        audio = track.transcoded_audio(AudioType.WEBM_OPUS_HIGH)
+
+        log.info('Streaming: %s', track.relpath)
+        with tempfile.NamedTemporaryFile(prefix='music-radio') as temp_input:
+            temp_input.write(audio)
+            temp_input.flush()
+
+            decoder = subprocess.Popen(['ffmpeg',
+                                        *settings.ffmpeg_flags(),
+                                        '-re',  # real time
+                                        '-ss', str(offset),
+                                        '-i', temp_input.name,
+                                        '-f', 's16le',
+                                        '-ar', str(SAMPLE_RATE),
+                                        '-ac', str(CHANNELS),
+                                        'pipe:1'],
+                                       stdout=self._encoder.stdin,
+                                       shell=False)
+            while True:
+                try:
+                    decoder.wait(timeout=5)
+                    return True
+                except subprocess.TimeoutExpired:
+                    if self._is_idle():
+                        decoder.kill()
+                        decoder.wait()
+                        return False
+
+    def _feed(self) -> None:
+        try:
+            with db.connect() as conn:
+                current = radio.get_current_track(conn)
+                relpath, start_time = current.track.relpath, current.start_time
+
+            while not self._is_idle():
+                with db.connect() as conn:
+                    # Tracks are transcoded in the background when they are scheduled
+                    next_track = radio.get_next_track(conn)
+
+                with db.connect(read_only=True) as conn:
+                    track = music.Track.by_relpath(conn, relpath)
+                    if track is not None and not self._play(track, start_time):
+                        break
+
+                relpath, start_time = next_track.track.relpath, next_track.start_time
+        except Exception:
+            log.exception('Error in radio stream')
+        finally:
+            log.info('Stopping radio stream')
+            self._encoder.kill()
+            self._encoder.wait()
+
+    def start(self) -> None:
+        self._encoder = subprocess.Popen(['ffmpeg',
+                                          *settings.ffmpeg_flags(),
+                                          '-f', 's16le',
+                                          '-ar', str(SAMPLE_RATE),
+                                          '-ac', str(CHANNELS),
+                                          '-i', 'pipe:0',
+                                          '-c:a', 'libopus',
+                                          '-b:a', '128k',
+                                          '-f', 'ogg',
+                                          'pipe:1'],
+                                         stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE,
+                                         shell=False)
+        Thread(target=self._read_pages, name='radio-stream-pages', daemon=True).start()
+        Thread(target=self._feed, name='radio-stream-feed', daemon=True).start()
+
+    def listen(self) -> 'Listener | None':
+        """
+        Reserve a listener slot, which is released when the listener is closed
+        Returns: Listener, or None if there are too many listeners
+        """
+        with self.condition:
+            if self.listeners >= MAX_LISTENERS:
+                return None
+            self.listeners += 1
+        return Listener(self)
+
+    def release(self) -> None:
+        with self.condition:
+            self.listeners -= 1
+            self.last_listener_time = time.monotonic()
+
+    def data(self) -> Generator[bytes, None, None]:
+        """
+        Returns: Ogg stream data, starting with the stream headers and recent pages
+        """
+        with self.condition:
+            while self.running and self.headers is None:
+                self.condition.wait()
+            if not self.running or self.headers is None:
+                return
+            headers = self.headers
+            sequence = max(self.sequence - BURST_PAGES, 0)
+
+        yield headers
+
+        while True:
+            with self.condition:
+                while self.running and self.sequence <= sequence:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                # A listener that cannot keep up skips pages no longer in the buffer
+                data = b''.join(page for page_sequence, page in self.pages if page_sequence > sequence)
+                sequence = self.sequence
+            yield data
+
+
+class Listener(Iterator[bytes]):
+    """
+    Response body for a single listener. The web server closes it when the response has finished
+    or the client has disconnected, even if the response was never iterated.
+    """
+    _stream: RadioStream
+    _data: Generator[bytes, None, None]
+    _closed: bool
+
+    def __init__(self, stream: RadioStream):
+        self._stream = stream
+        self._data = stream.data()
+        self._closed = False
+
+    def __next__(self) -> bytes:
+        return next(self._data)
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._data.close()
+        self._stream.release()
+
+
+def _read_exact(stream: IO[bytes], size: int) -> bytes | None:
+    data = b''
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def _read_page(stream: IO[bytes]) -> bytes | None:
+    """
+    Read a single Ogg page
+    Returns: Page bytes, or None at the end of the stream
+    """
+    header = _read_exact(stream, 27)
+    if header is None:
+        return None
+    assert header[:4] == b'OggS', header[:4]
+    segment_table = _read_exact(stream, header[26])
+    if segment_table is None:
+        return None
+    body = _read_exact(stream, sum(segment_table))
+    if body is None:
+        return None
+    return header + segment_table + body
+
+
+_stream: RadioStream | None = None
+_stream_lock = Lock()
+
+
+def listen() -> Listener | None:
+    """
+    Listen to the radio stream, starting it if it is not running
+    Returns: Listener, or None if there are too many listeners
+    """
+    global _stream  # pylint: disable=global-statement
+    with _stream_lock:
+        if _stream is None or not _stream.running:
+            log.info('Starting radio stream')
+            stream = RadioStream()
+            stream.start()
+            _stream = stream
+
+        return _stream.listen()
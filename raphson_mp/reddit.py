@@ -1,9 +1,7 @@
 import logging
 import random
 
-import requests
-
-from raphson_mp import settings
+from raphson_mp import httpclient, image
 
 log = logging.getLogger(__name__)
 
@@ -23,12 +21,13 @@ MEME_SUBREDDITS = [
 
 SUBREDDIT_ATTEMPTS = 2
 
+# Also used to download images from reddit image hosts
+_client = httpclient.Client('reddit', 'https://www.reddit.com/', pool_hosts=4)
+
 
 def _search(subreddit: str | None, query: str) -> str | None:
     log.info('Searching subreddit %s for: %s', subreddit if subreddit else "ALL", query)
 
-    headers = {'User-Agent': settings.user_agent}
-
     params = {
         'q': query,
         'raw_json': '1',
@@ -41,10 +40,7 @@ def _search(subreddit: str | None, query: str) -> str | None:
         params['restrict_sr'] = '1'
 
 
-    r = requests.get(f'https://www.reddit.com/r/{subreddit}/search.json',
-                     timeout=10,
-                     params=params,
-                     headers=headers)
+    r = _client.get(f'r/{subreddit}/search.json', params=params)
 
     json = r.json()
 
@@ -86,9 +82,7 @@ def get_image(query: str) -> bytes | None:
     if image_url is None:
         return None
 
-    r = requests.get(image_url,
-                     timeout=10,
-                     headers={'User-Agent': settings.user_agent})
+    r = _client.get(image_url)
 
     if r.status_code != 200:
         log.warning('Received status code %s while downloading image from Reddit', r.status_code)
@@ -96,6 +90,7 @@ def get_image(query: str) -> bytes | None:
 
     image_bytes = r.content
 
-    # if not image.check_valid(image_bytes):
-        # return None
+    if not image.check_valid(image_bytes):
+        log.warning('Downloaded image from Reddit is corrupt or in an unsupported format')
+        return None
     return image_bytes
@@ -0,0 +1,105 @@
+"""
+In-memory cache for JSON responses that only change when the music library changes.
+Cached responses are keyed by the library version, see shuffle.library_version().
+"""
+import hashlib
+import logging
+from collections import OrderedDict
+from collections.abc import Callable
+from datetime import datetime
+from sqlite3 import Connection
+from threading import Lock
+from typing import Any
+
+from flask import Response, request
+
+from raphson_mp import jsonw, shuffle
+
+log = logging.getLogger(__name__)
+
+# Least recently used entries are removed when either limit is exceeded
+MAX_ENTRIES = 512
+MAX_SIZE = 64*1024*1024
+
+_version: int = -1
+_entries: OrderedDict[tuple[str, ...], tuple[bytes, str]] = OrderedDict()
+_size: int = 0
+_lock = Lock()
+
+
+def _retrieve(version: int, key: tuple[str, ...]) -> tuple[bytes, str] | None:
+    with _lock:
+        if version != _version:
+            return None
+        entry = _entries.get(key)
+        if entry is not None:
+            _entries.move_to_end(key)
+        return entry
+
+
+def _store(version: int, key: tuple[str, ...], entry: tuple[bytes, str]) -> None:
+    global _version, _size
+    with _lock:
+        if version < _version:
+            # Produced using an older database snapshot
+            return
+
+        if version > _version:
+            log.debug('library version changed to %s, clearing cache', version)
+            _entries.clear()
+            _size = 0
+            _version = version
+
+        if key in _entries:
+            return
+
+        _entries[key] = entry
+        _size += len(entry[0])
+
+        while len(_entries) > MAX_ENTRIES or _size > MAX_SIZE:
+            _key, (body, _etag) = _entries.popitem(last=False)
+            _size -= len(body)
+
+
+def etag(body: bytes) -> str:
+    """
+    Returns: Strong ETag for response body
+    """
+    return hashlib.blake2s(body, digest_size=16).hexdigest()
+
+
+def conditional_response(body: bytes, body_etag: str, last_modified: datetime | None = None) -> Response:
+    """
+    Create JSON response with ETag. Responds with 304 Not Modified if the client already
+    has this response.
+    """
+    response = Response(body, content_type='application/json')
+    response.set_etag(body_etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True  # always revalidate cache
+    return response.make_conditional(request)
+
+
+def json_response(conn: Connection,
+                  key: tuple[str, ...],
+                  func: Callable[[], Any],
+                  last_modified: datetime | None = None) -> Response:
+    """
+    Get JSON response from cache, or create it if it is not cached yet.
+    Args:
+        conn: Database connection, used to determine library version
+        key: Endpoint name and all request inputs that influence the response
+        func: Function that returns the object to convert to json, using only data
+              from the music library (no user specific data).
+        last_modified: Optional Last-Modified time, for clients that do not support ETags
+    """
+    version = shuffle.library_version(conn)
+
+    entry = _retrieve(version, key)
+    if entry is None:
+        body = jsonw.to_json(func()).encode()
+        entry = (body, etag(body))
+        _store(version, key, entry)
+
+    return conditional_response(*entry, last_modified=last_modified)
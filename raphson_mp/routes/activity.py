@@ -8,7 +8,7 @@ from typing import Any, cast
 from flask import Blueprint, Response, abort, render_template, request
 from flask_babel import _, format_timedelta
 
-from raphson_mp import auth, db
+from raphson_mp import auth, db, scanner
 from raphson_mp.auth import PrivacyOption, StandardUser, User
 from raphson_mp.decorators import route
 from raphson_mp.music import Track
@@ -105,6 +105,21 @@ def route_data(conn: Connection, user: User):
             'file_changes': file_changes}
 
 
+@route(bp, '/scanner', require_admin=True)
+def route_scanner(conn: Connection, user: User):
+    """
+    Progress of the music scanner in JSON format
+    """
+    status = scanner.status
+    return {'running': status.running,
+            'playlist': status.playlist,
+            'processed': status.processed,
+            'total': status.total,
+            'errors': status.errors,
+            'files_per_second': round(status.files_per_second(), 1) if status.playlist else None,
+            'eta': status.eta_seconds()}
+
+
 @route(bp, '/files')
 def route_files(conn: Connection, user: User):
     """
@@ -1,5 +1,6 @@
 from collections.abc import Iterator
 import logging
+import os
 from sqlite3 import Connection
 import tempfile
 from pathlib import Path
@@ -51,12 +52,17 @@ def route_ytdl(conn: Connection, user: User):
     # Release database connection during download
 
     def generate() -> Iterator[str]:
+        # Downloaded files are found by comparing directory contents before and after the download
+        mtimes_before = {entry.name: entry.stat().st_mtime for entry in os.scandir(playlist.path)}
         status_code = yield from downloader.download(playlist.path, url)
         if status_code == 0:
-            yield 'Scanning playlists...\n'
+            yield 'Scanning downloaded files...\n'
             with db.connect() as writable_conn:
-                playlist2 = music.playlist(conn, directory)
-                scanner.scan_tracks(writable_conn, playlist2.name)
+                for entry in os.scandir(playlist.path):
+                    if entry.is_file() and mtimes_before.get(entry.name) != entry.stat().st_mtime:
+                        path = Path(entry.path)
+                        if music.is_music_file(path):
+                            scanner.scan_track(writable_conn, playlist.name, path, music.to_relpath(path))
             yield 'Done!'
         else:
             yield f'Failed with status code {status_code}'
@@ -6,7 +6,7 @@ from urllib.parse import quote as urlencode
 from flask import (Blueprint, Response, abort, redirect, render_template,
                    request, send_file)
 
-from raphson_mp import auth, db, music, scanner, settings, util
+from raphson_mp import auth, cache, db, music, scanner, settings, util
 from raphson_mp.decorators import route
 from raphson_mp.music import Playlist, Track
 from raphson_mp.util import send_directory
@@ -86,15 +86,20 @@ def route_upload(conn: Connection, user: User):
     if len(request.files.getlist('upload')) == 0:
         abort(400, 'No files provided.')
 
+    uploaded_paths: list[Path] = []
     for uploaded_file in request.files.getlist('upload'):
         if uploaded_file.filename is None or uploaded_file.filename == '':
             abort(400, 'Blank file name. Did you select a file?')
 
         util.check_filename(uploaded_file.filename)
-        uploaded_file.save(Path(upload_dir, uploaded_file.filename))
+        path = Path(upload_dir, uploaded_file.filename)
+        uploaded_file.save(path)
+        uploaded_paths.append(path)
 
     with db.connect() as writable_conn:
-        scanner.scan_tracks(writable_conn, playlist.name)
+        for path in uploaded_paths:
+            if music.is_music_file(path):
+                scanner.scan_track(writable_conn, playlist.name, path, music.to_relpath(path))
 
     return redirect('/files?path=' + urlencode(music.to_relpath(upload_dir)), code=303)
 
@@ -119,11 +124,28 @@ def route_rename(conn: Connection, user: User):
         if not playlist.has_write_permission(user):
             abort(403, 'No write permission for this playlist')
 
-        path.rename(Path(path.parent, new_name))
+        new_path = Path(path.parent, new_name)
+        old_relpath = music.to_relpath(path)
+        path.rename(new_path)
+        new_relpath = music.to_relpath(new_path)
 
+        cache_keys: list[tuple[str, str]] | None = None
         with db.connect() as writable_conn:
-            # TODO use scanner.scan_track to only scan the two changed tracks
-            scanner.scan_tracks(writable_conn, playlist.name)
+            if path.parent == settings.music_dir:
+                # Renamed playlist directory
+                scanner.scan_playlists(writable_conn)
+                scanner.scan_tracks(writable_conn, new_name)
+            elif new_path.is_dir():
+                cache_keys = scanner.move_directory(writable_conn, old_relpath, new_relpath)
+            elif not music.is_music_file(new_path) or (cache_keys := scanner.move_track(writable_conn, old_relpath, new_relpath)) is None:
+                # Not a known track before, or not a music file anymore after renaming
+                scanner.scan_track(writable_conn, playlist.name, path, old_relpath)
+                if music.is_music_file(new_path):
+                    scanner.scan_track(writable_conn, playlist.name, new_path, new_relpath)
+
+        if cache_keys:
+            # Only after the moves have been committed
+            cache.move(cache_keys)
 
         if request.is_json:
             return Response(None, 200)
@@ -3,15 +3,17 @@ from sqlite3 import Connection
 import subprocess
 import tempfile
 
-import requests
 from flask import Blueprint, Response, abort
 
-from raphson_mp import settings
+from raphson_mp import httpclient, settings
 from raphson_mp.auth import User
 from raphson_mp.decorators import route
 
 bp = Blueprint('news', __name__, url_prefix='/news')
 
+# The news server responds with 503 until it has news, which is expected and should not be retried
+_client = httpclient.Client('news', retries=0, circuit_breaker=False)
+
 
 @route(bp, '/audio')
 def audio(_conn: Connection, _user: User):
@@ -20,10 +22,7 @@ def audio(_conn: Connection, _user: User):
             abort(503, 'news server not configured')
 
         # Download wave audio to temp file
-        with requests.get(settings.news_server + '/news.wav',
-                          headers={'User-Agent': settings.user_agent},
-                          timeout=10,
-                          stream=True) as response:
+        with _client.get(settings.news_server + '/news.wav', stream=True) as response:
             # News is only kept in temporary storage, if the news service has just
             # started it won't have news cached yet.
             if response.status_code == 503:
@@ -1,4 +1,5 @@
 import shutil
+from pathlib import Path
 from sqlite3 import Connection
 import time
 from typing import cast
@@ -51,9 +52,8 @@ def route_copy_track(conn: Connection, user: User):
     if track.playlist == playlist.name:
         abort(400, 'track already in playlist')
 
-    shutil.copy(track.path, playlist.path)
+    new_path = Path(shutil.copy(track.path, playlist.path))
 
-    # TODO use scanner.scan_track to only scan the newly added track
-    scanner.scan_tracks(conn, playlist.name)
+    scanner.scan_track(conn, playlist.name, new_path, music.to_relpath(new_path))
 
     return Response(None, 200)
@@ -6,13 +6,13 @@ from typing import cast
 from flask import (Blueprint, abort, redirect, render_template,
                    request)
 
-from raphson_mp import (db, jsonw, metadata, music, scanner, settings,
-                        spotify, util)
+from raphson_mp import (db, jsonw, metadata, music, respcache, scanner,
+                        settings, spotify, util)
 from raphson_mp.auth import User
 from raphson_mp.decorators import route
 from raphson_mp.metadata import normalize_title
 from raphson_mp.spotify import SpotifyTrack
-from raphson_mp.music import TagMode
+from raphson_mp.music import AudioType, TagMode
 
 bp = Blueprint('playlists', __name__, url_prefix='/playlist')
 
@@ -27,9 +27,11 @@ def route_playlists(conn: Connection, user: User):
     primary_playlist, = conn.execute('SELECT primary_playlist FROM user WHERE id=?',
                                         (user.user_id,)).fetchone()
 
+    stats = music.playlists_stats(conn)
     playlists_stats = [{'name': playlist.name,
-                        'stats': playlist.stats()}
-                        for playlist in user_playlists]
+                        'stats': stats[playlist.name]}
+                        for playlist in user_playlists
+                        if playlist.name in stats]
 
     spotify_available = settings.spotify_api_id and settings.spotify_api_secret
 
@@ -125,9 +127,9 @@ def route_list(conn: Connection, user: User):
                 'write': playlist.write}
             for playlist in user_playlists
             if playlist.track_count > 0]
-    response = jsonw.json_response(json)
-    response.cache_control.max_age = 60
-    return response
+    # Favorite and write permissions are not part of the library version, so use a content hash
+    body = jsonw.to_json(json).encode()
+    return respcache.conditional_response(body, respcache.etag(body))
 
 
 @route(bp, '/<playlist_name>/choose_track', methods=['POST'], write=True)
@@ -147,9 +149,37 @@ def route_track(conn: Connection, user: User, playlist_name: str):
     if chosen_track is None:
         abort(404, 'no track found')
 
+    if 'audio_type' in request.json:
+        music.warm_transcode(chosen_track, AudioType.from_value(cast(str, request.json['audio_type'])))
+
     return chosen_track.info_dict()
 
 
+@route(bp, '/choose_tracks', methods=['POST'], write=True)
+def route_tracks(conn: Connection, user: User):
+    """
+    Choose multiple random tracks at once, taking turns choosing from the provided playlists.
+    """
+    playlist_names = cast(list[str], request.json['playlists'])
+    count = cast(int, request.json['count']) if 'count' in request.json else len(playlist_names)
+    if count < 1 or count > 50:
+        abort(400, 'count must be between 1 and 50')
+    require_metadata: bool = cast(bool, request.json['require_metadata']) if 'require_metadata' in request.json else False
+    if 'tag_mode' in request.json:
+        tag_mode = TagMode.from_value(cast(str, request.json['tag_mode']))
+        tags = cast(list[str], request.json['tags'])
+        chosen_tracks = music.choose_tracks(conn, playlist_names, count, user, require_metadata=require_metadata, tag_mode=tag_mode, tags=tags)
+    else:
+        chosen_tracks = music.choose_tracks(conn, playlist_names, count, user, require_metadata=require_metadata)
+
+    if 'audio_type' in request.json:
+        audio_type = AudioType.from_value(cast(str, request.json['audio_type']))
+        for track in chosen_tracks:
+            music.warm_transcode(track, audio_type)
+
+    return {'tracks': [track.info_dict() for track in chosen_tracks]}
+
+
 def _fuzzy_match_track(spotify_normalized_title: str, local_track_key: tuple[str, tuple[str]], spotify_track: SpotifyTrack) -> bool:
     (local_track_normalized_title, local_track_artists) = local_track_key
     if not util.str_match(spotify_normalized_title, local_track_normalized_title):
@@ -1,14 +1,14 @@
 from sqlite3 import Connection
-from flask import Blueprint, render_template
+from flask import Blueprint, Response, render_template, request
 
-from raphson_mp import db, radio
+from raphson_mp import music, radio, radio_stream, settings
 from raphson_mp.auth import User
 from raphson_mp.decorators import route
 
 bp = Blueprint('radio', __name__, url_prefix='/radio')
 
 
-@route(bp, '/info')
+@route(bp, '/info', write=True)
 def route_info(conn: Connection, _user: User):
     """
     Endpoint that returns information about the current and next radio track
@@ -16,6 +16,9 @@ def route_info(conn: Connection, _user: User):
     current_track = radio.get_current_track(conn)
     next_track = radio.get_next_track(conn)
 
+    if 'audio_type' in request.args:
+        music.warm_transcode(next_track.track, music.AudioType.from_value(request.args['audio_type']))
+
     return {
         'current': current_track.track.info_dict(),
         'current_time': current_track.start_time,
@@ -24,6 +27,21 @@ def route_info(conn: Connection, _user: User):
     }
 
 
+@route(bp, '/stream')
+def route_stream(_conn: Connection, _user: User):
+    """
+    Continuous Ogg/Opus stream of the radio, for external audio players
+    """
+    if not settings.radio_playlists:
+        return Response('radio is not configured', 503, content_type='text/plain')
+
+    stream = radio_stream.listen()
+    if stream is None:
+        return Response('too many listeners', 503, content_type='text/plain')
+
+    return Response(stream, content_type='audio/ogg', headers={'Cache-Control': 'no-store'})
+
+
 @route(bp, '', redirect_to_login=True)
 def route_radio_home(_conn: Connection, _user: User):
     return render_template('radio.jinja2')
@@ -2,13 +2,12 @@ import logging
 from pathlib import Path
 from sqlite3 import Connection
 import subprocess
-import time
 from tempfile import NamedTemporaryFile
 
 from flask import Blueprint, Response, abort, request, send_file
 
 from raphson_mp import (acoustid, cache, db, image, jsonw, lyrics, music,
-                        musicbrainz, scanner, settings)
+                        musicbrainz, respcache, scanner, settings)
 from raphson_mp.auth import User
 from raphson_mp.decorators import route
 from raphson_mp.image import ImageFormat
@@ -27,8 +26,7 @@ def _track(conn: Connection, relpath: str) -> Track:
 
 @route(bp, '/<path:relpath>/info')
 def route_info(conn: Connection, _user: User, relpath: str):
-    track = _track(conn, relpath)
-    return track.info_dict()
+    return respcache.json_response(conn, ('info', relpath), lambda: _track(conn, relpath).info_dict(cover_placeholder=False))
 
 
 @route(bp, '/<path:relpath>/video')
@@ -48,7 +46,7 @@ def route_raw(conn: Connection, _user: User, relpath: str):
     else:
         abort(400, 'file has no suitable video stream')
 
-    cache_key: str = f'video{track.relpath}{track.mtime}'
+    cache_key = music.video_cache_key(track.relpath, track.mtime)
 
     response = cache.retrieve_response(cache_key, output_media_type)
 
@@ -114,6 +112,8 @@ def route_album_cover(conn: Connection, _user: User, relpath: str) -> Response:
         quality = image.QUALITY_HIGH
     elif request.args['quality'] == 'low':
         quality = image.QUALITY_LOW
+    elif request.args['quality'] == 'tiny':
+        quality = image.QUALITY_TINY
     else:
         raise ValueError('invalid quality')
 
@@ -197,8 +197,6 @@ def route_acoustid(conn: Connection, _user: User, relpath: str):
         if len(meta_list) > 0:
             break
 
-        time.sleep(2) # crude way of avoiding rate limits
-
     return meta_list
 
 
@@ -37,6 +37,8 @@ def route_album_cover(path: str) -> Response:
         quality = image.QUALITY_HIGH
     elif request.args['quality'] == 'low':
         quality = image.QUALITY_LOW
+    elif request.args['quality'] == 'tiny':
+        quality = image.QUALITY_TINY
     else:
         raise ValueError('invalid quality')
 
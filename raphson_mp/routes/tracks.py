@@ -1,14 +1,15 @@
 
+import base64
 import logging
 from sqlite3 import Connection
 from typing import cast
 
-from flask import Blueprint, Response, request
+from flask import Blueprint, abort, request
 
-from raphson_mp import db, scanner
+from raphson_mp import db, image, respcache, scanner
 from raphson_mp.auth import User
 from raphson_mp.decorators import route
-from raphson_mp.jsonw import json_response
+from raphson_mp.image import ImageFormat
 from raphson_mp.music import Track
 
 log = logging.getLogger(__name__)
@@ -19,40 +20,42 @@ bp = Blueprint('tracks', __name__, url_prefix='/tracks')
 def route_filter(conn: Connection, _user: User):
     last_modified = scanner.last_change(conn, request.args['playlist'] if 'playlist' in request.args else None)
 
-    if request.if_modified_since and last_modified <= request.if_modified_since:
-        return Response(None, 304)  # Not Modified
+    def get_tracks():
+        query = 'SELECT path FROM track WHERE true'
+        params: list[str] = []
+        if 'playlist' in request.args:
+            query += ' AND playlist = ?'
+            params.append(request.args['playlist'])
 
-    query = 'SELECT path FROM track WHERE true'
-    params: list[str] = []
-    if 'playlist' in request.args:
-        query += ' AND playlist = ?'
-        params.append(request.args['playlist'])
+        if 'artist' in request.args:
+            query += ' AND EXISTS(SELECT artist FROM track_artist WHERE track = path AND artist = ?)'
+            params.append(request.args['artist'])
 
-    if 'artist' in request.args:
-        query += ' AND EXISTS(SELECT artist FROM track_artist WHERE track = path AND artist = ?)'
-        params.append(request.args['artist'])
+        if 'album_artist' in request.args:
+            query += ' AND album_artist = ?'
+            params.append(request.args['album_artist'])
 
-    if 'album_artist' in request.args:
-        query += ' AND album_artist = ?'
-        params.append(request.args['album_artist'])
+        if 'album' in request.args:
+            query += ' AND album = ?'
+            params.append(request.args['album'])
 
-    if 'album' in request.args:
-        query += ' AND album = ?'
-        params.append(request.args['album'])
+        if 'has_metadata' in request.args and request.args['has_metadata'] == '1':
+            # Has at least metadata for: title, album, album artist, artists
+            query += ' AND title NOT NULL AND album NOT NULL AND album_artist NOT NULL AND EXISTS(SELECT artist FROM track_artist WHERE track = path)'
 
-    if 'has_metadata' in request.args and request.args['has_metadata'] == '1':
-        # Has at least metadata for: title, album, album artist, artists
-        query += ' AND title NOT NULL AND album NOT NULL AND album_artist NOT NULL AND EXISTS(SELECT artist FROM track_artist WHERE track = path)'
+        if 'tag' in request.args:
+            query += ' AND EXISTS(SELECT tag FROM track_tag WHERE track = path AND tag = ?)'
+            params.append(request.args['tag'])
 
-    if 'tag' in request.args:
-        query += ' AND EXISTS(SELECT tag FROM track_tag WHERE track = path AND tag = ?)'
-        params.append(request.args['tag'])
+        query += ' LIMIT 5000'
+        result = conn.execute(query, params)
+        tracks = cast(list[Track], [Track.by_relpath(conn, row[0]) for row in result])
+        return {'tracks': [track.info_dict(cover_placeholder=False) for track in tracks]}
 
-    query += ' LIMIT 5000'
-    result = conn.execute(query, params)
-    tracks = cast(list[Track], [Track.by_relpath(conn, row[0]) for row in result])
-
-    return json_response({'tracks': [track.info_dict() for track in tracks]}, last_modified=last_modified)
+    key = ('filter', *(f'{name}={request.args[name]}'
+                       for name in ['playlist', 'artist', 'album_artist', 'album', 'has_metadata', 'tag']
+                       if name in request.args))
+    return respcache.json_response(conn, key, get_tracks, last_modified=last_modified)
 
 
 @route(bp, '/search')
@@ -61,15 +64,57 @@ def route_search(conn: Connection, _user: User):
     query = query.replace('"', '""')
     query = '"' + query.replace(' ', '" OR "') + '"'
     log.info('search: %s', query)
-    result = conn.execute('SELECT path FROM track_fts WHERE track_fts MATCH ? ORDER BY rank LIMIT 25', (query,))
-    tracks = cast(list[Track], [Track.by_relpath(conn, row[0]) for row in result])
-    albums = [{'album': row[0], 'artist': row[1]}
-                for row in conn.execute('SELECT DISTINCT album, album_artist FROM track_fts WHERE album MATCH ? ORDER BY rank LIMIT 10', (query,))]
-    return {'tracks': [track.info_dict() for track in tracks], 'albums': albums}
+
+    def search():
+        result = conn.execute('SELECT path FROM track_fts WHERE track_fts MATCH ? ORDER BY rank LIMIT 25', (query,))
+        tracks = cast(list[Track], [Track.by_relpath(conn, row[0]) for row in result])
+        albums = [{'album': row[0], 'artist': row[1]}
+                    for row in conn.execute('SELECT DISTINCT album, album_artist FROM track_fts WHERE album MATCH ? ORDER BY rank LIMIT 10', (query,))]
+        return {'tracks': [track.info_dict(cover_placeholder=False) for track in tracks], 'albums': albums}
+
+    return respcache.json_response(conn, ('search', query), search)
 
 
 @route(bp, '/tags')
 def route_tags(conn: Connection, _user: User):
-    result = conn.execute('SELECT DISTINCT tag FROM track_tag ORDER BY tag')
-    tags = [row[0] for row in result]
-    return tags
+    def tags():
+        result = conn.execute('SELECT DISTINCT tag FROM track_tag ORDER BY tag')
+        return [row[0] for row in result]
+
+    return respcache.json_response(conn, ('tags',), tags)
+
+
+@route(bp, '/covers', methods=['POST'])
+def route_covers(conn: Connection, _user: User):
+    """
+    Low quality covers for many tracks at once. Tracks of the same album share a cover, which is
+    only returned once. Only covers that have been found before are returned, finding a cover can
+    take a long time.
+    """
+    relpaths = request.json.get('tracks') if isinstance(request.json, dict) else None
+    if not isinstance(relpaths, list) or not all(isinstance(relpath, str) for relpath in relpaths):
+        abort(400, 'tracks must be a list of track paths')
+    relpaths = cast(list[str], relpaths)
+    if len(relpaths) > 100:
+        abort(400, 'at most 100 tracks')
+
+    # Cover id is the album key, or the track path for tracks that are not part of an album
+    cover_ids: dict[str, str] = {}
+    covers: dict[str, str] = {}
+    for relpath in relpaths:
+        track = Track.by_relpath(conn, relpath)
+        if track is None:
+            continue
+
+        album_key = track.metadata().album_key()
+        cover_id = album_key if album_key is not None else relpath
+
+        if cover_id not in covers:
+            image_bytes = track.get_cached_cover(False, image.QUALITY_LOW, ImageFormat.WEBP)
+            if image_bytes is None:
+                continue
+            covers[cover_id] = base64.b64encode(image_bytes).decode()
+
+        cover_ids[relpath] = cover_id
+
+    return {'tracks': cover_ids, 'covers': covers}
@@ -1,5 +1,7 @@
 import logging
-from threading import Thread
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+import sqlite3
+from threading import Lock, Thread
 import time
 from dataclasses import dataclass
 from datetime import datetime, timezone
@@ -60,7 +62,9 @@ def query_params(relpath: str, path: Path) -> QueryParams | None:
                                           'track_number': meta.track_number,
                                           'year': meta.year,
                                           'lyrics': meta.lyrics,
-                                          'video': meta.video}
+                                          'video': meta.video,
+                                          'embedded_cover': meta.embedded_cover,
+                                          'album_key': meta.album_key()}
     artist_data = [{'track': relpath,
                     'artist': artist} for artist in meta.artists]
     tag_data = [{'track': relpath,
@@ -69,6 +73,85 @@ def query_params(relpath: str, path: Path) -> QueryParams | None:
     return QueryParams(main_data, artist_data, tag_data)
 
 
+def _log_change(conn: Connection, action: str, playlist_name: str, track_relpath: str) -> None:
+    conn.execute('''
+                 INSERT INTO scanner_log (timestamp, action, playlist, track)
+                 VALUES (?, ?, ?, ?)
+                 ''', (int(time.time()), action, playlist_name, track_relpath))
+
+
+def _delete_track(conn: Connection, playlist_name: str, track_relpath: str) -> None:
+    if conn.execute('DELETE FROM track WHERE path=?', (track_relpath,)).rowcount == 0:
+        # Track was never scanned, no need to bump the library version
+        return
+    _log_change(conn, 'delete', playlist_name, track_relpath)
+
+
+def _insert_track(conn: Connection, playlist_name: str, track_relpath: str, file_mtime: int, params: QueryParams) -> None:
+    conn.execute('''
+                 INSERT INTO track (path, playlist, duration, title, album, album_artist, track_number, year, lyrics, video, embedded_cover, album_key, mtime)
+                 VALUES (:path, :playlist, :duration, :title, :album, :album_artist, :track_number, :year, :lyrics, :video, :embedded_cover, :album_key, :mtime)
+                 ''',
+                 {**params.main_data,
+                  'playlist': playlist_name,
+                  'mtime': file_mtime})
+    conn.executemany('INSERT INTO track_artist (track, artist) VALUES (:track, :artist)', params.artist_data)
+    conn.executemany('INSERT INTO track_tag (track, tag) VALUES (:track, :tag)', params.tag_data)
+    _log_change(conn, 'insert', playlist_name, track_relpath)
+
+
+def _update_track(conn: Connection, playlist_name: str, track_relpath: str, file_mtime: int, params: QueryParams) -> None:
+    conn.execute('''
+                    UPDATE track
+                    SET duration=:duration,
+                        title=:title,
+                        album=:album,
+                        album_artist=:album_artist,
+                        track_number=:track_number,
+                        year=:year,
+                        lyrics=:lyrics,
+                        video=:video,
+                        embedded_cover=:embedded_cover,
+                        album_key=:album_key,
+                        mtime=:mtime
+                    WHERE path=:path
+                ''',
+                {**params.main_data,
+                 'mtime': file_mtime})
+    conn.execute('DELETE FROM track_artist WHERE track=?', (track_relpath,))
+    conn.executemany('INSERT INTO track_artist (track, artist) VALUES (:track, :artist)', params.artist_data)
+    conn.execute('DELETE FROM track_tag WHERE track=?', (track_relpath,))
+    conn.executemany('INSERT INTO track_tag (track, tag) VALUES (:track, :tag)', params.tag_data)
+    _log_change(conn, 'update', playlist_name, track_relpath)
+
+
+def _write_track(conn: Connection,
+                 playlist_name: str,
+                 track_relpath: str,
+                 file_mtime: int,
+                 db_mtime: int | None,
+                 params: QueryParams | None) -> bool:
+    """
+    Store probed track metadata in the database
+    Returns: Whether the track is present in the database
+    """
+    if db_mtime is None:
+        if not params:
+            log.warning('Skipping due to metadata error: %s', track_relpath)
+            return False
+        log.info('New track, insert: %s', track_relpath)
+        _insert_track(conn, playlist_name, track_relpath, file_mtime, params)
+        return True
+
+    log.info('Changed, update: %s (%s to %s)', track_relpath, datetime.fromtimestamp(db_mtime, tz=timezone.utc), datetime.fromtimestamp(file_mtime, tz=timezone.utc))
+    if not params:
+        log.warning('Metadata error, delete track from database: %s', track_relpath)
+        _delete_track(conn, playlist_name, track_relpath)
+        return False
+    _update_track(conn, playlist_name, track_relpath, file_mtime, params)
+    return True
+
+
 def scan_track(conn: Connection, playlist_name: str, track_path: Path, track_relpath: str) -> bool:
     """
     Scan single track.
@@ -76,93 +159,256 @@ def scan_track(conn: Connection, playlist_name: str, track_path: Path, track_rel
     """
     if not track_path.exists():
         log.info('Deleted: %s', track_relpath)
-        conn.execute('DELETE FROM track WHERE path=?', (track_relpath,))
-        conn.execute('''
-                        INSERT INTO scanner_log (timestamp, action, playlist, track)
-                        VALUES (?, 'delete', ?, ?)
-                        ''', (int(time.time()), playlist_name, track_relpath))
+        _delete_track(conn, playlist_name, track_relpath)
         return False
 
     row = conn.execute('SELECT mtime FROM track WHERE path=?', (track_relpath,)).fetchone()
     db_mtime = row[0] if row else None
     file_mtime = int(track_path.stat().st_mtime)
 
-    # Track does not yet exist in database
-    if db_mtime is None:
-        log.info('New track, insert: %s', track_relpath)
-        params = query_params(track_relpath, track_path)
-        if not params:
-            log.warning('Skipping due to metadata error')
-            return False
-        conn.execute('''
-                     INSERT INTO track (path, playlist, duration, title, album, album_artist, track_number, year, lyrics, video, mtime)
-                     VALUES (:path, :playlist, :duration, :title, :album, :album_artist, :track_number, :year, :lyrics, :video, :mtime)
-                     ''',
-                     {**params.main_data,
-                      'playlist': playlist_name,
-                      'mtime': file_mtime})
-        conn.executemany('INSERT INTO track_artist (track, artist) VALUES (:track, :artist)', params.artist_data)
-        conn.executemany('INSERT INTO track_tag (track, tag) VALUES (:track, :tag)', params.tag_data)
-
-        conn.execute('''
-                     INSERT INTO scanner_log (timestamp, action, playlist, track)
-                     VALUES (?, 'insert', ?, ?)
-                     ''', (int(time.time()), playlist_name, track_relpath))
+    if file_mtime == db_mtime:
+        # Track exists in filesystem and is unchanged
         return True
 
-    if file_mtime != db_mtime:
-        log.info('Changed, update: %s (%s to %s)', track_relpath, datetime.fromtimestamp(db_mtime, tz=timezone.utc), datetime.fromtimestamp(file_mtime, tz=timezone.utc))
-        params = query_params(track_relpath, track_path)
-        if not params:
-            log.warning('Metadata error, delete track from database')
-            conn.execute('DELETE FROM track WHERE path=?', (track_relpath,))
-            return False
-        conn.execute('''
-                        UPDATE track
-                        SET duration=:duration,
-                            title=:title,
-                            album=:album,
-                            album_artist=:album_artist,
-                            track_number=:track_number,
-                            year=:year,
-                            lyrics=:lyrics,
-                            video=:video,
-                            mtime=:mtime
-                        WHERE path=:path
-                    ''',
-                    {**params.main_data,
-                     'mtime': file_mtime})
-        conn.execute('DELETE FROM track_artist WHERE track=?', (track_relpath,))
-        conn.executemany('INSERT INTO track_artist (track, artist) VALUES (:track, :artist)', params.artist_data)
-        conn.execute('DELETE FROM track_tag WHERE track=?', (track_relpath,))
-        conn.executemany('INSERT INTO track_tag (track, tag) VALUES (:track, :tag)', params.tag_data)
-
-        conn.execute('''
-                     INSERT INTO scanner_log (timestamp, action, playlist, track)
-                     VALUES (?, 'update', ?, ?)
-                     ''', (int(time.time()), playlist_name, track_relpath))
-        return True
+    return _write_track(conn, playlist_name, track_relpath, file_mtime, db_mtime, query_params(track_relpath, track_path))
 
-    # Track exists in filesystem and is unchanged
-    return True
 
+# Tables referencing a track by path. The history table intentionally has no foreign key, but
+# should follow the track as well.
+TRACK_REFERENCES = ['track_artist', 'track_tag', 'radio_track', 'now_playing', 'dislikes', 'shares', 'history']
 
-def scan_tracks(conn: Connection, playlist_name: str) -> None:
+
+def move_track(conn: Connection, old_relpath: str, new_relpath: str) -> list[tuple[str, str]] | None:
     """
-    Scan for added, removed or changed tracks in a playlist.
+    Update the database after a track file has been moved or renamed. Unlike deleting and inserting
+    the track, this preserves its last chosen time, references from other tables and cached audio.
+    Returns: Cache keys to move using cache.move(), after the transaction has been committed. None if
+             the old track is not in the database, the new file should be scanned instead.
+    """
+    row = conn.execute('SELECT playlist, mtime FROM track WHERE path=?', (old_relpath,)).fetchone()
+    if row is None:
+        return None
+    old_playlist, mtime = row
+    new_playlist = new_relpath.split('/')[0]
+
+    log.info('Moved: %s to %s', old_relpath, new_relpath)
+
+    # Moved file has replaced another track
+    _delete_track(conn, new_playlist, new_relpath)
+
+    # Child rows are updated after the track row
+    conn.execute('PRAGMA defer_foreign_keys = ON')
+    # Must be updated before the track, the update trigger finds the search entry by its new path
+    conn.execute('UPDATE track_fts SET path=? WHERE path=?', (new_relpath, old_relpath))
+    conn.execute('UPDATE track SET path=?, playlist=? WHERE path=?', (new_relpath, new_playlist, old_relpath))
+    for table in TRACK_REFERENCES:
+        conn.execute(f'UPDATE {table} SET track=? WHERE track=?', (new_relpath, old_relpath))
+    # Statistics per playlist use the playlist stored in history
+    conn.execute('UPDATE history SET playlist=? WHERE track=?', (new_playlist, new_relpath))
+
+    # Clients know tracks by path, for them this is a different track
+    _log_change(conn, 'delete', old_playlist, old_relpath)
+    _log_change(conn, 'insert', new_playlist, new_relpath)
+
+    return music.moved_cache_keys(old_relpath, new_relpath, mtime)
+
+
+def move_directory(conn: Connection, old_relpath: str, new_relpath: str) -> list[tuple[str, str]]:
+    """
+    Update the database after a directory has been moved or renamed, see move_track()
+    Returns: Cache keys to move using cache.move(), after the transaction has been committed
+    """
+    old_prefix = old_relpath + '/'
+    old_tracks = [row[0] for row in conn.execute('SELECT path FROM track WHERE substr(path, 1, ?) = ?',
+                                                 (len(old_prefix), old_prefix))]
+    cache_keys: list[tuple[str, str]] = []
+    for old_track in old_tracks:
+        cache_keys.extend(move_track(conn, old_track, new_relpath + old_track[len(old_relpath):]) or [])
+    conn.execute("DELETE FROM scanner_directory WHERE path=? OR substr(path, 1, ?) = ?",
+                 (old_relpath, len(old_prefix), old_prefix))
+    return cache_keys
+
+
+@dataclass
+class ScanStatus:
+    """
+    Progress of the currently running scan, for logging and monitoring
+    """
+    playlist: str | None = None
+    total: int = 0  # Number of new or changed files in the current playlist
+    processed: int = 0  # Number of files probed in the current playlist
+    errors: int = 0  # Number of files that could not be probed, since the scanner was started
+    start_time: float = 0
+    running: bool = False  # Whether a full or background scan is running
+
+    def files_per_second(self) -> float:
+        duration = time.time() - self.start_time
+        return self.processed / duration if duration > 0 else 0
+
+    def eta_seconds(self) -> int | None:
+        """
+        Returns: Estimated time until the current playlist has been scanned, or None if unknown
+        """
+        files_per_second = self.files_per_second()
+        if self.playlist is None or files_per_second == 0:
+            return None
+        return int((self.total - self.processed) / files_per_second)
+
+
+status = ScanStatus()
+
+# Number of changed tracks after which a full scan commits, so other connections can see
+# progress and the write-ahead log does not grow too large
+COMMIT_BATCH_SIZE = 500
+# Smaller batches for the background scanner, to hold the write lock only briefly while
+# the web server is handling requests
+BACKGROUND_BATCH_SIZE = 50
+# Number of attempts to scan a playlist in the background scanner, when the database is busy
+BACKGROUND_ATTEMPTS = 3
+# Interval for logging progress while scanning a playlist, in seconds
+PROGRESS_INTERVAL = 10
+
+# Prevents the full, background and watcher scans from scanning the same files at the same time
+scan_lock = Lock()
+
+
+def _probe(track_path: Path, track_relpath: str) -> QueryParams | None:
+    try:
+        return query_params(track_relpath, track_path)
+    except Exception:
+        log.exception('Error probing track: %s', track_relpath)
+        return None
+
+
+def _find_changes(playlist_name: str,
+                  db_mtimes: dict[str, int],
+                  dir_mtimes: dict[str, int],
+                  full: bool) -> tuple[list[tuple[Path, str, int, int | None]], dict[str, int]]:
+    """
+    Walk playlist directory to find new or changed files. Files in a directory are only
+    checked if the modification time of the directory has changed since the previous scan,
+    unless a full scan is requested. Found tracks are removed from db_mtimes, so afterwards
+    it only contains tracks that no longer exist.
+    Returns: Tuple of changed files and modification time of all found directories
+    """
+    changed: list[tuple[Path, str, int, int | None]] = []
+    found_dirs: dict[str, int] = {}
+    root = music.from_relpath(playlist_name)
+    for dir_path, dir_stat, files in music.walk_directories(root):
+        # Not using to_relpath(), it resolves symlinks
+        dir_relpath = playlist_name + dir_path.as_posix()[len(root.as_posix()):]
+        found_dirs[dir_relpath] = dir_stat.st_mtime_ns
+        unchanged = not full and dir_mtimes.get(dir_relpath) == dir_stat.st_mtime_ns
+        for entry in files:
+            if entry.name.startswith('.trash.') or not entry.name.endswith(music.MUSIC_EXTENSIONS_TUPLE):
+                continue
+            entry_relpath = dir_relpath + '/' + entry.name
+            db_mtime = db_mtimes.pop(entry_relpath, None)
+            if unchanged and db_mtime is not None:
+                # No files were added or removed, assume the file itself is unchanged
+                continue
+            try:
+                file_mtime = int(entry.stat().st_mtime)
+            except OSError as ex:
+                log.warning('Cannot read file %s: %s', entry.path, ex)
+                continue
+            if file_mtime != db_mtime:
+                changed.append((Path(entry.path), entry_relpath, file_mtime, db_mtime))
+
+    return changed, found_dirs
+
+
+def _write_tracks(conn: Connection,
+                  playlist_name: str,
+                  results: list[tuple[str, int, int | None, QueryParams | None]],
+                  commit: bool) -> None:
+    for track_relpath, file_mtime, db_mtime, params in results:
+        _write_track(conn, playlist_name, track_relpath, file_mtime, db_mtime, params)
+    results.clear()
+    if commit:
+        conn.commit()
+
+
+def scan_tracks(conn: Connection, playlist_name: str, commit_batch_size: int | None = None, full: bool = False) -> None:
+    """
+    Scan for added, removed or changed tracks in a playlist. Metadata of new and changed
+    files is read by a pool of worker threads, while this thread writes the results to
+    the database.
+    Args:
+        conn: Database connection
+        playlist_name: Playlist to scan
+        commit_batch_size: If set, commit after every so many changed tracks. By default,
+                           all changes are part of the caller's transaction.
+        full: Check all files, not only files in directories that have been modified since
+              the previous scan. Required to find files that were modified in place.
     """
     log.info('Scanning playlist: %s', playlist_name)
-    paths_db: set[str] = set()
+    db_mtimes: dict[str, int] = {relpath: mtime for relpath, mtime in
+                                 conn.execute('SELECT path, mtime FROM track WHERE playlist=?', (playlist_name,))}
+    dir_mtimes: dict[str, int] = {relpath: mtime for relpath, mtime in
+                                  conn.execute('SELECT path, mtime FROM scanner_directory WHERE playlist=?', (playlist_name,))}
 
-    for track_relpath, in conn.execute('SELECT path FROM track WHERE playlist=?',
-                                        (playlist_name,)).fetchall():
-        if scan_track(conn, playlist_name, music.from_relpath(track_relpath), track_relpath):
-            paths_db.add(track_relpath)
+    changed, found_dirs = _find_changes(playlist_name, db_mtimes, dir_mtimes, full)
 
-    for track_path in music.list_tracks_recursively(music.from_relpath(playlist_name)):
-        track_relpath = music.to_relpath(track_path)
-        if track_relpath not in paths_db:
-            scan_track(conn, playlist_name, track_path, track_relpath)
+    # Tracks left in the dictionary no longer exist in the filesystem
+    for track_relpath in db_mtimes:
+        log.info('Deleted: %s', track_relpath)
+        _delete_track(conn, playlist_name, track_relpath)
+
+    if commit_batch_size:
+        # Do not hold the write lock while probing files
+        conn.commit()
+
+    # Directories containing files that could not be read are checked again next time
+    error_dirs: set[str] = set()
+
+    if changed:
+        status.playlist = playlist_name
+        status.total = len(changed)
+        status.processed = 0
+        status.start_time = time.time()
+        last_progress_log = status.start_time
+        # With a commit batch size, results are written in batches so the write lock is only
+        # held briefly, instead of for as long as it takes to probe the files in the batch.
+        results: list[tuple[str, int, int | None, QueryParams | None]] = []
+
+        with ThreadPoolExecutor(max_workers=settings.scanner_workers, thread_name_prefix='scanner') as executor:
+            futures: dict[Future[QueryParams | None], tuple[Path, str, int, int | None]] = {
+                executor.submit(_probe, track_path, track_relpath): (track_path, track_relpath, file_mtime, db_mtime)
+                for track_path, track_relpath, file_mtime, db_mtime in changed}
+
+            for future in as_completed(futures):
+                _track_path, track_relpath, file_mtime, db_mtime = futures[future]
+                params = future.result()
+                status.processed += 1
+                if params is None:
+                    status.errors += 1
+                    error_dirs.add(track_relpath.rsplit('/', 1)[0])
+
+                results.append((track_relpath, file_mtime, db_mtime, params))
+                if not commit_batch_size or len(results) >= commit_batch_size:
+                    _write_tracks(conn, playlist_name, results, commit_batch_size is not None)
+
+                if time.time() - last_progress_log > PROGRESS_INTERVAL:
+                    last_progress_log = time.time()
+                    log.info('Scanning %s: %s/%s files (%.1f files/s, %s errors)',
+                             playlist_name, status.processed, status.total, status.files_per_second(), status.errors)
+
+            _write_tracks(conn, playlist_name, results, commit_batch_size is not None)
+
+        log.info('Scanned %s: %s files (%.1f files/s, %s errors)',
+                 playlist_name, status.processed, status.files_per_second(), status.errors)
+        status.playlist = None
+
+    # Directory modification times are stored in the same transaction as the last tracks,
+    # so directories are only skipped in the next scan if all their tracks have been stored.
+    conn.execute('DELETE FROM scanner_directory WHERE playlist=?', (playlist_name,))
+    conn.executemany('INSERT INTO scanner_directory (path, playlist, mtime) VALUES (?, ?, ?)',
+                     [(dir_relpath, playlist_name, mtime) for dir_relpath, mtime in found_dirs.items()
+                      if dir_relpath not in error_dirs])
+
+    if commit_batch_size:
+        conn.commit()
 
 
 def last_change(conn: Connection, playlist: str | None = None):
@@ -179,42 +425,70 @@ def last_change(conn: Connection, playlist: str | None = None):
     return datetime.fromtimestamp(0, timezone.utc)
 
 
-def scan() -> None:
+def scan(full: bool = False) -> None:
     """
     Main function for scanning music directory structure
+    Args:
+        full: Check all files, see scan_tracks()
     """
     if settings.offline_mode:
         log.info('Skip scanner in offline mode')
         return
 
-    with db.connect() as conn:
-        start_time_ns = time.time_ns()
-        playlists = scan_playlists(conn)
-        for playlist in playlists:
-            scan_tracks(conn, playlist)
-        duration_ms = (time.time_ns() - start_time_ns) // 1000000
-        log.info('Took %sms', duration_ms)
+    with scan_lock, db.connect() as conn:
+        status.running = True
+        try:
+            start_time_ns = time.time_ns()
+            playlists = scan_playlists(conn)
+            conn.commit()
+            for playlist in playlists:
+                scan_tracks(conn, playlist, commit_batch_size=COMMIT_BATCH_SIZE, full=full)
+            duration_ms = (time.time_ns() - start_time_ns) // 1000000
+            log.info('Took %sms', duration_ms)
+        finally:
+            status.running = False
+
+
+def _scan_background_playlist(playlist: str) -> None:
+    for attempt in range(1, BACKGROUND_ATTEMPTS + 1):
+        try:
+            with db.connect() as conn:
+                scan_tracks(conn, playlist, commit_batch_size=BACKGROUND_BATCH_SIZE)
+            return
+        except sqlite3.OperationalError as ex:
+            # Committed batches are not scanned again in the next attempt
+            log.warning('Database error while scanning playlist %s (attempt %s): %s', playlist, attempt, ex)
+            time.sleep(attempt * 5)
+    log.error('Giving up scanning playlist: %s', playlist)
+
+
+def _scan_background() -> None:
+    with scan_lock:
+        status.running = True
+        try:
+            start_time_ns = time.time_ns()
+            with db.connect() as conn:
+                playlists = scan_playlists(conn)
+
+            for playlist in playlists:
+                _scan_background_playlist(playlist)
+
+            duration_ms = (time.time_ns() - start_time_ns) // 1000000
+            log.info('Background scan took %sms', duration_ms)
+        except Exception:
+            log.exception('Background scan failed')
+        finally:
+            status.running = False
 
 
 def scan_background() -> None:
+    """
+    Scan music directory in a background thread. Every playlist is scanned using its own database
+    connection, committing in small batches so the web server can write in between. Must be called
+    after the server has forked, a thread holding a database connection does not survive fork.
+    """
     if settings.offline_mode:
         log.info('Skip scanner in offline mode')
         return
 
-    # Call regular scan function instead, background scanning is broken
-    # Causes sqlite disk I/O errors when a different thread writes simulatenously
-    # TODO figure out why
-    scan()
-    return
-
-    def scan_slowly():
-        with db.connect() as conn:
-            playlists = scan_playlists(conn)
-
-        for playlist in playlists:
-            with db.connect() as conn:
-                scan_tracks(conn, playlist)
-            # release database connection and allow server to process important requests
-            time.sleep(1)
-
-    Thread(target=scan_slowly, daemon=True).start()
+    Thread(target=_scan_background, name='scanner-background', daemon=True).start()
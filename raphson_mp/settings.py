@@ -26,12 +26,17 @@ data_dir: Path = None  # pyright: ignore[reportAssignmentType]
 ffmpeg_log_level: str = 'warning'
 track_max_duration_seconds: int = 1200
 radio_playlists: list[str] = []
+radio_lookahead: int = 3
 lastfm_api_key: str | None = None
 lastfm_api_secret: str | None = None
 spotify_api_id: str | None = None
 spotify_api_secret: str | None = None
 offline_mode: bool = False
 news_server: str | None = None
+scanner_workers: int = 4
+probe_backend: str = 'tagreader'
+lyrics_deadline_seconds: int = 15
+lyrics_preference: list[str] = []
 
 def ffmpeg_flags():
     return ['-hide_banner', '-nostats', '-loglevel', ffmpeg_log_level]
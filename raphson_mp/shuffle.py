@@ -0,0 +1,190 @@
+"""
+In-memory candidate lists used to choose random tracks from a playlist, without
+running an expensive query for every chosen track.
+"""
+import heapq
+import logging
+import random
+import time
+from array import array
+from sqlite3 import Connection
+from threading import Lock
+
+log = logging.getLogger(__name__)
+
+
+def _mask(indices: list[int]) -> int:
+    """
+    Returns: Bit mask with a bit set for every provided track index
+    """
+    mask = 0
+    for i in indices:
+        mask |= 1 << i
+    return mask
+
+
+def _mask_indices(mask: int) -> list[int]:
+    """
+    Returns: Track indices for all bits that are set in the provided mask
+    """
+    return [i for i, bit in enumerate(reversed(bin(mask)[2:])) if bit == '1']
+
+
+def library_version(conn: Connection) -> int:
+    """
+    Returns: Id of the most recent scanner log entry. It increases every time a track is
+    added, changed or removed.
+    """
+    version, = conn.execute('SELECT MAX(id) FROM scanner_log').fetchone()
+    return version if version else 0
+
+
+def playlist_version(conn: Connection, playlist: str) -> int:
+    """
+    Returns: Id of the most recent scanner log entry for a playlist, see library_version()
+    """
+    version, = conn.execute('SELECT MAX(id) FROM scanner_log WHERE playlist = ?', (playlist,)).fetchone()
+    return version if version else 0
+
+
+class ShuffleBag:
+    """
+    Compact representation of all tracks in a playlist. Tracks are identified by their
+    index in the paths list. Sets of tracks (for example all tracks with a certain tag)
+    are stored as bit masks, so filters can be combined using bitwise operations.
+    """
+    playlist: str
+    version: int
+    paths: list[str]
+    indices: dict[str, int]
+    last_chosen: array[int]
+    tag_masks: dict[str, int]
+    metadata_mask: int
+    all_mask: int
+    lock: Lock
+
+    def __init__(self,
+                 playlist: str,
+                 version: int,
+                 paths: list[str],
+                 last_chosen: list[int],
+                 tags: dict[str, list[int]],
+                 has_metadata: list[int]):
+        """
+        Args:
+            playlist: Playlist name
+            version: Playlist version this bag was created at, see playlist_version()
+            paths: Track paths
+            last_chosen: Last chosen timestamp for each track, in the same order as paths
+            tags: For each tag, a list of indices of tracks with that tag
+            has_metadata: Indices of tracks that have at least title, album and artist metadata
+        """
+        self.playlist = playlist
+        self.version = version
+        self.paths = paths
+        self.indices = {path: i for i, path in enumerate(paths)}
+        self.last_chosen = array('q', last_chosen)
+        self.tag_masks = {tag.lower(): _mask(indices) for tag, indices in tags.items()}
+        self.metadata_mask = _mask(has_metadata)
+        self.all_mask = (1 << len(paths)) - 1
+        self.lock = Lock()
+
+    def _tags_mask(self, tags: list[str]) -> int:
+        """
+        Returns: Mask of tracks that have at least one of the provided tags
+        """
+        mask = 0
+        for tag in tags:
+            mask |= self.tag_masks.get(tag.lower(), 0)
+        return mask
+
+    def choose(self,
+               require_metadata: bool = False,
+               allow_tags: list[str] | None = None,
+               deny_tags: list[str] | None = None,
+               exclude: list[str] | None = None) -> tuple[str, int] | None:
+        """
+        Choose a random track from the least recently chosen quarter of the playlist, and
+        mark it as chosen.
+        Args:
+            require_metadata: Only choose tracks with title, album and artist metadata
+            allow_tags: Only choose tracks with at least one of these tags
+            deny_tags: Only choose tracks with none of these tags
+            exclude: Track paths that must not be chosen, for example disliked tracks
+        Returns: Tuple of chosen track path and previous last chosen timestamp, or None
+                 if there are no candidate tracks.
+        """
+        with self.lock:
+            mask = self.all_mask
+
+            if require_metadata:
+                mask &= self.metadata_mask
+
+            if allow_tags is not None:
+                mask &= self._tags_mask(allow_tags)
+
+            if deny_tags is not None:
+                mask &= ~self._tags_mask(deny_tags)
+
+            if exclude:
+                mask &= ~_mask([self.indices[path] for path in exclude if path in self.indices])
+
+            if mask == 0:
+                return None
+
+            # From the least recently played tracks, choose a random one
+            limit = len(self.paths) // 4 + 1
+            candidates = heapq.nsmallest(limit, _mask_indices(mask), key=self.last_chosen.__getitem__)
+            chosen = random.choice(candidates)
+            last_chosen = self.last_chosen[chosen]
+            self.last_chosen[chosen] = int(time.time())
+            return self.paths[chosen], last_chosen
+
+    @staticmethod
+    def load(conn: Connection, playlist: str, version: int) -> 'ShuffleBag':
+        """
+        Create shuffle bag using tracks from the database
+        """
+        paths: list[str] = []
+        last_chosen: list[int] = []
+        has_metadata: list[int] = []
+        for i, (path, track_last_chosen, track_has_metadata) in enumerate(conn.execute('''
+                SELECT path, last_chosen,
+                       title NOT NULL AND album NOT NULL AND EXISTS(SELECT artist FROM track_artist WHERE track = path)
+                FROM track
+                WHERE playlist = ?
+                ''', (playlist,))):
+            paths.append(path)
+            last_chosen.append(track_last_chosen)
+            if track_has_metadata:
+                has_metadata.append(i)
+
+        indices = {path: i for i, path in enumerate(paths)}
+        tags: dict[str, list[int]] = {}
+        for path, tag in conn.execute('''
+                                      SELECT track, tag
+                                      FROM track_tag JOIN track ON track_tag.track = track.path
+                                      WHERE playlist = ?
+                                      ''', (playlist,)):
+            tags.setdefault(tag.lower(), []).append(indices[path])
+
+        log.info('Loaded shuffle bag for playlist %s with %s tracks', playlist, len(paths))
+        return ShuffleBag(playlist, version, paths, last_chosen, tags, has_metadata)
+
+
+_bags: dict[str, ShuffleBag] = {}
+_bags_lock = Lock()
+
+
+def get_bag(conn: Connection, playlist: str) -> ShuffleBag:
+    """
+    Get shuffle bag for a playlist. It is (re)created when it does not exist yet, or
+    when the scanner has changed tracks in the playlist since it was created.
+    """
+    version = playlist_version(conn, playlist)
+    with _bags_lock:
+        bag = _bags.get(playlist)
+        if bag is None or bag.version != version:
+            bag = ShuffleBag.load(conn, playlist, version)
+            _bags[playlist] = bag
+        return bag
@@ -4,12 +4,12 @@ from collections.abc import Iterator
 from dataclasses import dataclass
 from urllib.parse import quote
 
-import requests
-
-from raphson_mp import settings
+from raphson_mp import httpclient, settings
 
 log = logging.getLogger(__name__)
 
+_client = httpclient.Client('spotify', 'https://api.spotify.com/v1/', pool_hosts=2)
+
 @dataclass
 class SpotifyTrack:
     title: str
@@ -31,12 +31,10 @@ class SpotifyClient:
             if self._access_token_expiry > int(time.time()):
                 return self._access_token
 
-        response= requests.post('https://accounts.spotify.com/api/token',
-                                    data={'grant_type': 'client_credentials',
-                                          'client_id': settings.spotify_api_id,
-                                          'client_secret': settings.spotify_api_secret},
-                                    headers={'User-Agent': settings.user_agent},
-                                    timeout=10)
+        response = _client.post('https://accounts.spotify.com/api/token',
+                                data={'grant_type': 'client_credentials',
+                                      'client_id': settings.spotify_api_id,
+                                      'client_secret': settings.spotify_api_secret})
         response.raise_for_status()
         access_token: str = response.json()['access_token']
         self._access_token = access_token
@@ -44,15 +42,13 @@ class SpotifyClient:
         return access_token
 
     def get_playlist(self, playlist_id: str) -> Iterator[SpotifyTrack]:
-        url = 'https://api.spotify.com/v1/playlists/' + quote(playlist_id) + '/tracks'
+        url = _client.url('playlists/' + quote(playlist_id) + '/tracks')
 
         while url:
             log.info('making request to: %s', url)
-            response = requests.get(url,
-                                    params={'fields': 'next,items(track(name,artists(name)))'},
-                                    headers={'Authorization': 'Bearer ' + self.access_token,
-                                             'User-Agent': settings.user_agent},
-                                    timeout=10)
+            response = _client.get(url,
+                                   params={'fields': 'next,items(track(name,artists(name)))'},
+                                   headers={'Authorization': 'Bearer ' + self.access_token})
             response.raise_for_status()
 
             json = response.json()
@@ -1,7 +1,8 @@
 BEGIN;
 
 CREATE TABLE playlist (
-    path TEXT NOT NULL UNIQUE PRIMARY KEY
+    path TEXT NOT NULL UNIQUE PRIMARY KEY,
+    track_count INTEGER NOT NULL DEFAULT 0
 ) STRICT;
 
 CREATE TABLE track (
@@ -16,7 +17,9 @@ CREATE TABLE track (
     mtime INTEGER NOT NULL,
     last_chosen INTEGER NOT NULL DEFAULT 0,
     lyrics TEXT NULL,
-    video TEXT NULL
+    video TEXT NULL,
+    embedded_cover INTEGER NULL,
+    album_key TEXT NULL
 ) STRICT;
 
 CREATE INDEX idx_track_playlist ON track(playlist);
@@ -24,6 +27,11 @@ CREATE INDEX idx_track_album ON track(album);
 CREATE INDEX idx_track_album_artist ON track(album_artist);
 CREATE INDEX idx_track_last_chosen ON track(last_chosen);
 
+CREATE TABLE cover_placeholder (
+    album_key TEXT NOT NULL UNIQUE PRIMARY KEY,
+    color TEXT NOT NULL -- average color of album cover, like #a1b2c3
+) STRICT;
+
 CREATE TABLE track_artist (
     track TEXT NOT NULL REFERENCES track(path) ON DELETE CASCADE,
     artist TEXT NOT NULL COLLATE NOCASE,
@@ -120,6 +128,15 @@ CREATE TABLE scanner_log (
 ) STRICT;
 
 CREATE INDEX idx_scanner_log_timestamp ON scanner_log(timestamp);
+CREATE INDEX idx_scanner_log_playlist ON scanner_log(playlist);
+
+CREATE TABLE scanner_directory (
+    path TEXT NOT NULL UNIQUE PRIMARY KEY,
+    playlist TEXT NOT NULL REFERENCES playlist(path) ON DELETE CASCADE,
+    mtime INTEGER NOT NULL -- Nanoseconds since UNIX epoch
+) STRICT;
+
+CREATE INDEX idx_scanner_directory_playlist ON scanner_directory(playlist);
 
 CREATE TABLE dislikes (
     user INTEGER NOT NULL REFERENCES user(id) ON DELETE CASCADE,
@@ -167,4 +184,17 @@ CREATE TRIGGER track_fts_artist_update AFTER UPDATE ON track_artist BEGIN
     UPDATE track_fts SET artists = (SELECT GROUP_CONCAT(artist, ' ') FROM track_artist WHERE track=new.track GROUP BY track);
 END;
 
+CREATE TRIGGER playlist_track_count_insert AFTER INSERT ON track BEGIN
+    UPDATE playlist SET track_count = track_count + 1 WHERE path = new.playlist;
+END;
+
+CREATE TRIGGER playlist_track_count_delete AFTER DELETE ON track BEGIN
+    UPDATE playlist SET track_count = track_count - 1 WHERE path = old.playlist;
+END;
+
+CREATE TRIGGER playlist_track_count_update AFTER UPDATE OF playlist ON track WHEN old.playlist != new.playlist BEGIN
+    UPDATE playlist SET track_count = track_count - 1 WHERE path = old.playlist;
+    UPDATE playlist SET track_count = track_count + 1 WHERE path = new.playlist;
+END;
+
 COMMIT;
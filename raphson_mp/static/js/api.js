@@ -102,6 +102,25 @@ class Music {
         return new Track(await response.json());
     }
 
+    /**
+     * Choose multiple random tracks in a single request
+     * @param {Array<string>} playlistNames Playlist to choose each track from, in order
+     * @param {boolean} requireMetadata
+     * @param {object} tagFilter
+     * @param {string|null} audioType Audio type the tracks will be downloaded in, so the server can start transcoding them early
+     * @returns {Promise<Array<Track>>}
+     */
+    async chooseTracks(playlistNames, requireMetadata, tagFilter, audioType=null) {
+        const body = {'playlists': playlistNames, 'require_metadata': requireMetadata, ...tagFilter};
+        if (audioType) {
+            body.audio_type = audioType;
+        }
+        const chooseResponse = await jsonPost('/playlist/choose_tracks', body);
+        const json = await chooseResponse.json();
+        console.info('api: chosen tracks', json.tracks.length);
+        return this.#tracksFromJson(json.tracks);
+    }
+
     /**
      * @returns {Promise<Array<string>>}
      */
@@ -243,8 +262,12 @@ class Playlist {
         this.write = objectFromApi.write;
     }
 
-    async chooseRandomTrack(requireMetadata, tagFilter) {
-        const chooseResponse = await jsonPost('/playlist/' + encodeURIComponent(this.name) + '/choose_track', {'require_metadata': requireMetadata, ...tagFilter});
+    async chooseRandomTrack(requireMetadata, tagFilter, audioType=null) {
+        const body = {'require_metadata': requireMetadata, ...tagFilter};
+        if (audioType) {
+            body.audio_type = audioType;
+        }
+        const chooseResponse = await jsonPost('/playlist/' + encodeURIComponent(this.name) + '/choose_track', body);
         const trackData = await chooseResponse.json();
         console.info('api: chosen track', trackData.path);
         return new Track(trackData);
@@ -305,6 +328,8 @@ class Track {
     year;
     /** @type {string | null} */
     video;
+    /** @type {string | null} */
+    coverPlaceholder;
 
     constructor(trackData) {
         this.#updateLocalVariablesFromTrackDataResponse(trackData);
@@ -321,6 +346,7 @@ class Track {
         this.albumArtist = trackData.album_artist;
         this.year = trackData.year;
         this.video = trackData.video;
+        this.coverPlaceholder = trackData.cover_placeholder;
     }
 
     // TODO uses player-specific code, does not belong in api.js
@@ -448,6 +474,15 @@ class Track {
         }
     }
 
+    /**
+     * @param {string} imageQuality 'tiny', 'low' or 'high'
+     * @param {boolean} memeCover
+     * @returns {string} URL
+     */
+    coverUrl(imageQuality, memeCover=false) {
+        return `/track/${encodeURIComponent(this.path)}/cover?quality=${imageQuality}&meme=${memeCover ? 1 : 0}`;
+    }
+
     /**
      *
      * @param {string} imageQuality 'low' or 'high'
@@ -456,7 +491,7 @@ class Track {
      * @returns {Promise<string>} URL
      */
     async getCover(imageQuality, stream=false, memeCover=false) {
-        const imageUrl = `/track/${encodeURIComponent(this.path)}/cover?quality=${imageQuality}&meme=${memeCover ? 1 : 0}`;
+        const imageUrl = this.coverUrl(imageQuality, memeCover);
         if (stream) {
             return imageUrl;
         } else {
@@ -105,18 +105,28 @@ class Queue {
             return;
         }
 
-        let playlist;
+        // Choose playlists for all missing tracks, so they can be chosen in a single request
+        const playlists = [];
+        for (let i = this.autoQueuedTracks.length; i < minQueueSize; i++) {
+            let playlist;
+
+            if (this.playlistOverrides.length > 0) {
+                playlist = this.playlistOverrides.pop();
+                console.debug('queue: override', playlist);
+            } else {
+                playlist = getNextPlaylist(this.previousPlaylist);
+                console.debug(`queue: round robin: ${this.previousPlaylist} -> ${playlist}`);
+                this.previousPlaylist = playlist;
+            }
 
-        if (this.playlistOverrides.length > 0) {
-            playlist = this.playlistOverrides.pop();
-            console.debug('queue: override', playlist);
-        } else {
-            playlist = getNextPlaylist(this.previousPlaylist);
-            console.debug(`queue: round robin: ${this.previousPlaylist} -> ${playlist}`);
-            this.previousPlaylist = playlist;
+            if (playlist === null) {
+                break;
+            }
+
+            playlists.push(playlist);
         }
 
-        if (playlist === null) {
+        if (playlists.length === 0) {
             console.debug('queue: no playlists selected, trying again later');
             document.getElementById('no-playlists-selected').hidden = false;
             setTimeout(() => this.fill(), 1000);
@@ -127,7 +137,7 @@ class Queue {
 
         this.#fillBusy = true;
 
-        queue.addRandomTrackFromPlaylist(playlist).then(() => {
+        queue.addRandomTracksFromPlaylists(playlists).then(() => {
             this.#fillBusy = false;
             this.fill();
         }, error => {
@@ -138,13 +148,29 @@ class Queue {
         });
     };
 
+    /**
+     * @param {Array<string>} playlistNames Playlist directory name for each track to add
+     */
+    async addRandomTracksFromPlaylists(playlistNames) {
+        const downloadParams = getTrackDownloadParams();
+        const tracks = await music.chooseTracks(playlistNames, false, getTagFilter(), downloadParams[0]);
+        if (tracks.length === 0) {
+            throw new Error('no tracks could be chosen');
+        }
+        for (const track of tracks) {
+            const downloadedTrack = await track.download(...downloadParams);
+            this.add(downloadedTrack, false);
+        }
+    };
+
     /**
      * @param {string} playlistName Playlist directory name
      */
     async addRandomTrackFromPlaylist(playlistName) {
         const playlist = await music.playlist(playlistName);
-        const track = await playlist.chooseRandomTrack(false, getTagFilter());
-        const downloadedTrack = await track.download(...getTrackDownloadParams());
+        const downloadParams = getTrackDownloadParams();
+        const track = await playlist.chooseRandomTrack(false, getTagFilter(), downloadParams[0]);
+        const downloadedTrack = await track.download(...downloadParams);
         this.add(downloadedTrack, false);
     };
 
@@ -163,7 +189,15 @@ class Queue {
 
             // Trash can that appears when hovering - click to remove track
             const tdCover = document.getElementById('template-td-cover').content.cloneNode(true).firstElementChild;
-            tdCover.style.backgroundImage = `url("${queuedTrack.imageUrl}")`;
+            if (track != null) {
+                // Small thumbnail, the downloaded cover is much larger than the queue cell
+                tdCover.style.backgroundImage = `url("${track.coverUrl('tiny', getTrackDownloadParams()[2])}")`;
+                if (track.coverPlaceholder) {
+                    tdCover.style.backgroundColor = track.coverPlaceholder;
+                }
+            } else {
+                tdCover.style.backgroundImage = `url("${queuedTrack.imageUrl}")`;
+            }
             const rememberI = i;
             tdCover.onclick = () => queue.removeFromQueue(rememberI);
 
@@ -27,7 +27,7 @@ async function updateState() {
             return;
         }
 
-        const json = await jsonGet('/radio/info');
+        const json = await jsonGet('/radio/info?audio_type=webm_opus_high');
 
         if (state.currentTrack == null) {
             console.debug('updateState: init currentTrack');
@@ -0,0 +1,927 @@
+"""
+Pure Python reader for tags, duration and stream codecs of common audio containers. Reading
+a file this way is much faster than starting an ffprobe process. Tag names are converted to
+the names used by ffprobe, so the result can be interpreted the same way. Files or features
+that are not supported raise UnsupportedFile, callers should fall back to ffprobe.
+"""
+import re
+import struct
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO
+
+
+class UnsupportedFile(Exception):
+    """
+    File format or feature is not supported, or the file is corrupt
+    """
+
+
+@dataclass
+class ProbeResult:
+    duration: float
+    tags: list[tuple[str, str]]  # Tags of audio streams followed by container tags, like ffprobe
+    video_codecs: list[str]  # ffprobe codec names of video streams, excluding cover images
+    cover: bool = False  # Whether the file has an embedded cover image
+
+
+def _read(fp: BinaryIO, size: int) -> bytes:
+    data = fp.read(size)
+    if len(data) != size:
+        raise UnsupportedFile('unexpected end of file')
+    return data
+
+
+def _file_size(fp: BinaryIO) -> int:
+    position = fp.tell()
+    size = fp.seek(0, 2)
+    fp.seek(position)
+    return size
+
+
+def _add_tag(tags: dict[str, str], name: str, value: str) -> None:
+    """
+    Add tag, multiple values for the same tag are joined using a semicolon like ffmpeg does
+    """
+    if name in tags:
+        tags[name] += ';' + value
+    else:
+        tags[name] = value
+
+
+# ID3v2 (mp3)
+
+_ID3_FRAMES = {
+    'TALB': 'album',
+    'TPE1': 'artist',
+    'TPE2': 'album_artist',
+    'TPE3': 'performer',
+    'TIT2': 'title',
+    'TRCK': 'track',
+    'TPOS': 'disc',
+    'TCON': 'genre',
+    'TCOM': 'composer',
+    'TCOP': 'copyright',
+    'TENC': 'encoded_by',
+    'TSSE': 'encoder',
+    'TLAN': 'language',
+    'TPUB': 'publisher',
+    'TDRC': 'date',
+    'TYER': 'date',
+    # ID3v2.2
+    'TAL': 'album',
+    'TP1': 'artist',
+    'TP2': 'album_artist',
+    'TT2': 'title',
+    'TRK': 'track',
+    'TPA': 'disc',
+    'TCO': 'genre',
+    'TCM': 'composer',
+    'TYE': 'date',
+}
+
+_ID3_ENCODINGS = ['latin-1', 'utf-16', 'utf-16-be', 'utf-8']
+
+
+def _syncsafe(data: bytes) -> int:
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def _id3_strings(encoding: int, data: bytes) -> list[str]:
+    """
+    Decode null separated strings
+    """
+    if encoding >= len(_ID3_ENCODINGS):
+        raise UnsupportedFile('invalid text encoding')
+
+    if encoding in {1, 2}:
+        # Find double null bytes at even offsets
+        parts: list[bytes] = []
+        start = 0
+        for i in range(0, len(data) - 1, 2):
+            if data[i] == 0 and data[i+1] == 0:
+                parts.append(data[start:i])
+                start = i + 2
+        parts.append(data[start:])
+    else:
+        parts = data.split(b'\x00')
+
+    return [part.decode(_ID3_ENCODINGS[encoding], errors='replace').lstrip('\ufeff') for part in parts]
+
+
+def _id3_frame(frame_id: str, data: bytes, tags: dict[str, str]) -> None:
+    if len(data) < 1:
+        return
+
+    encoding = data[0]
+
+    if frame_id in {'TXXX', 'TXX'}:
+        strings = _id3_strings(encoding, data[1:])
+        if len(strings) >= 2 and strings[0]:
+            _add_tag(tags, strings[0], strings[1])
+        return
+
+    if frame_id in {'USLT', 'ULT'}:
+        if len(data) < 4:
+            return
+        language = data[1:4].decode('latin-1')
+        strings = _id3_strings(encoding, data[4:])
+        if len(strings) < 2:
+            return
+        descriptor, text = strings[0], '\n'.join(strings[1:]).rstrip('\n')
+        # Same name as ffmpeg, for example: lyrics-eng
+        name = f'lyrics-{descriptor}-{language}' if descriptor else f'lyrics-{language}'
+        _add_tag(tags, name, text)
+        return
+
+    if not frame_id.startswith('T'):
+        return
+
+    values = [value for value in _id3_strings(encoding, data[1:]) if value != '']
+    if not values:
+        return
+
+    name = _ID3_FRAMES.get(frame_id, frame_id)
+    if name == 'genre' and re.match(r'^\(?\d+\)?', values[0]):
+        # ffmpeg converts ID3v1 genre numbers to names
+        raise UnsupportedFile('numeric genre')
+
+    _add_tag(tags, name, ';'.join(values))
+
+
+def _read_id3v2(fp: BinaryIO, tags: dict[str, str]) -> bool:
+    """
+    Read ID3v2 tag, the file position must be at the start of the tag
+    Returns: Whether the tag contains a picture
+    """
+    header = _read(fp, 10)
+    major_version = header[3]
+    flags = header[5]
+    size = _syncsafe(header[6:10])
+    data = _read(fp, size)
+
+    if major_version not in {2, 3, 4}:
+        raise UnsupportedFile(f'unsupported ID3v2 version: {major_version}')
+
+    if flags & 0x80 and major_version < 4:
+        data = data.replace(b'\xff\x00', b'\xff')
+
+    pos = 0
+    if flags & 0x40:
+        if major_version == 2:
+            raise UnsupportedFile('compressed ID3v2.2 tag')
+        # Skip extended header
+        if major_version == 3:
+            pos = 4 + struct.unpack('>I', data[:4])[0]
+        else:
+            pos = _syncsafe(data[:4])
+
+    header_size = 6 if major_version == 2 else 10
+    cover = False
+
+    while pos + header_size <= len(data):
+        if major_version == 2:
+            frame_id = data[pos:pos+3].decode('latin-1')
+            frame_size = int.from_bytes(data[pos+3:pos+6], 'big')
+            frame_flags = 0
+        else:
+            frame_id = data[pos:pos+4].decode('latin-1')
+            if major_version == 4:
+                frame_size = _syncsafe(data[pos+4:pos+8])
+            else:
+                frame_size = struct.unpack('>I', data[pos+4:pos+8])[0]
+            frame_flags = struct.unpack('>H', data[pos+8:pos+10])[0]
+
+        if frame_id[0] == '\x00':
+            break  # padding
+
+        frame_data = data[pos+header_size:pos+header_size+frame_size]
+        pos += header_size + frame_size
+
+        if frame_id in {'APIC', 'PIC'}:
+            cover = True
+            continue
+
+        if major_version == 3:
+            if frame_flags & 0x00c0:
+                continue  # compressed or encrypted
+            if frame_flags & 0x0020:
+                frame_data = frame_data[1:]  # group identifier
+        elif major_version == 4:
+            if frame_flags & 0x000c:
+                continue  # compressed or encrypted
+            if frame_flags & 0x0040:
+                frame_data = frame_data[1:]  # group identifier
+            if frame_flags & 0x0001:
+                frame_data = frame_data[4:]  # data length indicator
+            if frame_flags & 0x0002 or flags & 0x80:
+                frame_data = frame_data.replace(b'\xff\x00', b'\xff')
+
+        _id3_frame(frame_id, frame_data, tags)
+
+    return cover
+
+
+# MPEG audio (mp3)
+
+_MPEG_BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+
+_MPEG_SAMPLE_RATES = {
+    1: [44100, 48000, 32000],
+    2: [22050, 24000, 16000],
+    25: [11025, 12000, 8000],
+}
+
+
+@dataclass
+class _MpegFrame:
+    version: int  # 1, 2 or 25 (MPEG 2.5)
+    layer: int
+    bitrate: int  # bits per second
+    sample_rate: int
+    mono: bool
+    length: int  # frame length in bytes
+
+    @property
+    def samples(self) -> int:
+        if self.layer == 1:
+            return 384
+        if self.layer == 3 and self.version != 1:
+            return 576
+        return 1152
+
+    @staticmethod
+    def parse(header: bytes) -> '_MpegFrame | None':
+        if len(header) < 4 or header[0] != 0xff or header[1] & 0xe0 != 0xe0:
+            return None
+        version = {0: 25, 2: 2, 3: 1}.get((header[1] >> 3) & 3)
+        layer = {1: 3, 2: 2, 3: 1}.get((header[1] >> 1) & 3)
+        bitrate_index = header[2] >> 4
+        sample_rate_index = (header[2] >> 2) & 3
+        if version is None or layer is None or bitrate_index in {0, 15} or sample_rate_index == 3:
+            return None
+        bitrate = _MPEG_BITRATES[(1 if version == 1 else 2, layer)][bitrate_index] * 1000
+        sample_rate = _MPEG_SAMPLE_RATES[version][sample_rate_index]
+        padding = (header[2] >> 1) & 1
+        if layer == 1:
+            length = (12 * bitrate // sample_rate + padding) * 4
+        elif layer == 3 and version != 1:
+            length = 72 * bitrate // sample_rate + padding
+        else:
+            length = 144 * bitrate // sample_rate + padding
+        return _MpegFrame(version, layer, bitrate, sample_rate, header[3] >> 6 == 3, length)
+
+
+def _read_mp3(fp: BinaryIO) -> ProbeResult:
+    tags: dict[str, str] = {}
+    cover = False
+    while True:
+        tag_start = fp.tell()
+        is_tag = fp.read(3) == b'ID3'
+        fp.seek(tag_start)
+        if not is_tag:
+            break
+        cover = _read_id3v2(fp, tags) or cover
+
+    # Find first frame. Some files have padding or garbage between the tag and the first frame.
+    audio_start = fp.tell()
+    data = fp.read(64*1024)
+    frame = None
+    offset = 0
+    for offset in range(len(data) - 4):
+        if data[offset] != 0xff:
+            continue
+        frame = _MpegFrame.parse(data[offset:offset+4])
+        if frame is None:
+            continue
+        # Verify next frame, to avoid false sync
+        next_frame = data[offset+frame.length:offset+frame.length+4]
+        if len(next_frame) == 4 and _MpegFrame.parse(next_frame) is None:
+            frame = None
+            continue
+        break
+
+    if frame is None:
+        if data[:4] == b'fLaC':
+            raise UnsupportedFile('FLAC with ID3 tag')
+        raise UnsupportedFile('no MPEG audio frame found')
+
+    audio_start += offset
+    frame_data = data[offset:offset+frame.length]
+
+    audio_end = _file_size(fp)
+    if audio_end >= 128:
+        fp.seek(audio_end - 128)
+        if fp.read(3) == b'TAG':
+            if not tags:
+                # ffmpeg reads ID3v1 tags when there is no other tag, which would require a genre list
+                raise UnsupportedFile('ID3v1 tag')
+            audio_end -= 128
+    if audio_end >= 32:
+        fp.seek(audio_end - 32)
+        if fp.read(8) == b'APETAGEX':
+            raise UnsupportedFile('APE tag')
+
+    # Xing or Info header contains number of frames, for VBR files
+    if frame.version == 1:
+        xing_offset = 4 + (17 if frame.mono else 32)
+    else:
+        xing_offset = 4 + (9 if frame.mono else 17)
+    if frame_data[xing_offset:xing_offset+4] in {b'Xing', b'Info'}:
+        xing_flags, = struct.unpack('>I', frame_data[xing_offset+4:xing_offset+8])
+        if xing_flags & 1:
+            frame_count, = struct.unpack('>I', frame_data[xing_offset+8:xing_offset+12])
+            return ProbeResult(frame_count * frame.samples / frame.sample_rate, list(tags.items()), [], cover)
+    elif frame_data[36:40] == b'VBRI':
+        frame_count, = struct.unpack('>I', frame_data[50:54])
+        return ProbeResult(frame_count * frame.samples / frame.sample_rate, list(tags.items()), [], cover)
+
+    # Constant bitrate
+    return ProbeResult((audio_end - audio_start) * 8 / frame.bitrate, list(tags.items()), [], cover)
+
+
+# Vorbis comments (flac, ogg)
+
+_VORBIS_COMMENT_NAMES = {
+    'ALBUMARTIST': 'album_artist',
+    'TRACKNUMBER': 'track',
+    'DISCNUMBER': 'disc',
+    'DESCRIPTION': 'comment',
+}
+
+
+def _vorbis_comments(data: bytes, tags: dict[str, str]) -> bool:
+    """
+    Returns: Whether the comments contain a picture
+    """
+    cover = False
+    try:
+        vendor_length, = struct.unpack_from('<I', data, 0)
+        pos = 4 + vendor_length
+        count, = struct.unpack_from('<I', data, pos)
+        pos += 4
+        for _i in range(count):
+            length, = struct.unpack_from('<I', data, pos)
+            comment = data[pos+4:pos+4+length].decode(errors='replace')
+            pos += 4 + length
+            if '=' not in comment:
+                continue
+            name, value = comment.split('=', 1)
+            name = name.upper()
+            if name == 'METADATA_BLOCK_PICTURE':
+                cover = True
+                continue
+            _add_tag(tags, _VORBIS_COMMENT_NAMES.get(name, name), value)
+    except struct.error as ex:
+        raise UnsupportedFile('invalid vorbis comment') from ex
+    return cover
+
+
+def _read_flac(fp: BinaryIO) -> ProbeResult:
+    _read(fp, 4)  # fLaC
+    tags: dict[str, str] = {}
+    duration: float | None = None
+    cover = False
+    while True:
+        header = _read(fp, 4)
+        block_type = header[0] & 0x7f
+        length = int.from_bytes(header[1:4], 'big')
+        if block_type == 0:  # STREAMINFO
+            data = _read(fp, length)
+            sample_rate = (data[10] << 12) | (data[11] << 4) | (data[12] >> 4)
+            total_samples = ((data[13] & 0x0f) << 32) | struct.unpack('>I', data[14:18])[0]
+            if sample_rate and total_samples:
+                duration = total_samples / sample_rate
+        elif block_type == 4:  # VORBIS_COMMENT
+            cover = _vorbis_comments(_read(fp, length), tags) or cover
+        elif block_type == 6:  # PICTURE
+            cover = True
+            fp.seek(length, 1)
+        else:
+            fp.seek(length, 1)
+
+        if header[0] & 0x80:  # last block
+            break
+
+    if duration is None:
+        raise UnsupportedFile('unknown duration')
+
+    return ProbeResult(duration, list(tags.items()), [], cover)
+
+
+# Ogg (vorbis, opus)
+
+def _ogg_page(fp: BinaryIO) -> tuple[int, int, int, list[bytes], bool]:
+    """
+    Returns: Tuple of header type, granule position, stream serial, packet segments and whether
+             the last segment continues on the next page
+    """
+    header = _read(fp, 27)
+    if header[:4] != b'OggS':
+        raise UnsupportedFile('invalid ogg page')
+    header_type = header[5]
+    granule, serial = struct.unpack_from('<qI', header, 6)
+    lacing = _read(fp, header[26])
+    segments: list[bytes] = []
+    segment = b''
+    for lace in lacing:
+        segment += _read(fp, lace)
+        if lace < 255:
+            segments.append(segment)
+            segment = b''
+    continued = lacing[-1] == 255 if lacing else False
+    if continued:
+        segments.append(segment)
+    return header_type, granule, serial, segments, continued
+
+
+def _ogg_last_granule(fp: BinaryIO, serial: int) -> int | None:
+    size = _file_size(fp)
+    for search_size in (64*1024, 1024*1024):
+        start = max(0, size - search_size)
+        fp.seek(start)
+        data = fp.read(search_size)
+        pos = data.rfind(b'OggS')
+        while pos != -1:
+            if pos + 18 <= len(data) and data[pos+4] == 0:
+                granule, page_serial = struct.unpack_from('<qI', data, pos + 6)
+                if page_serial == serial and granule != -1:
+                    return granule
+            pos = data.rfind(b'OggS', 0, pos)
+        if start == 0:
+            break
+    return None
+
+
+def _read_ogg(fp: BinaryIO) -> ProbeResult:
+    packets: list[bytes] = []
+    partial = b''
+    serial = None
+    # Headers are in the first pages, a comment packet with cover art may span many pages
+    while len(packets) < 2:
+        header_type, _granule, page_serial, segments, continued = _ogg_page(fp)
+        if serial is None:
+            serial = page_serial
+        elif page_serial != serial or header_type & 0x02:
+            raise UnsupportedFile('multiple logical streams')
+        for i, segment in enumerate(segments):
+            partial += segment
+            if not (continued and i == len(segments) - 1):
+                packets.append(partial)
+                partial = b''
+
+    assert serial is not None
+    tags: dict[str, str] = {}
+    identification, comments = packets[0], packets[1]
+    if identification.startswith(b'\x01vorbis') and comments.startswith(b'\x03vorbis'):
+        sample_rate, = struct.unpack_from('<I', identification, 12)
+        pre_skip = 0
+        cover = _vorbis_comments(comments[7:], tags)
+    elif identification.startswith(b'OpusHead') and comments.startswith(b'OpusTags'):
+        sample_rate = 48000
+        pre_skip, = struct.unpack_from('<H', identification, 10)
+        cover = _vorbis_comments(comments[8:], tags)
+    else:
+        raise UnsupportedFile('unsupported ogg codec')
+
+    granule = _ogg_last_granule(fp, serial)
+    if granule is None or sample_rate == 0:
+        raise UnsupportedFile('unknown duration')
+
+    return ProbeResult(max(0, granule - pre_skip) / sample_rate, list(tags.items()), [], cover)
+
+
+# MP4 (m4a, mp4)
+
+_MP4_ATOMS = {
+    b'\xa9nam': 'title',
+    b'\xa9ART': 'artist',
+    b'aART': 'album_artist',
+    b'\xa9alb': 'album',
+    b'\xa9day': 'date',
+    b'\xa9gen': 'genre',
+    b'\xa9lyr': 'lyrics',
+    b'\xa9wrt': 'composer',
+    b'\xa9cmt': 'comment',
+    b'\xa9too': 'encoder',
+    b'cprt': 'copyright',
+    b'\xa9cpy': 'copyright',
+    b'desc': 'description',
+}
+
+_MP4_VIDEO_CODECS = {
+    b'avc1': 'h264',
+    b'avc3': 'h264',
+    b'vp09': 'vp9',
+    b'hvc1': 'hevc',
+    b'hev1': 'hevc',
+    b'av01': 'av1',
+}
+
+
+def _mp4_atoms(data: bytes) -> list[tuple[bytes, bytes]]:
+    atoms: list[tuple[bytes, bytes]] = []
+    pos = 0
+    while pos + 8 <= len(data):
+        size, atom_type = struct.unpack_from('>I4s', data, pos)
+        header_size = 8
+        if size == 1:
+            size, = struct.unpack_from('>Q', data, pos + 8)
+            header_size = 16
+        elif size == 0:
+            size = len(data) - pos
+        if size < header_size:
+            raise UnsupportedFile('invalid atom size')
+        atoms.append((atom_type, data[pos+header_size:pos+size]))
+        pos += size
+    return atoms
+
+
+def _mp4_child(data: bytes, atom_type: bytes) -> bytes | None:
+    for child_type, child_data in _mp4_atoms(data):
+        if child_type == atom_type:
+            return child_data
+    return None
+
+
+def _mp4_ilst(ilst: bytes, tags: dict[str, str]) -> bool:
+    """
+    Returns: Whether the item list contains a cover image
+    """
+    cover = False
+    for item_type, item in _mp4_atoms(ilst):
+        data = _mp4_child(item, b'data')
+        if data is None or len(data) < 8:
+            continue
+        data_type, = struct.unpack_from('>I', data, 0)
+        value = data[8:]
+
+        if item_type == b'covr':
+            cover = True
+        elif item_type in {b'trkn', b'disk'}:
+            if len(value) < 6:
+                continue
+            number, total = struct.unpack_from('>HH', value, 2)
+            name = 'track' if item_type == b'trkn' else 'disc'
+            _add_tag(tags, name, f'{number}/{total}' if total else str(number))
+        elif item_type == b'gnre':
+            raise UnsupportedFile('numeric genre')
+        elif item_type in _MP4_ATOMS:
+            if data_type == 1:
+                _add_tag(tags, _MP4_ATOMS[item_type], value.decode(errors='replace'))
+            elif data_type == 2:
+                _add_tag(tags, _MP4_ATOMS[item_type], value.decode('utf-16-be', errors='replace'))
+    return cover
+
+
+def _read_mp4(fp: BinaryIO) -> ProbeResult:
+    moov = None
+    size = _file_size(fp)
+    pos = 0
+    while pos + 8 <= size:
+        fp.seek(pos)
+        atom_size, atom_type = struct.unpack('>I4s', _read(fp, 8))
+        header_size = 8
+        if atom_size == 1:
+            atom_size, = struct.unpack('>Q', _read(fp, 8))
+            header_size = 16
+        elif atom_size == 0:
+            atom_size = size - pos
+        if atom_size < header_size:
+            raise UnsupportedFile('invalid atom size')
+        if atom_type == b'moov':
+            moov = _read(fp, atom_size - header_size)
+            break
+        pos += atom_size
+
+    if moov is None:
+        raise UnsupportedFile('missing moov atom')
+
+    mvhd = _mp4_child(moov, b'mvhd')
+    if mvhd is None:
+        raise UnsupportedFile('missing mvhd atom')
+    if mvhd[0] == 1:
+        timescale, duration = struct.unpack_from('>IQ', mvhd, 20)
+    else:
+        timescale, duration = struct.unpack_from('>II', mvhd, 12)
+    if timescale == 0 or duration == 0:
+        raise UnsupportedFile('unknown duration')
+
+    video_codecs: list[str] = []
+    for atom_type, trak in _mp4_atoms(moov):
+        if atom_type != b'trak':
+            continue
+        mdia = _mp4_child(trak, b'mdia')
+        hdlr = _mp4_child(mdia, b'hdlr') if mdia else None
+        if mdia is None or hdlr is None or hdlr[8:12] != b'vide':
+            continue
+        minf = _mp4_child(mdia, b'minf')
+        stbl = _mp4_child(minf, b'stbl') if minf else None
+        stsd = _mp4_child(stbl, b'stsd') if stbl else None
+        if stsd is not None and len(stsd) >= 16:
+            codec = stsd[12:16]
+            video_codecs.append(_MP4_VIDEO_CODECS.get(codec, codec.decode('latin-1')))
+
+    tags: dict[str, str] = {}
+    cover = False
+    udta = _mp4_child(moov, b'udta')
+    if udta is not None:
+        for atom_type, atom in _mp4_atoms(udta):
+            if atom_type == b'meta':
+                # meta is a full atom, except in some QuickTime files
+                if atom[4:8] != b'hdlr':
+                    atom = atom[4:]
+                ilst = _mp4_child(atom, b'ilst')
+                if ilst is not None:
+                    cover = _mp4_ilst(ilst, tags) or cover
+            elif atom_type in _MP4_ATOMS and len(atom) >= 4:
+                # QuickTime user data text: length, language, text
+                length, = struct.unpack_from('>H', atom, 0)
+                _add_tag(tags, _MP4_ATOMS[atom_type], atom[4:4+length].decode(errors='replace'))
+
+    return ProbeResult(duration / timescale, list(tags.items()), video_codecs, cover)
+
+
+# Matroska (mkv, mka, webm)
+
+_EBML = 0x1A45DFA3
+_SEGMENT = 0x18538067
+_SEEK_HEAD = 0x114D9B74
+_SEEK = 0x4DBB
+_SEEK_ID = 0x53AB
+_SEEK_POSITION = 0x53AC
+_INFO = 0x1549A966
+_TIMECODE_SCALE = 0x2AD7B1
+_DURATION = 0x4489
+_TRACKS = 0x1654AE6B
+_TRACK_ENTRY = 0xAE
+_TRACK_UID = 0x73C5
+_TRACK_TYPE = 0x83
+_CODEC_ID = 0x86
+_TAGS = 0x1254C367
+_TAG = 0x7373
+_TARGETS = 0x63C0
+_TAG_TRACK_UID = 0x63C5
+_SIMPLE_TAG = 0x67C8
+_TAG_NAME = 0x45A3
+_TAG_LANGUAGE = 0x447A
+_TAG_STRING = 0x4487
+_CLUSTER = 0x1F43B675
+_ATTACHMENTS = 0x1941A469
+_ATTACHED_FILE = 0x61A7
+_FILE_MIME_TYPE = 0x4660
+
+_MATROSKA_VIDEO_CODECS = {
+    'V_VP9': 'vp9',
+    'V_VP8': 'vp8',
+    'V_MPEG4/ISO/AVC': 'h264',
+    'V_MPEGH/ISO/HEVC': 'hevc',
+    'V_AV1': 'av1',
+}
+
+_MATROSKA_TAG_NAMES = {
+    'LEAD_PERFORMER': 'performer',
+    'PART_NUMBER': 'track',
+}
+
+
+def _vint(data: bytes, pos: int, keep_marker: bool) -> tuple[int, int, bool]:
+    """
+    Returns: Tuple of value, new position and whether all value bits are set (unknown size)
+    """
+    if pos >= len(data):
+        raise UnsupportedFile('unexpected end of element')
+    first = data[pos]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not first & mask:
+        length += 1
+        mask >>= 1
+    if length > 8 or pos + length > len(data):
+        raise UnsupportedFile('invalid variable size integer')
+    value = first if keep_marker else first & (mask - 1)
+    for byte in data[pos+1:pos+length]:
+        value = (value << 8) | byte
+    all_ones = (first & (mask - 1)) == mask - 1 and all(byte == 0xff for byte in data[pos+1:pos+length])
+    return value, pos + length, all_ones
+
+
+def _ebml_elements(data: bytes) -> list[tuple[int, bytes]]:
+    elements: list[tuple[int, bytes]] = []
+    pos = 0
+    while pos < len(data):
+        element_id, pos, _unknown = _vint(data, pos, True)
+        size, pos, unknown = _vint(data, pos, False)
+        if unknown:
+            raise UnsupportedFile('unknown element size')
+        elements.append((element_id, data[pos:pos+size]))
+        pos += size
+    return elements
+
+
+def _ebml_uint(data: bytes) -> int:
+    return int.from_bytes(data, 'big')
+
+
+def _ebml_float(data: bytes) -> float:
+    if len(data) == 4:
+        return struct.unpack('>f', data)[0]
+    if len(data) == 8:
+        return struct.unpack('>d', data)[0]
+    raise UnsupportedFile('invalid float size')
+
+
+def _ebml_header(fp: BinaryIO) -> tuple[int, int, bool]:
+    """
+    Read element header from file
+    Returns: Tuple of element id, element size and whether the size is unknown
+    """
+    data = fp.read(12)
+    element_id, pos, _unknown = _vint(data, 0, True)
+    size, pos, unknown = _vint(data, pos, False)
+    fp.seek(pos - len(data), 1)
+    return element_id, size, unknown
+
+
+def _matroska_simple_tag(data: bytes, prefix: str, tags: dict[str, str]) -> None:
+    name = None
+    language = 'und'
+    value = None
+    children: list[bytes] = []
+    for element_id, element in _ebml_elements(data):
+        if element_id == _TAG_NAME:
+            name = element.decode(errors='replace')
+        elif element_id == _TAG_LANGUAGE:
+            language = element.decode(errors='replace').rstrip('\x00')
+        elif element_id == _TAG_STRING:
+            value = element.decode(errors='replace').rstrip('\x00')
+        elif element_id == _SIMPLE_TAG:
+            children.append(element)
+
+    if name is None:
+        return
+
+    name = prefix + name
+    if value is not None:
+        key = _MATROSKA_TAG_NAMES.get(name, name)
+        if language != 'und':
+            key += '-' + language
+        _add_tag(tags, key, value)
+
+    for child in children:
+        _matroska_simple_tag(child, name + '/', tags)
+
+
+def _read_matroska(fp: BinaryIO) -> ProbeResult:
+    _element_id, size, _unknown = _ebml_header(fp)
+    fp.seek(size, 1)  # EBML header
+    element_id, size, unknown = _ebml_header(fp)
+    if element_id != _SEGMENT:
+        raise UnsupportedFile('missing segment')
+    segment_start = fp.tell()
+    segment_end = _file_size(fp) if unknown else segment_start + size
+
+    wanted = {_INFO, _TRACKS, _TAGS, _ATTACHMENTS}
+    elements: dict[int, bytes] = {}
+    seek_positions: dict[int, int] = {}
+
+    # Read top level elements up to the first cluster
+    while fp.tell() < segment_end:
+        element_id, size, unknown = _ebml_header(fp)
+        if element_id == _CLUSTER:
+            break
+        if unknown:
+            raise UnsupportedFile('unknown element size')
+        if element_id == _SEEK_HEAD:
+            for seek_id, seek in _ebml_elements(_read(fp, size)):
+                if seek_id != _SEEK:
+                    continue
+                seek_children = dict(_ebml_elements(seek))
+                if _SEEK_ID in seek_children and _SEEK_POSITION in seek_children:
+                    target = _ebml_uint(seek_children[_SEEK_ID])
+                    seek_positions[target] = segment_start + _ebml_uint(seek_children[_SEEK_POSITION])
+        elif element_id in wanted and element_id not in elements:
+            elements[element_id] = _read(fp, size)
+        else:
+            fp.seek(size, 1)
+
+    # Elements after clusters can only be found using the seek head
+    for element_id in wanted:
+        if element_id not in elements and element_id in seek_positions:
+            fp.seek(seek_positions[element_id])
+            found_id, size, unknown = _ebml_header(fp)
+            if found_id == element_id and not unknown:
+                elements[element_id] = _read(fp, size)
+
+    if _INFO not in elements:
+        raise UnsupportedFile('missing segment info')
+
+    timecode_scale = 1000000
+    duration = None
+    for element_id, element in _ebml_elements(elements[_INFO]):
+        if element_id == _TIMECODE_SCALE:
+            timecode_scale = _ebml_uint(element)
+        elif element_id == _DURATION:
+            duration = _ebml_float(element)
+    if duration is None:
+        raise UnsupportedFile('unknown duration')
+
+    audio_tracks: set[int] = set()
+    video_codecs: list[str] = []
+    for element_id, entry in _ebml_elements(elements.get(_TRACKS, b'')):
+        if element_id != _TRACK_ENTRY:
+            continue
+        track_uid = None
+        track_type = None
+        codec_id = ''
+        for child_id, child in _ebml_elements(entry):
+            if child_id == _TRACK_UID:
+                track_uid = _ebml_uint(child)
+            elif child_id == _TRACK_TYPE:
+                track_type = _ebml_uint(child)
+            elif child_id == _CODEC_ID:
+                codec_id = child.decode(errors='replace').rstrip('\x00')
+        if track_type == 1:
+            video_codecs.append(_MATROSKA_VIDEO_CODECS.get(codec_id, codec_id))
+        elif track_type == 2 and track_uid is not None:
+            audio_tracks.add(track_uid)
+
+    stream_tags: dict[str, str] = {}
+    format_tags: dict[str, str] = {}
+    for element_id, tag in _ebml_elements(elements.get(_TAGS, b'')):
+        if element_id != _TAG:
+            continue
+        track_uids: list[int] = []
+        simple_tags: list[bytes] = []
+        for child_id, child in _ebml_elements(tag):
+            if child_id == _TARGETS:
+                track_uids.extend(_ebml_uint(target) for target_id, target in _ebml_elements(child) if target_id == _TAG_TRACK_UID)
+            elif child_id == _SIMPLE_TAG:
+                simple_tags.append(child)
+
+        track_uids = [uid for uid in track_uids if uid != 0]
+        if track_uids:
+            # Tags of video tracks are not used, like ffprobe stream tags
+            if not any(uid in audio_tracks for uid in track_uids):
+                continue
+            target = stream_tags
+        else:
+            target = format_tags
+
+        for simple_tag in simple_tags:
+            _matroska_simple_tag(simple_tag, '', target)
+
+    # Image attachments are cover images, ffmpeg shows them as attached pictures
+    cover = False
+    for element_id, attached_file in _ebml_elements(elements.get(_ATTACHMENTS, b'')):
+        if element_id != _ATTACHED_FILE:
+            continue
+        for child_id, child in _ebml_elements(attached_file):
+            if child_id == _FILE_MIME_TYPE and child.startswith(b'image/'):
+                cover = True
+
+    return ProbeResult(duration * timecode_scale / 1e9,
+                       list(stream_tags.items()) + list(format_tags.items()),
+                       video_codecs,
+                       cover)
+
+
+def read(fp: BinaryIO) -> ProbeResult:
+    """
+    Read tags, duration and video codecs from a seekable binary file
+    Raises: UnsupportedFile
+    """
+    magic = fp.read(12)
+    fp.seek(0)
+
+    try:
+        if magic.startswith(b'fLaC'):
+            return _read_flac(fp)
+        if magic.startswith(b'OggS'):
+            return _read_ogg(fp)
+        if magic[4:8] == b'ftyp':
+            return _read_mp4(fp)
+        if magic.startswith(b'\x1a\x45\xdf\xa3'):
+            return _read_matroska(fp)
+        if magic.startswith(b'ID3') or _MpegFrame.parse(magic[:4]) is not None:
+            return _read_mp3(fp)
+    except (struct.error, IndexError, ValueError) as ex:
+        raise UnsupportedFile('corrupt file') from ex
+
+    raise UnsupportedFile('unknown file format')
+
+
+def read_file(path: Path) -> ProbeResult:
+    """
+    Read tags, duration and video codecs from a file
+    Raises: UnsupportedFile
+    """
+    with path.open('rb') as fp:
+        return read(fp)
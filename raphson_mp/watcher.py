@@ -0,0 +1,269 @@
+"""
+Watch the music directory for changes using inotify (Linux only), and scan changed tracks
+shortly after they have changed. This makes full rescans only necessary as a fallback.
+"""
+import ctypes
+import ctypes.util
+import logging
+import os
+import struct
+import sys
+import time
+from pathlib import Path
+from threading import Condition, Thread
+
+from raphson_mp import cache, db, music, scanner, settings
+
+log = logging.getLogger(__name__)
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+# Changes are processed after no events have been received for a path for this many seconds,
+# so a file that is still being written or copied is only scanned once.
+DEBOUNCE_SECONDS = 2
+
+
+class Watcher:
+    fd: int
+    directories: dict[int, Path]  # watch descriptor to directory path
+    pending: dict[str, float]  # track relpath to time of last event
+    pending_moves: list[tuple[str, str, bool]]  # old relpath, new relpath, is directory
+    pending_playlists: bool  # playlist directories have been added or removed
+    pending_full_scan: bool  # events have been lost, everything needs to be scanned
+    condition: Condition
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.directories = {}
+        self.pending = {}
+        self.pending_moves = []
+        self.pending_playlists = False
+        self.pending_full_scan = False
+        self.condition = Condition()
+
+    def _add_watch(self, path: Path) -> None:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            log.warning('Cannot watch directory %s: %s', path, os.strerror(ctypes.get_errno()))
+            return
+        self.directories[wd] = path
+
+    def _remove_watch(self, wd: int) -> None:
+        self._libc.inotify_rm_watch(self.fd, wd)
+        del self.directories[wd]
+
+    def _add_watches_recursively(self, path: Path) -> None:
+        """
+        Watch a directory and its subdirectories, and queue all music files in it for scanning
+        in case they were created before the watch was added.
+        """
+        self._add_watch(path)
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.trash.'):
+                        continue
+                    # Symlinked directories are not followed, they may form a cycle
+                    if entry.is_dir(follow_symlinks=False):
+                        self._add_watches_recursively(Path(entry.path))
+                    elif music.is_music_file(Path(entry.path)):
+                        self._queue(Path(entry.path))
+        except OSError as ex:
+            log.warning('Cannot list directory %s: %s', path, ex)
+
+    def _subtree_watches(self, path: Path) -> list[int]:
+        return [wd for wd, dir_path in self.directories.items() if dir_path == path or dir_path.is_relative_to(path)]
+
+    def _queue(self, path: Path) -> None:
+        self.pending[music.to_relpath(path)] = time.monotonic()
+
+    def _remove_watches(self, path: Path) -> None:
+        for wd in self._subtree_watches(path):
+            self._remove_watch(wd)
+
+    def _queue_removed_directory(self, path: Path) -> None:
+        """
+        Directory was deleted or moved away. Stop watching it and queue all its tracks.
+        """
+        self._remove_watches(path)
+
+        prefix = music.to_relpath(path) + '/'
+        with db.connect(read_only=True) as conn:
+            for relpath, in conn.execute("SELECT path FROM track WHERE substr(path, 1, ?) = ?", (len(prefix), prefix)):
+                self.pending[relpath] = time.monotonic()
+
+    def _handle_event(self, wd: int, mask: int, cookie: int, name: str, moves: dict[int, tuple[Path, bool]]) -> None:
+        if mask & IN_Q_OVERFLOW:
+            log.warning('Event queue overflow, rescanning all playlists')
+            self.pending_full_scan = True
+            return
+
+        if mask & IN_IGNORED:
+            self.directories.pop(wd, None)
+            return
+
+        if wd not in self.directories:
+            return
+
+        path = self.directories[wd] / name
+        is_playlist = self.directories[wd] == settings.music_dir
+        trashed = music.is_trashed(path)
+
+        if mask & IN_MOVED_FROM:
+            moves[cookie] = (path, bool(mask & IN_ISDIR))
+            return
+
+        if mask & IN_MOVED_TO and cookie in moves:
+            old_path, _is_dir = moves.pop(cookie)
+            old_trashed = music.is_trashed(old_path)
+            if mask & IN_ISDIR:
+                playlist_moved = is_playlist or old_path.parent == settings.music_dir
+                self.pending_playlists = self.pending_playlists or playlist_moved
+                if not old_trashed and not trashed and not playlist_moved:
+                    # Watches follow the moved directory, but all paths have changed
+                    self._remove_watches(old_path)
+                    self.pending_moves.append((music.to_relpath(old_path), music.to_relpath(path), True))
+                elif not old_trashed:
+                    self._queue_removed_directory(old_path)
+                if not trashed:
+                    self._add_watches_recursively(path)
+            else:
+                if music.is_music_file(old_path) and music.is_music_file(path) and not old_trashed and not trashed:
+                    self.pending_moves.append((music.to_relpath(old_path), music.to_relpath(path), False))
+                    return
+                if music.is_music_file(old_path) and not old_trashed:
+                    self._queue(old_path)
+                if music.is_music_file(path) and not trashed:
+                    self._queue(path)
+            return
+
+        if mask & IN_ISDIR:
+            if is_playlist:
+                self.pending_playlists = True
+            if trashed:
+                return
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self._add_watches_recursively(path)
+            elif mask & IN_DELETE:
+                self._queue_removed_directory(path)
+            return
+
+        if trashed or not music.is_music_file(path):
+            return
+
+        if mask & (IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE):
+            self._queue(path)
+
+    def _read_events(self) -> None:
+        while True:
+            data = os.read(self.fd, 64*1024)
+            moves: dict[int, tuple[Path, bool]] = {}
+            with self.condition:
+                pos = 0
+                while pos < len(data):
+                    wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, pos)
+                    name = os.fsdecode(data[pos+_EVENT_HEADER.size:pos+_EVENT_HEADER.size+length].rstrip(b'\x00'))
+                    pos += _EVENT_HEADER.size + length
+                    try:
+                        self._handle_event(wd, mask, cookie, name, moves)
+                    except Exception:
+                        log.exception('Error handling event for %s', name)
+
+                # Moved out of the music directory, there will be no matching IN_MOVED_TO event
+                for path, is_dir in moves.values():
+                    if music.is_trashed(path):
+                        continue
+                    if is_dir:
+                        self._queue_removed_directory(path)
+                        if path.parent == settings.music_dir:
+                            self.pending_playlists = True
+                    elif music.is_music_file(path):
+                        self._queue(path)
+
+                self.condition.notify()
+
+    def _process_pending(self) -> None:
+        while True:
+            with self.condition:
+                while not self.pending and not self.pending_moves and not self.pending_playlists and not self.pending_full_scan:
+                    self.condition.wait()
+
+                now = time.monotonic()
+                ready = [relpath for relpath, last_event in self.pending.items() if now - last_event > DEBOUNCE_SECONDS]
+                if not ready and not self.pending_moves and not self.pending_playlists and not self.pending_full_scan:
+                    self.condition.wait(DEBOUNCE_SECONDS)
+                    continue
+
+                for relpath in ready:
+                    del self.pending[relpath]
+                moves, self.pending_moves = self.pending_moves, []
+                full_scan, self.pending_full_scan = self.pending_full_scan, False
+                scan_playlists, self.pending_playlists = self.pending_playlists, False
+
+            try:
+                if full_scan:
+                    scanner.scan()
+                    continue
+
+                cache_keys: list[tuple[str, str]] = []
+                with scanner.scan_lock, db.connect() as conn:
+                    if scan_playlists:
+                        scanner.scan_playlists(conn)
+                    for old_relpath, new_relpath, is_dir in moves:
+                        if is_dir:
+                            cache_keys.extend(scanner.move_directory(conn, old_relpath, new_relpath))
+                        elif (track_cache_keys := scanner.move_track(conn, old_relpath, new_relpath)) is not None:
+                            cache_keys.extend(track_cache_keys)
+                        else:
+                            ready.append(new_relpath)
+                    playlists = {row[0] for row in conn.execute('SELECT path FROM playlist')}
+                    for relpath in ready:
+                        playlist = relpath.split('/')[0]
+                        if playlist not in playlists:
+                            continue
+                        log.info('Changed on disk: %s', relpath)
+                        scanner.scan_track(conn, playlist, music.from_relpath(relpath), relpath)
+                # Only after the moves have been committed
+                cache.move(cache_keys)
+            except Exception:
+                log.exception('Error processing changes')
+
+    def start(self) -> None:
+        self._add_watches_recursively(settings.music_dir)
+        with self.condition:
+            # Files found while adding watches are already known to the scanner
+            self.pending.clear()
+        log.info('Watching %s directories for changes', len(self.directories))
+        Thread(target=self._read_events, name='watcher-events', daemon=True).start()
+        Thread(target=self._process_pending, name='watcher-scanner', daemon=True).start()
+
+
+def start() -> None:
+    """
+    Start watching the music directory in background threads
+    """
+    if sys.platform != 'linux':
+        log.warning('Watching for changes is only supported on Linux')
+        return
+
+    if settings.offline_mode:
+        log.info('Not watching for changes in offline mode')
+        return
+
+    Watcher().start()
@@ -6,6 +6,7 @@ from unittest import TestCase
 from flask.testing import FlaskClient
 
 from raphson_mp import auth, main, settings, db
+from raphson_mp.music import Track
 
 
 TEST_USERNAME: str = 'autotest'
@@ -107,3 +108,27 @@ class TestFlask(TestCase):
         assert type(playlist['track_count']) == int
         assert type(playlist['favorite']) == bool
         assert type(playlist['write']) == bool
+
+    # --------------- TRACK --------------- #
+
+    def test_cover_placeholder(self):
+        with db.connect() as conn:
+            relpath, album_key = conn.execute('SELECT path, album_key FROM track WHERE album_key IS NOT NULL ORDER BY RANDOM() LIMIT 1').fetchone()
+            conn.execute('DELETE FROM cover_placeholder WHERE album_key = ?', (album_key,))
+        # Remove cached thumbnails, so the cover is generated again
+        with db.cache() as conn:
+            conn.execute("DELETE FROM cache WHERE key LIKE 'albumcover' || ? || '%'", (album_key,))
+
+        # Cached until the library changes, so it must not include the placeholder
+        response = self.client.get(f'/track/{relpath}/info')
+        assert response.status_code == 200
+        assert 'cover_placeholder' not in cast(Any, response.json)
+
+        with db.connect(read_only=True) as conn:
+            assert cast(Track, Track.by_relpath(conn, relpath)).info_dict()['cover_placeholder'] is None
+
+        response = self.client.get(f'/track/{relpath}/cover', query_string={'quality': 'tiny', 'meme': '0'})
+        assert response.status_code == 200
+
+        with db.connect(read_only=True) as conn:
+            assert cast(str, cast(Track, Track.by_relpath(conn, relpath)).info_dict()['cover_placeholder']).startswith('#')
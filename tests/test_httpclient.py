@@ -0,0 +1,93 @@
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from unittest import TestCase
+
+from raphson_mp import httpclient, settings
+
+
+class _Handler(BaseHTTPRequestHandler):
+    requests: list[str] = []
+    unavailable_count: int = 0
+
+    def do_GET(self):
+        _Handler.requests.append(self.path)
+        if self.path == '/unavailable' and _Handler.unavailable_count < 2:
+            _Handler.unavailable_count += 1
+            self.send_response(503)
+            self.end_headers()
+            return
+
+        body = self.headers['User-Agent'].encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestHttpClient(TestCase):
+    def setUp(self):
+        _Handler.requests = []
+        _Handler.unavailable_count = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f'http://127.0.0.1:{self.server.server_port}/'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_override_base_url(self):
+        client = httpclient.Client('test', 'https://example.invalid/api/')
+        httpclient.override_base_url('test', self.base_url)
+        response = client.get('hello', params={'q': 'x'})
+        assert response.status_code == 200
+        assert response.text == settings.user_agent
+        assert _Handler.requests == ['/hello?q=x'], _Handler.requests
+
+    def test_retry(self):
+        client = httpclient.Client('test', self.base_url, retries=2)
+        response = client.get('unavailable')
+        assert response.status_code == 200
+        assert len(_Handler.requests) == 3, _Handler.requests
+
+        _Handler.unavailable_count = 0
+        client = httpclient.Client('test', self.base_url, retries=1)
+        response = client.get('unavailable')
+        assert response.status_code == 503
+
+    def test_circuit_breaker(self):
+        client = httpclient.Client('test', self.base_url, retries=0)
+        for _i in range(httpclient.FAILURE_THRESHOLD):
+            _Handler.unavailable_count = 0
+            assert client.get('unavailable').status_code == 503
+        assert client.is_open
+
+        try:
+            client.get('hello')
+            assert False, 'request should be rejected'
+        except httpclient.CircuitOpenError:
+            pass
+        assert len(_Handler.requests) == httpclient.FAILURE_THRESHOLD
+        assert client.rejected == 1
+
+        # after some time, a single request is allowed to test whether the service has recovered
+        client.open_until = 0
+        assert client.get('hello').status_code == 200
+        assert not client.is_open
+        assert client.consecutive_failures == 0
+
+    def test_rate_limiter(self):
+        limiter = httpclient.RateLimiter(20, burst=2)
+        start_time = time.monotonic()
+        threads = [Thread(target=limiter.acquire) for _i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # 2 tokens are available immediately, the other 4 take 1/20 second each
+        duration = time.monotonic() - start_time
+        assert 0.18 < duration < 0.5, duration
@@ -14,3 +14,14 @@ class TestMetadata(TestCase):
 
     def test_sort(self):
         assert metadata.sort_artists(['A', 'B'], 'B') == ['B', 'A']
+
+    def test_album_key(self):
+        def meta(artists: list[str], album: str | None, album_artist: str | None):
+            return metadata.Metadata('test/test.mp3', 180, artists, album, 'title', None, album_artist, None, [], None, None)
+
+        key = meta(['Red Hot Chili Peppers'], 'Californication', None).album_key()
+        assert key == meta(['Red Hot Chili Peppers', 'Other'], 'CALIFORNICATION ', 'Red Hot Chili Peppers').album_key(), key
+        assert key != meta(['Red Hot Chili Peppers'], 'By the Way', None).album_key()
+        # compilation
+        assert meta(['A'], 'Hits', 'Various Artists').album_key() == meta(['B'], 'Hits', 'Various Artists').album_key()
+        assert meta(['A'], None, None).album_key() is None
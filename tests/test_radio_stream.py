@@ -0,0 +1,55 @@
+import io
+import struct
+from unittest import TestCase
+
+from raphson_mp import radio_stream
+
+
+def _ogg_page(header_type: int, segments: list[int], body: bytes) -> bytes:
+    return (b'OggS\x00' + bytes([header_type]) + struct.pack('<qIII', 0, 1234, 0, 0) +
+            bytes([len(segments)]) + bytes(segments) + body)
+
+
+def _pages() -> list[bytes]:
+    head = b'OpusHead\x01\x02' + struct.pack('<HIhB', 312, 48000, 0, 0)
+    # OpusTags packet spanning two pages, the first page ends with a 255 byte segment
+    tags = b'OpusTags' + bytes(400)
+    return [_ogg_page(0x02, [len(head)], head),
+            _ogg_page(0x00, [255], tags[:255]),
+            _ogg_page(0x01, [len(tags) - 255], tags[255:]),
+            _ogg_page(0x00, [100], bytes(100)),
+            _ogg_page(0x00, [255, 10], bytes(265)),
+            _ogg_page(0x05, [20], bytes(20))]  # continued audio packet, end of stream
+
+
+class TestRadioStream(TestCase):
+    def test_read_page(self):
+        pages = _pages()
+        stream = io.BytesIO(b''.join(pages))
+        for page in pages:
+            assert radio_stream._read_page(stream) == page
+        assert radio_stream._read_page(stream) is None
+        # truncated page
+        assert radio_stream._read_page(io.BytesIO(pages[1][:100])) is None
+
+    def test_headers(self):
+        stream = radio_stream.RadioStream()
+        pages = _pages()
+        for page in pages:
+            stream._add_page(page)
+        assert stream.headers == b''.join(pages[:3])
+        assert list(stream.pages) == [(1, pages[3]), (2, pages[4]), (3, pages[5])]
+
+    def test_listener_limit(self):
+        stream = radio_stream.RadioStream()
+        listeners = [stream.listen() for _i in range(radio_stream.MAX_LISTENERS)]
+        assert None not in listeners
+        assert stream.listen() is None
+
+        # a listener that was never iterated still releases its slot
+        listener = listeners.pop()
+        assert listener is not None
+        listener.close()
+        listener.close()
+        assert stream.listeners == radio_stream.MAX_LISTENERS - 1
+        assert stream.listen() is not None
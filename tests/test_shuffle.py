@@ -0,0 +1,40 @@
+from unittest import TestCase
+
+from raphson_mp.shuffle import ShuffleBag
+
+
+def _bag() -> ShuffleBag:
+    paths = [f'test/{i}.mp3' for i in range(8)]
+    last_chosen = [0, 0, 0, 0, 100, 100, 100, 100]
+    tags = {'Rock': [0, 1, 4], 'Pop': [2, 5]}
+    return ShuffleBag('test', 0, paths, last_chosen, tags, [0, 2, 4, 6])
+
+
+class TestShuffle(TestCase):
+    def test_least_recently_chosen(self):
+        bag = _bag()
+        # playlist has 8 tracks, so choose from the 8 // 4 + 1 = 3 least recently chosen tracks
+        path, last_chosen = bag.choose()
+        assert path in {'test/0.mp3', 'test/1.mp3', 'test/2.mp3', 'test/3.mp3'}, path
+        assert last_chosen == 0
+        assert bag.last_chosen[bag.indices[path]] > 100
+
+    def test_tags(self):
+        for _i in range(20):
+            path, _last_chosen = _bag().choose(allow_tags=['rock'])
+            assert path in {'test/0.mp3', 'test/1.mp3', 'test/4.mp3'}, path
+
+            path, _last_chosen = _bag().choose(deny_tags=['rock', 'POP'])
+            assert path in {'test/3.mp3', 'test/6.mp3', 'test/7.mp3'}, path
+
+        assert _bag().choose(allow_tags=['missing']) is None
+
+    def test_metadata_exclude(self):
+        for _i in range(20):
+            path, _last_chosen = _bag().choose(require_metadata=True, exclude=['test/0.mp3', 'test/missing.mp3'])
+            assert path in {'test/2.mp3', 'test/4.mp3', 'test/6.mp3'}, path
+
+    def test_all_chosen(self):
+        bag = _bag()
+        chosen = {bag.choose()[0] for _i in range(8)}
+        assert len(chosen) >= 4, chosen
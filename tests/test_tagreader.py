@@ -0,0 +1,163 @@
+import io
+import struct
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from raphson_mp import tagreader
+
+
+def _id3_frame(frame_id: bytes, text: str) -> bytes:
+    data = b'\x03' + text.encode()  # utf-8
+    return frame_id + struct.pack('>I', len(data)) + b'\x00\x00' + data
+
+
+def _mp3() -> bytes:
+    frames = (_id3_frame(b'TIT2', 'Title') +
+              _id3_frame(b'TPE1', 'Artist 1\x00Artist 2') +
+              _id3_frame(b'TRCK', '3/10') +
+              b'USLT' + struct.pack('>I', 11) + b'\x00\x00' + b'\x00eng\x00Lyrics')
+    tag = b'ID3\x03\x00\x00' + bytes([0, 0, len(frames) >> 7, len(frames) & 0x7f]) + frames
+    # MPEG 1 layer 3, 128kbps, 44100Hz, stereo: 417 bytes per frame
+    header = b'\xff\xfb\x90\x00'
+    xing = header + bytes(32) + b'Xing' + struct.pack('>II', 1, 1000)
+    frame = header + bytes(413)
+    return tag + xing + bytes(417 - len(xing)) + frame * 4
+
+
+def _vorbis_comment(comments: list[str]) -> bytes:
+    data = struct.pack('<I', 6) + b'vendor' + struct.pack('<I', len(comments))
+    for comment in comments:
+        data += struct.pack('<I', len(comment.encode())) + comment.encode()
+    return data
+
+
+def _flac() -> bytes:
+    # 44100Hz, 441000 samples
+    streaminfo = bytes(10) + bytes([0x0a, 0xc4, 0x40, 0x00]) + struct.pack('>I', 441000) + bytes(16)
+    comment = _vorbis_comment(['TITLE=Title', 'ARTIST=Artist 1', 'ARTIST=Artist 2', 'ALBUMARTIST=Album artist'])
+    return (b'fLaC' +
+            bytes([0]) + len(streaminfo).to_bytes(3, 'big') + streaminfo +
+            bytes([0x84]) + len(comment).to_bytes(3, 'big') + comment)
+
+
+def _ogg_page(header_type: int, granule: int, packet: bytes) -> bytes:
+    lacing = [255] * (len(packet) // 255) + [len(packet) % 255]
+    return (b'OggS\x00' + bytes([header_type]) + struct.pack('<qIII', granule, 1234, 0, 0) +
+            bytes([len(lacing)]) + bytes(lacing) + packet)
+
+
+def _opus() -> bytes:
+    head = b'OpusHead\x01\x02' + struct.pack('<HIhB', 312, 48000, 0, 0)
+    tags = b'OpusTags' + _vorbis_comment(['title=Title', 'LYRICS=' + 'la ' * 200])
+    return (_ogg_page(0x02, 0, head) +
+            _ogg_page(0x00, 0, tags) +
+            _ogg_page(0x04, 48000 * 5 + 312, bytes(100)))
+
+
+def _atom(atom_type: bytes, data: bytes) -> bytes:
+    return struct.pack('>I', len(data) + 8) + atom_type + data
+
+
+def _mp4() -> bytes:
+    mvhd = _atom(b'mvhd', bytes(12) + struct.pack('>II', 1000, 12500) + bytes(80))
+    ilst = _atom(b'ilst',
+                 _atom(b'\xa9nam', _atom(b'data', struct.pack('>II', 1, 0) + b'Title')) +
+                 _atom(b'trkn', _atom(b'data', struct.pack('>II', 0, 0) + struct.pack('>HHHH', 0, 2, 0, 0))))
+    meta = _atom(b'meta', bytes(4) + _atom(b'hdlr', bytes(25)) + ilst)
+    stsd = _atom(b'stsd', bytes(8) + _atom(b'avc1', bytes(8)))
+    trak = _atom(b'trak', _atom(b'mdia', _atom(b'hdlr', bytes(8) + b'vide' + bytes(12)) +
+                                         _atom(b'minf', _atom(b'stbl', stsd))))
+    return (_atom(b'ftyp', b'M4A \x00\x00\x00\x00') +
+            _atom(b'mdat', bytes(1000)) +
+            _atom(b'moov', mvhd + trak + _atom(b'udta', meta)))
+
+
+def _ebml(element_id: int, data: bytes) -> bytes:
+    id_bytes = element_id.to_bytes((element_id.bit_length() + 7) // 8, 'big')
+    # 8 byte size
+    return id_bytes + b'\x01' + len(data).to_bytes(7, 'big') + data
+
+
+def _webm() -> bytes:
+    info = _ebml(0x1549A966, _ebml(0x2AD7B1, (1000000).to_bytes(3, 'big')) + _ebml(0x4489, struct.pack('>d', 61500.0)))
+    tracks = _ebml(0x1654AE6B,
+                   _ebml(0xAE, _ebml(0x73C5, b'\x01') + _ebml(0x83, b'\x01') + _ebml(0x86, b'V_VP9')) +
+                   _ebml(0xAE, _ebml(0x73C5, b'\x02') + _ebml(0x83, b'\x02') + _ebml(0x86, b'A_OPUS')))
+    cluster = _ebml(0x1F43B675, bytes(100))
+    tags = _ebml(0x1254C367,
+                 _ebml(0x7373, _ebml(0x63C0, b'') + _ebml(0x67C8, _ebml(0x45A3, b'TITLE') + _ebml(0x4487, b'Title'))) +
+                 _ebml(0x7373, _ebml(0x63C0, _ebml(0x63C5, b'\x02')) + _ebml(0x67C8, _ebml(0x45A3, b'ARTIST') + _ebml(0x4487, b'Artist'))) +
+                 _ebml(0x7373, _ebml(0x63C0, _ebml(0x63C5, b'\x01')) + _ebml(0x67C8, _ebml(0x45A3, b'ENCODER') + _ebml(0x4487, b'x'))))
+    # Tags after cluster, must be found using seek head
+    tags_position = len(info) + len(tracks) + len(cluster)
+    seek = _ebml(0x4DBB, _ebml(0x53AB, (0x1254C367).to_bytes(4, 'big')) + _ebml(0x53AC, b'\x00\x00'))
+    seek_head_size = len(_ebml(0x114D9B74, seek))
+    seek = _ebml(0x4DBB, _ebml(0x53AB, (0x1254C367).to_bytes(4, 'big')) + _ebml(0x53AC, (seek_head_size + tags_position).to_bytes(2, 'big')))
+    segment = _ebml(0x114D9B74, seek) + info + tracks + cluster + tags
+    return _ebml(0x1A45DFA3, _ebml(0x4282, b'webm')) + _ebml(0x18538067, segment)
+
+
+class TestTagReader(TestCase):
+    def test_mp3(self):
+        result = tagreader.read(io.BytesIO(_mp3()))
+        assert abs(result.duration - 1000 * 1152 / 44100) < 0.01, result.duration
+        assert result.tags == [('title', 'Title'),
+                               ('artist', 'Artist 1;Artist 2'),
+                               ('track', '3/10'),
+                               ('lyrics-eng', 'Lyrics')], result.tags
+        assert result.video_codecs == []
+
+    def test_flac(self):
+        result = tagreader.read(io.BytesIO(_flac()))
+        assert result.duration == 10
+        assert result.tags == [('TITLE', 'Title'),
+                               ('ARTIST', 'Artist 1;Artist 2'),
+                               ('album_artist', 'Album artist')], result.tags
+
+    def test_opus(self):
+        result = tagreader.read(io.BytesIO(_opus()))
+        assert result.duration == 5
+        assert result.tags == [('TITLE', 'Title'), ('LYRICS', 'la ' * 200)], result.tags
+
+    def test_mp4(self):
+        result = tagreader.read(io.BytesIO(_mp4()))
+        assert result.duration == 12.5
+        assert result.tags == [('title', 'Title'), ('track', '2')], result.tags
+        assert result.video_codecs == ['h264']
+
+    def test_webm(self):
+        result = tagreader.read(io.BytesIO(_webm()))
+        assert result.duration == 61.5
+        assert result.tags == [('ARTIST', 'Artist'), ('TITLE', 'Title')], result.tags
+        assert result.video_codecs == ['vp9']
+
+    def test_cover(self):
+        assert not tagreader.read(io.BytesIO(_mp3())).cover
+        apic = b'APIC' + struct.pack('>I', 20) + b'\x00\x00' + b'\x00image/png\x00\x03\x00' + bytes(8)
+        mp3 = _mp3()
+        tag_size = 10 + (mp3[8] << 7 | mp3[9])
+        frames = mp3[10:tag_size] + apic
+        tag = b'ID3\x03\x00\x00' + bytes([0, 0, len(frames) >> 7, len(frames) & 0x7f]) + frames
+        assert tagreader.read(io.BytesIO(tag + mp3[tag_size:])).cover
+
+        assert not tagreader.read(io.BytesIO(_flac())).cover
+        picture = bytes(32)
+        flac = bytearray(_flac())
+        flac[4 + 4 + 34] &= 0x7f  # comment block is no longer the last block
+        flac += bytes([0x86]) + len(picture).to_bytes(3, 'big') + picture
+        assert tagreader.read(io.BytesIO(bytes(flac))).cover
+
+    def test_short_mp3(self):
+        # Seeking before the start of a real file raises OSError, unlike BytesIO
+        with tempfile.NamedTemporaryFile() as temp_file:
+            temp_file.write(b'\xff\xfb\x90\x00' + bytes(40))
+            temp_file.flush()
+            result = tagreader.read_file(Path(temp_file.name))
+        assert result.tags == []
+
+    def test_unsupported(self):
+        with self.assertRaises(tagreader.UnsupportedFile):
+            tagreader.read(io.BytesIO(b'RIFF' + bytes(100)))
+        with self.assertRaises(tagreader.UnsupportedFile):
+            tagreader.read(io.BytesIO(_flac()[:50]))